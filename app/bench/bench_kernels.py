@@ -0,0 +1,115 @@
+"""
+Micro-benchmark of the vector scoring kernels (app/shared/kernels.py)
+
+Compares, on random float32 matrices of several sizes:
+- legacy: the float64 scalar-loop numba kernels the search used before (plain range, so numba never parallelized them)
+- prange: the prange/fastmath numba kernels
+- blas: the numpy/BLAS kernels
+- auto: the dispatcher the app uses (picks prange or blas by matrix size, see KERNEL_BLAS_MIN_SIZE)
+
+Usage:
+    python bench_kernels.py
+    python bench_kernels.py --rows 1000 31000 100000 --dim 256 --batch 32 --repeat 20
+"""
+import os, sys, argparse, time
+import numpy as np
+from numba import njit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from shared import kernels
+
+"""
+======================================================= LEGACY KERNELS =======================================================
+"""
+@njit(parallel=True)
+def legacy_l2_distance_numba(search_vector, verse_vectors) -> np.ndarray:
+    similarities = np.zeros(len(verse_vectors))
+    for i in range(len(verse_vectors)):
+        cur_vector = verse_vectors[i]
+        distance = 0
+        for j in range(len(search_vector)):
+            distance += (search_vector[j] - cur_vector[j]) ** 2
+        similarities[i] = np.sqrt(distance)
+    return similarities
+
+
+@njit(parallel=True)
+def legacy_cosine_distance_numba(search_vector, verse_vectors) -> np.ndarray:
+    similarities = np.zeros(len(verse_vectors))
+    for i in range(len(verse_vectors)):
+        cur_vector = verse_vectors[i]
+        dot_product = 0
+        norm_a = 0
+        norm_b = 0
+        for j in range(len(search_vector)):
+            dot_product += search_vector[j] * cur_vector[j]
+            norm_a += search_vector[j] ** 2
+            norm_b += cur_vector[j] ** 2
+        norm_a = np.sqrt(norm_a)
+        norm_b = np.sqrt(norm_b)
+        similarities[i] = 1 - dot_product / (norm_a * norm_b)
+    return similarities
+
+
+"""
+======================================================= BENCHMARK =======================================================
+"""
+def timeit(function, repeat: int) -> float:
+    """
+    Returns the median runtime of function() in milliseconds (after one warm-up call)
+    """
+    function()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return 1000 * float(np.median(times))
+
+
+def bench(rows: int, dim: int, batch: int, repeat: int) -> None:
+    rng = np.random.default_rng(0)
+    matrix = rng.normal(size=(rows, dim)).astype(np.float32)
+    normalized = kernels.normalize_rows(matrix)
+    query = rng.normal(size=dim).astype(np.float32)
+    queries = rng.normal(size=(batch, dim)).astype(np.float32)
+    quantized, scales = kernels.quantize_embeddings(normalized, "int8")
+
+    # The legacy search converted the embeddings to a float64 array
+    matrix64, query64 = matrix.astype(np.float64), query.astype(np.float64)
+
+    results = {
+        "cosine legacy (float64)": timeit(lambda: legacy_cosine_distance_numba(query64, matrix64), repeat),
+        "cosine prange": timeit(lambda: kernels.cosine_prange(matrix, query), repeat),
+        "cosine blas": timeit(lambda: kernels.cosine_blas(matrix, query), repeat),
+        "dot prange (normalized)": timeit(lambda: kernels.dot_prange(normalized, query), repeat),
+        "dot blas (normalized)": timeit(lambda: kernels.dot_blas(normalized, query), repeat),
+        "dot auto (normalized)": timeit(lambda: kernels.dot_scores(normalized, query), repeat),
+        "int8 dot prange": timeit(lambda: kernels.int8_dot_prange(quantized, scales, query), repeat),
+        "l2 legacy (float64)": timeit(lambda: legacy_l2_distance_numba(query64, matrix64), repeat),
+        "l2 prange": timeit(lambda: kernels.l2_prange(matrix, query), repeat),
+        "l2 blas": timeit(lambda: kernels.l2_blas(matrix, query), repeat),
+        f"{batch} queries: legacy loop": timeit(lambda: [legacy_cosine_distance_numba(q.astype(np.float64), matrix64) for q in queries], max(1, repeat // 4)),
+        f"{batch} queries: dot prange batch": timeit(lambda: kernels.dot_batch_prange(normalized, queries), max(1, repeat // 4)),
+        f"{batch} queries: dot blas batch": timeit(lambda: kernels.dot_blas(normalized, queries), max(1, repeat // 4)),
+    }
+
+    baseline = results["cosine legacy (float64)"]
+    print(f"\n{rows} rows x {dim} dims (dot auto uses {'blas' if kernels.use_blas(normalized) else 'prange'})")
+    print(f"{'kernel':<36} {'ms':>9} {'vs legacy cosine':>17}")
+    for name, ms in results.items():
+        print(f"{name:<36} {ms:>9.3f} {baseline / ms:>16.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the vector scoring kernels")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000, 10_000, 31_102, 100_000])
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--batch", type=int, default=16)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    import numba
+    print(f"numba {numba.__version__}, threads: {numba.get_num_threads()}, threading layer: {numba.config.THREADING_LAYER}")
+    for rows in args.rows:
+        bench(rows, args.dim, args.batch, args.repeat)
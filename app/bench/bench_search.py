@@ -0,0 +1,346 @@
+"""
+Benchmark of the Bible search pipeline on a synthetic corpus (no Bible files or GCP credentials needed)
+
+It generates a synthetic Bible version of configurable size and dimensionality in a temporary directory, replaces
+the Vertex AI embedding call with a deterministic local embedder and reports:
+- per-stage timings of a search: load, embed (cache miss / hit), score, top-k, context, log, serialize
+- throughput and latency percentiles of /api/bible/search under concurrent requests (in-process, through the ASGI app)
+
+The app still needs app/shared/env.json to import (the secrets are read but never used). The search logs and the
+embedding cache are written to a throw-away SQLite database in the temporary directory.
+
+Save a run with --save and compare a later run against it with --compare to catch regressions before deploying
+(the script exits with status 1 when a stage got slower than the tolerance).
+
+Usage:
+    python bench_search.py
+    python bench_search.py --verses 31102 --dim 256 --queries 200 --concurrency 1 8 32 --requests 500
+    python bench_search.py --format json --storage float32
+    python bench_search.py --save baseline.json
+    python bench_search.py --compare baseline.json --tolerance 0.25
+"""
+import os, sys, argparse, asyncio, hashlib, json, tempfile, time
+import numpy as np
+from typing import Any, Dict, List
+
+app_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, app_dir)
+
+"""
+======================================================= CONFIG =======================================================
+"""
+SYNTHETIC_VERSION = "synthetic"
+VERSES_PER_CHAPTER = 25
+CHAPTERS_PER_BOOK = 30
+WORDS_PER_VERSE = (8, 30)
+VOCABULARY = (
+    "love faith hope grace mercy peace light darkness water bread wine shepherd sheep king kingdom heaven earth "
+    "spirit truth life death sin law covenant temple prayer fear joy sorrow brother father son mother servant lord "
+    "mountain river sea fire wind stone tree fruit seed harvest word voice people nation city house gate way path "
+    "strength wisdom glory power judgment righteous wicked poor rich widow stranger enemy friend blood cross crown"
+).split()
+QUERY_WORDS = (1, 6)
+
+
+"""
+======================================================= SYNTHETIC CORPUS =======================================================
+"""
+class LocalEmbedder:
+    """
+    Deterministic stand-in for the Vertex AI embedding model: a text embeds to the sum of one fixed random vector
+    per word (seeded by the word), so texts sharing words get similar embeddings and searches return sensible verses
+    - dimensionality: The dimensionality of the embeddings
+    """
+    def __init__(self, dimensionality: int):
+        self.dimensionality = dimensionality
+        self.word_vectors: Dict[str, np.ndarray] = {}
+
+    def word_vector(self, word: str) -> np.ndarray:
+        if word not in self.word_vectors:
+            seed = int.from_bytes(hashlib.sha256(word.encode()).digest()[:8], "little")
+            self.word_vectors[word] = np.random.default_rng(seed).normal(size=self.dimensionality).astype(np.float32)
+        return self.word_vectors[word]
+
+    def embed(self, text: str) -> List[float]:
+        words = text.lower().split() or [""]
+        return np.sum([self.word_vector(word) for word in words], axis=0).tolist()
+
+    async def get_text_embeddings_async(self, texts: List[str], task: str = "RETRIEVAL_QUERY", model_name: str = "text-embedding-004", dimensionality: int = 256) -> List[List[float]]:
+        """
+        Same signature as shared.bible.get_text_embeddings_async (task, model_name and dimensionality are ignored)
+        """
+        return [self.embed(text) for text in texts]
+
+
+def generate_bible(n_verses: int, embedder: LocalEmbedder, seed: int = 0) -> Dict[str, Any]:
+    """
+    Generate a synthetic Bible in the formatted {version}.json layout (see app/bible/format_bible.py)
+    - n_verses: The number of verses
+    - embedder: The embedder used for the verse embeddings
+    - seed: The random seed of the verse texts
+
+    Returns the Bible ({"metadata": {...}, "verses": [...]})
+    """
+    rng = np.random.default_rng(seed)
+    verses = []
+    for i in range(n_verses):
+        chapter_index, verse_index = divmod(i, VERSES_PER_CHAPTER)
+        book_index, chapter_index = divmod(chapter_index, CHAPTERS_PER_BOOK)
+        text = " ".join(rng.choice(VOCABULARY, rng.integers(*WORDS_PER_VERSE)))
+        verses.append({
+            "book_name": f"Book {book_index + 1}",
+            "book": book_index + 1,
+            "chapter": chapter_index + 1,
+            "verse": verse_index + 1,
+            "text": text,
+            "embedding": embedder.embed(text),
+        })
+    return {"metadata": {"name": "Synthetic Bible", "shortname": SYNTHETIC_VERSION}, "verses": verses}
+
+
+def generate_queries(n_queries: int, seed: int = 1) -> List[str]:
+    """
+    Generate distinct synthetic search texts (different seeds never repeat a text, so every run starts with cache misses)
+
+    Returns a list of search texts
+    """
+    rng = np.random.default_rng(seed)
+    return [f"{' '.join(rng.choice(VOCABULARY, rng.integers(*QUERY_WORDS)))} {seed}-{i}" for i in range(n_queries)]
+
+
+"""
+======================================================= STAGE TIMINGS =======================================================
+"""
+def summarize(times: List[float]) -> Dict[str, float]:
+    """
+    Summarize a list of durations (seconds)
+
+    Returns {"n", "mean_ms", "p50_ms", "p95_ms", "p99_ms"}
+    """
+    ms = 1000 * np.asarray(times)
+    return {
+        "n": len(ms),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+    }
+
+
+async def bench_stages(bible, queries: List[str], max_results: int, context_size: int, load_repeat: int) -> Dict[str, Dict[str, float]]:
+    """
+    Time each stage of a search (the same steps as shared.bible.search_bible_async, called one by one)
+    - bible: The shared.bible module (with the synthetic corpus and the local embedder installed)
+    - queries: The search texts
+    - max_results: The number of verses per search
+    - context_size: The number of context verses before and after each verse
+    - load_repeat: The number of cold loads of the version
+
+    Returns {stage: summary}
+    """
+    from db.log_writer import log_writer
+    from shared.kernels import top_k, score_quantized, dot_scores, normalize_rows
+
+    stages: Dict[str, List[float]] = {stage: [] for stage in ["load", "embed (miss)", "embed (hit)", "score", "top-k", "search (score + top-k)", "context", "log", "serialize"]}
+
+    def timed(stage: str, function, *args, **kwargs):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        stages[stage].append(time.perf_counter() - start)
+        return result
+
+    async def timed_async(stage: str, function, *args, **kwargs):
+        start = time.perf_counter()
+        result = await function(*args, **kwargs)
+        stages[stage].append(time.perf_counter() - start)
+        return result
+
+    for _ in range(load_repeat):
+        bible.version_store.clear()
+        index = timed("load", bible.load_bible_index, SYNTHETIC_VERSION)
+
+    bible.embedding_cache.clear()
+    for search_text in queries:
+        embedding = (await timed_async("embed (miss)", bible.get_cached_text_embeddings_async, [search_text], "RETRIEVAL_QUERY"))[0]
+        await timed_async("embed (hit)", bible.get_cached_text_embeddings_async, [search_text], "RETRIEVAL_QUERY")
+
+        # Score and top-k are timed separately with the same steps as BibleIndex.search (exact mode)
+        query = normalize_rows(np.asarray(embedding, dtype=np.float32))
+        if index.quantized is not None:
+            scores = timed("score", score_quantized, index.quantized, index.scales, query)
+            def select():
+                candidates = np.sort(top_k(scores, max_results * bible.RERANK_FACTOR))
+                similarities = dot_scores(index.embeddings[candidates], query)
+                best = top_k(similarities, max_results)
+                return candidates[best], similarities[best]
+            rows, similarities = timed("top-k", select)
+        else:
+            scores = timed("score", dot_scores, index.embeddings, query)
+            rows = timed("top-k", top_k, scores, max_results)
+            similarities = scores[rows]
+        timed("search (score + top-k)", index.search, embedding, max_results)
+
+        verses = timed("context", bible.build_bible_verses, index, rows, similarities, True, context_size)
+        timed("log", bible.log_bible_search, search_text, SYNTHETIC_VERSION, max_results, True, context_size, verses, 0.0)
+        timed("serialize", bible.bible_verses_adapter.dump_json, verses)  # As cached by search_bible_json_async
+
+    # The searches only queue their log rows, the background writer inserts them in batches
+    start = time.perf_counter()
+    log_writer.flush()
+    stages["log flush (per row)"] = [(time.perf_counter() - start) / len(queries)]
+
+    return {stage: summarize(times) for stage, times in stages.items()}
+
+
+"""
+======================================================= THROUGHPUT =======================================================
+"""
+async def bench_throughput(app, queries: List[str], concurrency: int, n_requests: int, max_results: int) -> Dict[str, float]:
+    """
+    Send search requests to the app (in-process, through httpx's ASGI transport) with a fixed number in flight
+    - app: The FastAPI app
+    - queries: The search texts (cycled)
+    - concurrency: The number of requests in flight
+    - n_requests: The total number of requests
+    - max_results: The number of verses per search
+
+    Returns the latency summary plus "requests_per_second" and "errors"
+    """
+    import httpx
+
+    latencies, errors = [], 0
+    semaphore = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        async def request(i: int) -> None:
+            nonlocal errors
+            params = {"search_text": queries[i % len(queries)], "bible_version": SYNTHETIC_VERSION, "max_results": max_results, "add_context": True}
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.get("/api/bible/search", params=params)
+                latencies.append(time.perf_counter() - start)
+                errors += response.status_code != 200
+
+        start = time.perf_counter()
+        await asyncio.gather(*[request(i) for i in range(n_requests)])
+        elapsed = time.perf_counter() - start
+
+    return {**summarize(latencies), "requests_per_second": n_requests / elapsed, "errors": errors}
+
+
+"""
+======================================================= REPORT =======================================================
+"""
+def print_report(results: Dict[str, Any]) -> None:
+    print(f"\nStages ({results['config']['verses']} verses x {results['config']['dim']} dims, {results['config']['format']}, storage={results['config']['storage']})")
+    print(f"{'stage':<26} {'n':>6} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for stage, row in results["stages"].items():
+        print(f"{stage:<26} {row['n']:>6} {row['mean_ms']:>9.3f} {row['p50_ms']:>9.3f} {row['p95_ms']:>9.3f} {row['p99_ms']:>9.3f}")
+
+    print("\nThroughput of GET /api/bible/search")
+    print(f"{'concurrency':<12} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for concurrency, row in results["throughput"].items():
+        print(f"{concurrency:<12} {row['requests_per_second']:>9.1f} {row['p50_ms']:>9.3f} {row['p95_ms']:>9.3f} {row['p99_ms']:>9.3f} {row['errors']:>7}")
+
+
+def compare_results(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """
+    Compare a run against a saved baseline
+    - results: The current run
+    - baseline: The saved run
+    - tolerance: The allowed relative slowdown (0.25 = 25%)
+
+    Returns a list of regressions (empty when none)
+    """
+    regressions = []
+    for stage, row in results["stages"].items():
+        if stage in baseline["stages"] and row["p50_ms"] > baseline["stages"][stage]["p50_ms"] * (1 + tolerance):
+            regressions.append(f"{stage}: p50 {baseline['stages'][stage]['p50_ms']:.3f}ms -> {row['p50_ms']:.3f}ms")
+    for concurrency, row in results["throughput"].items():
+        if concurrency in baseline["throughput"] and row["requests_per_second"] < baseline["throughput"][concurrency]["requests_per_second"] / (1 + tolerance):
+            regressions.append(f"concurrency {concurrency}: {baseline['throughput'][concurrency]['requests_per_second']:.1f} -> {row['requests_per_second']:.1f} req/s")
+    return regressions
+
+
+"""
+======================================================= MAIN =======================================================
+"""
+def main(args: argparse.Namespace) -> int:
+    # Everything the app writes (SQLite database, synthetic Bible) goes to a temporary directory
+    workdir = tempfile.mkdtemp(prefix="bench_search_")
+    os.chdir(workdir)
+    bible_dir = os.path.join(workdir, "bibles")
+    compiled_dir = os.path.join(bible_dir, "compiled")
+    os.makedirs(compiled_dir)
+
+    embedder = LocalEmbedder(args.dim)
+    print(f"Generating {args.verses} synthetic verses ({args.dim} dims) in {workdir}")
+    corpus = generate_bible(args.verses, embedder)
+    if args.format == "compiled":
+        from bible.compile_bible import write_compiled_bible
+        embeddings = np.array([verse.pop("embedding") for verse in corpus["verses"]], dtype=np.float32)
+        write_compiled_bible(compiled_dir, SYNTHETIC_VERSION, corpus["metadata"], corpus["verses"], embeddings)
+    else:
+        with open(os.path.join(bible_dir, f"{SYNTHETIC_VERSION}.json"), "w") as f:
+            json.dump(corpus, f)
+    del corpus
+
+    # Point the app at the synthetic corpus and the local embedder
+    import db.models
+    from db.controller import create_db_and_tables
+    from db.log_writer import log_writer
+    from shared import bible
+    from shared.kernels import compile_kernels
+    create_db_and_tables()
+    bible.bible_dir, bible.compiled_bible_dir, bible.all_bibles = bible_dir, compiled_dir, os.listdir(bible_dir)
+    bible.EMBEDDING_STORAGE = args.storage
+    bible.get_text_embeddings_async = embedder.get_text_embeddings_async
+
+    compile_kernels()  # Done by the warm-up when the app starts, keep the compilation out of the timings
+    queries = generate_queries(args.queries)
+    results = {"config": vars(args).copy(), "stages": asyncio.run(bench_stages(bible, queries, args.max_results, args.context_size, args.load_repeat)), "throughput": {}}
+
+    from main import app
+    log_writer.start()
+    for i, concurrency in enumerate(args.concurrency):
+        throughput_queries = generate_queries(args.requests, seed=2 + i)
+        results["throughput"][str(concurrency)] = asyncio.run(bench_throughput(app, throughput_queries, concurrency, args.requests, args.max_results))
+    log_writer.stop()
+
+    results["config"].pop("save"), results["config"].pop("compare")
+    print_report(results)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved {args.save}")
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare_results(results, json.load(f), args.tolerance)
+        print(f"\n{len(regressions)} regression(s) against {args.compare} (tolerance {args.tolerance:.0%})")
+        for regression in regressions:
+            print(f"- {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the Bible search pipeline on a synthetic corpus")
+    parser.add_argument("--verses", type=int, default=31_102, help="The number of synthetic verses (the KJV has 31,102)")
+    parser.add_argument("--dim", type=int, default=256, help="The embedding dimensionality")
+    parser.add_argument("--format", choices=["compiled", "json"], default="compiled", help="The on-disk format of the synthetic version")
+    parser.add_argument("--storage", choices=["float32", "float16", "int8"], default="int8", help="EMBEDDING_STORAGE for compiled versions")
+    parser.add_argument("--queries", type=int, default=200, help="The number of searches timed stage by stage")
+    parser.add_argument("--load-repeat", type=int, default=3, help="The number of cold loads timed")
+    parser.add_argument("--max-results", type=int, default=5)
+    parser.add_argument("--context-size", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32], help="The concurrency levels of the throughput test")
+    parser.add_argument("--requests", type=int, default=300, help="The number of requests per concurrency level")
+    parser.add_argument("--save", default=None, help="Save the results to this JSON file")
+    parser.add_argument("--compare", default=None, help="Compare the results against this saved JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="The allowed relative slowdown when comparing")
+    args = parser.parse_args()
+    if args.save:
+        args.save = os.path.abspath(args.save)
+    if args.compare:
+        args.compare = os.path.abspath(args.compare)
+    sys.exit(main(args))
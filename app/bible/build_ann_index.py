@@ -0,0 +1,69 @@
+"""
+One off script to build the approximate nearest neighbor (ANN) index of the compiled Bible versions
+
+Input: app/shared/bibles/compiled/{version}.embeddings.npy (see compile_bible.py)
+Output: app/shared/bibles/compiled/{version}.ann.npz, loaded by the app for search_mode=approx
+
+It also prints a recall@k report against the exact search for a range of nprobe values so you can pick the
+default with confidence. The report uses verse embeddings with added noise as stand-in queries (no API calls).
+
+Usage:
+    python build_ann_index.py kjv
+    python build_ann_index.py kjv --n-lists 512 --nprobe 16 --k 10 --queries 500
+"""
+import os, sys, argparse, time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from shared.ann import IVFIndex, recall_report
+
+compiled_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../shared/bibles/compiled")
+
+ANN_SUFFIX = ".ann.npz"
+
+
+def build_ann_index(version: str, n_lists: int = None, nprobe: int = 16, k: int = 10, n_queries: int = 200, noise: float = 0.5) -> None:
+    """
+    Build, evaluate and save the IVF index of a compiled Bible version
+    - version: The Bible version name
+    - n_lists: The number of clusters (default 4 * sqrt(n_verses))
+    - nprobe: The default number of clusters scanned per query, saved with the index
+    - k: The k of the recall@k report
+    - n_queries: The number of stand-in queries in the report
+    - noise: The standard deviation (relative to a unit vector) of the noise added to the stand-in queries
+    """
+    embeddings = np.load(os.path.join(compiled_dir, f"{version}.embeddings.npy"), mmap_mode="r")
+    embeddings = np.ascontiguousarray(embeddings)
+    print(f"Building IVF index for {version}: {embeddings.shape[0]} verses, {embeddings.shape[1]} dims")
+
+    start = time.time()
+    index = IVFIndex.build(embeddings, n_lists=n_lists, nprobe=nprobe)
+    print(f"Built {index.n_lists} lists in {time.time() - start:.2f}s")
+
+    # Stand-in queries: random verses pushed away from their own embedding
+    rng = np.random.default_rng(0)
+    queries = embeddings[rng.choice(len(embeddings), min(n_queries, len(embeddings)), replace=False)]
+    queries = queries + rng.normal(scale=noise / np.sqrt(embeddings.shape[1]), size=queries.shape).astype(np.float32)
+    queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+    settings = [{"nprobe": p} for p in sorted({1, 2, 4, 8, 16, 32, 64, nprobe}) if p <= index.n_lists]
+    print(f"{'nprobe':>8} {f'recall@{k}':>10} {'avg ms':>8} {'exact ms':>9}")
+    for row in recall_report(index, embeddings, queries, k, settings):
+        print(f"{row['setting']['nprobe']:>8} {row['recall_at_k']:>10.3f} {row['avg_ms']:>8.3f} {row['exact_avg_ms']:>9.3f}")
+
+    output_path = os.path.join(compiled_dir, f"{version}{ANN_SUFFIX}")
+    index.save(output_path)
+    print(f"Saved {output_path} (default nprobe={nprobe})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the ANN index of a compiled Bible version")
+    parser.add_argument("versions", nargs="+", help="The Bible versions to index")
+    parser.add_argument("--n-lists", type=int, default=None, help="The number of clusters (default 4 * sqrt(n_verses))")
+    parser.add_argument("--nprobe", type=int, default=16, help="The default number of clusters scanned per query")
+    parser.add_argument("--k", type=int, default=10, help="The k of the recall@k report")
+    parser.add_argument("--queries", type=int, default=200, help="The number of stand-in queries in the report")
+    args = parser.parse_args()
+
+    for version in args.versions:
+        build_ann_index(version, args.n_lists, args.nprobe, args.k, args.queries)
@@ -0,0 +1,107 @@
+"""
+One off script to compile the formatted Bible versions into the binary format loaded by the app
+
+Input: the formatted {version}.json files (see format_bible.py), i.e.
+{
+    "metadata": {...},
+    "verses": [
+        {
+            "book_name": {{book_name}},
+            "book": {{book_number}},
+            "chapter": {{chapter}},
+            "verse": {{verse}},
+            "text": {{text}},
+            "embedding": [...]
+        },
+        ...
+    ]
+}
+
+Output (per version, in app/shared/bibles/compiled):
+- {version}.embeddings.npy: float32 matrix [n_verses, dimensionality] with every row L2-normalized
+- {version}.verses.json: compact {"metadata": {...}, "verses": [...]} with the verse records minus the embeddings
+
+Row i of the embedding matrix belongs to verses[i]. The app memory-maps the .npy file (np.load(mmap_mode="r")),
+so every worker process shares the same pages through the OS cache instead of parsing the JSON.
+
+Usage:
+    python compile_bible.py                                 # compiles every app/shared/bibles/*.json
+    python compile_bible.py --input formatted_versions      # compiles every formatted_versions/*.json
+    python compile_bible.py --input ../shared/bibles/kjv.json
+"""
+import os, sys, json, argparse, time
+import numpy as np
+from typing import List, Dict, Any
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from shared.kernels import normalize_rows  # The same normalization as the app's, so compiled rows match it exactly
+
+default_input_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../shared/bibles")
+default_output_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../shared/bibles/compiled")
+
+EMBEDDINGS_SUFFIX = ".embeddings.npy"
+VERSES_SUFFIX = ".verses.json"
+
+
+def write_compiled_bible(output_dir: str, version: str, metadata: Dict[str, Any], verses: List[Dict[str, Any]], embeddings: np.ndarray) -> None:
+    """
+    Write a Bible version in the compiled format
+    - output_dir: The directory to write the files to
+    - version: The Bible version name (used for the file names)
+    - metadata: The metadata block of the Bible
+    - verses: The verse records, without embeddings, in the same order as the embedding rows
+    - embeddings: The verse embeddings [n_verses, dimensionality]
+
+    The files are written to a temporary name and then renamed, so a running app never sees a half written file
+    """
+    if len(verses) != len(embeddings):
+        raise ValueError(f"{version}: {len(verses)} verses but {len(embeddings)} embeddings")
+    os.makedirs(output_dir, exist_ok=True)
+
+    embeddings_path = os.path.join(output_dir, f"{version}{EMBEDDINGS_SUFFIX}")
+    verses_path = os.path.join(output_dir, f"{version}{VERSES_SUFFIX}")
+
+    with open(f"{embeddings_path}.tmp", "wb") as f:
+        np.save(f, normalize_rows(embeddings))
+    with open(f"{verses_path}.tmp", "w") as f:
+        json.dump({"metadata": metadata, "verses": verses}, f, separators=(",", ":"))
+
+    os.replace(f"{embeddings_path}.tmp", embeddings_path)
+    os.replace(f"{verses_path}.tmp", verses_path)
+
+
+def compile_bible(input_path: str, output_dir: str = default_output_dir) -> None:
+    """
+    Compile a single formatted {version}.json Bible
+    - input_path: The path to the formatted Bible JSON file
+    - output_dir: The directory to write the compiled files to
+    """
+    version = os.path.basename(input_path).replace(".json", "")
+    start = time.time()
+    print(f"Loading Bible version: {version}")
+    with open(input_path, "r") as f:
+        bible = json.load(f)
+
+    verses = bible["verses"]
+    missing = [i for i, verse in enumerate(verses) if "embedding" not in verse]
+    if missing:
+        raise ValueError(f"{version}: {len(missing)} verses are missing embeddings (run format_bible.py first)")
+
+    embeddings = np.array([verse.pop("embedding") for verse in verses], dtype=np.float32)
+    write_compiled_bible(output_dir, version, bible.get("metadata", {}), verses, embeddings)
+    print(f"Compiled Bible version: {version} ({len(verses)} verses, {embeddings.shape[1]} dims) in {time.time() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile formatted Bible versions into the binary format loaded by the app")
+    parser.add_argument("--input", default=default_input_dir, help="A formatted {version}.json file or a directory of them")
+    parser.add_argument("--output", default=default_output_dir, help="The directory to write the compiled files to")
+    args = parser.parse_args()
+
+    if os.path.isdir(args.input):
+        inputs = [os.path.join(args.input, f) for f in sorted(os.listdir(args.input)) if f.endswith(".json")]
+    else:
+        inputs = [args.input]
+
+    for input_path in inputs:
+        compile_bible(input_path, args.output)
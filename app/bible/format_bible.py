@@ -1,5 +1,5 @@
 """
-One off script to format the Bible versions in the ./versions folder
+One off script to embed the Bible versions in the ./versions folder
 
 They start off in the format of:
 {
@@ -21,25 +21,83 @@ They start off in the format of:
     ]
 }
 
-We want to add a vector embedding for each verse under the key "embedding".
-Output the updated JSON fiels in a new folder called ./formatted_versions
+Every verse gets a vector embedding and the version is written straight to the compiled binary format loaded by the
+app (app/shared/bibles/compiled/{version}.embeddings.npy + {version}.verses.json, see compile_bible.py).
+--write-json also writes the formatted JSON (each verse with an "embedding" key) to ./formatted_versions.
+
+The embedding requests run concurrently (bounded by --concurrency) and are retried with exponential backoff on rate
+limits (429) and server errors. Every completed batch is appended to a checkpoint file
+(./formatted_versions/{version}.{model}.{dimensionality}.checkpoint.jsonl), so an interrupted run resumes where it
+stopped; a different model or dimensionality starts its own checkpoint.
+
+Usage:
+    python format_bible.py embed                                  # every version in ./versions
+    python format_bible.py embed kjv asv --concurrency 16 --dimensionality 512
+    python format_bible.py search                                 # interactive search of a compiled version
 """
-import os, json, requests, time
+import os, json, requests, time, asyncio, base64, random, argparse, threading
+import httpx
 import numpy as np
-from numba import njit
-from typing import List, Optional
+from typing import List, Optional, Dict, Any
 import google.auth
 import google.auth.transport.requests
 
+from compile_bible import write_compiled_bible, default_output_dir
 
 service_account = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gcp-service.json")
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = service_account
 
-def get_gcp_bearer_token():
-    credentials, project = google.auth.default(scopes=["https://www.googleapis.com/auth/cloud-platform"])
-    auth_request = google.auth.transport.requests.Request()
-    credentials.refresh(auth_request)
-    return credentials.token
+versions_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "versions")
+formatted_versions_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "formatted_versions")
+
+LOCATION = "us-central1"
+PROJECT_ID = "bible-explorer-gcp-project"
+
+# Embedding pipeline defaults
+BATCH_SIZE = 250  # Verses per request (the Vertex AI limit is 250 instances)
+CONCURRENCY = 8  # Requests in flight
+MAX_RETRIES = 8
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+"""
+======================================================= GOOGLE HELPERS =======================================================
+"""
+credentials = None
+credentials_lock = threading.Lock()
+
+
+def get_gcp_bearer_token(force_refresh: bool = False) -> str:
+    """
+    Get a bearer token for the service account (the credentials are reused until the token expires)
+    - force_refresh: Whether to refresh the token even if it is still valid
+
+    Returns a GCP bearer token
+    """
+    global credentials
+    with credentials_lock:
+        if credentials is None:
+            credentials, _ = google.auth.default(scopes=["https://www.googleapis.com/auth/cloud-platform"])
+        if force_refresh or not credentials.valid:
+            credentials.refresh(google.auth.transport.requests.Request())
+        return credentials.token
+
+
+def get_embeddings_endpoint(model_name: str) -> str:
+    return f"https://{LOCATION}-aiplatform.googleapis.com/v1/projects/{PROJECT_ID}/locations/{LOCATION}/publishers/google/models/{model_name}:predict"
+
+
+def get_embeddings_request(texts: List[str], task: str, dimensionality: Optional[int]) -> Dict[str, Any]:
+    return {
+        "instances": [{
+            "task_type": task,
+            "content": text,
+        } for text in texts],
+        "parameters": {"outputDimensionality": dimensionality},
+    }
+
 
 def embed_text(
     texts: List[str],
@@ -48,190 +106,280 @@ def embed_text(
     dimensionality: Optional[int] = 256,
 ) -> List[List[float]]:
     """Embeds texts with a pre-trained, foundational model."""
-    location = "us-central1"
-    project_id = "bible-explorer-gcp-project"
-    endpoint = f"https://{location}-aiplatform.googleapis.com/v1/projects/{project_id}/locations/{location}/publishers/google/models/{model_name}:predict"
     headers = {
         "Authorization": f"Bearer {get_gcp_bearer_token()}",
         "Content-Type": "application/json",
     }
-    data = {
-        "instances": [{
-            "task_type": task,
-            "content": text,
-        } for text in texts],
-        "parameters": {"outputDimensionality": dimensionality},
-    }
-    response = requests.post(endpoint, headers=headers, json=data)
+    response = requests.post(get_embeddings_endpoint(model_name), headers=headers, json=get_embeddings_request(texts, task, dimensionality))
     response.raise_for_status()
     response = response.json()
     embeddings = [prediction["embeddings"]["values"] for prediction in response["predictions"]]
     return embeddings
 
-def format_bible_versions(batch_size=250):
+
+def get_retry_delay(attempt: int, retry_after: Optional[str] = None) -> float:
     """
-    Format the Bible versions in the ./versions folder
-    For each verse, add a vector embedding under the key "embedding"
-    Output the updated JSON files in a new folder called ./formatted_versions
+    Get how long to wait before retrying a request
+    - attempt: The number of the failed attempt (0 = first)
+    - retry_after: The Retry-After header of the response, if any
+
+    Returns the delay in seconds (the Retry-After value, else exponential backoff with full jitter)
     """
-    formatted_versions_abs_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "formatted_versions")
-    versions_abs_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "versions")
+    if retry_after:
+        try:
+            return min(BACKOFF_MAX_SECONDS, float(retry_after))
+        except ValueError:
+            pass
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
 
-    # Create the formatted_versions folder if it doesn't exist
-    if not os.path.exists(formatted_versions_abs_path):
-        os.makedirs(formatted_versions_abs_path)
 
-    # Get the list of Bible versions
-    versions = os.listdir(versions_abs_path)
-    
-    for version in versions:
-        # Load the Bible version (Try the formatted one first)
-        with open(f"{formatted_versions_abs_path}/{version}", "r") as f:
-            print(f"Loading Pre-Formated Bible version: {version}")
-            bible = json.load(f)
-            print(f"Bible version: {bible['metadata']['name']} {bible['metadata']['year']} Loaded!")
-
-        if not bible:
-            print(f"Loading Bible version: {version}")
-            with open(f"{versions_abs_path}/{version}", "r") as f:
-                print(f"Loading Bible version: {version}")
-                bible = json.load(f)
-                print(f"Bible version: {bible['metadata']['name']} {bible['metadata']['year']} Loaded!")
-        
-        verses = bible["verses"]
-        for i in range(0, len(verses), batch_size):
-            batch = verses[i:i+batch_size]
-            # Skip verses that already have embeddings (i.e. all in batch)
-            if all("embedding" in verse for verse in batch):
+async def embed_text_async(
+    client: httpx.AsyncClient,
+    texts: List[str],
+    task: str = "RETRIEVAL_DOCUMENT",
+    model_name: str = "text-embedding-004",
+    dimensionality: Optional[int] = 256,
+) -> List[List[float]]:
+    """
+    Embed texts, retrying rate limits (429), server errors and network errors with backoff
+    - client: The shared HTTP client
+    - texts: The texts to embed
+    - task: The task type of the model
+    - model_name: The name of the embedding model
+    - dimensionality: The dimensionality of the embeddings
+
+    Returns a list of embeddings for each text
+    """
+    data = get_embeddings_request(texts, task, dimensionality)
+    for attempt in range(MAX_RETRIES + 1):
+        retry_after = None
+        try:
+            token = credentials.token if credentials is not None and credentials.valid else await asyncio.to_thread(get_gcp_bearer_token)
+            response = await client.post(get_embeddings_endpoint(model_name), headers={"Authorization": f"Bearer {token}"}, json=data)
+            if response.status_code == 401:
+                await asyncio.to_thread(get_gcp_bearer_token, True)
+            elif response.status_code not in RETRY_STATUS_CODES:
+                response.raise_for_status()
+                return [prediction["embeddings"]["values"] for prediction in response.json()["predictions"]]
+            error = f"HTTP {response.status_code}"
+            retry_after = response.headers.get("Retry-After")
+        except (httpx.TransportError, httpx.TimeoutException) as e:
+            error = repr(e)
+        if attempt == MAX_RETRIES:
+            break
+        delay = get_retry_delay(attempt, retry_after)
+        print(f"Embedding request failed ({error}), retrying in {delay:.1f}s (attempt {attempt + 1}/{MAX_RETRIES})")
+        await asyncio.sleep(delay)
+    raise RuntimeError(f"Embedding request failed after {MAX_RETRIES + 1} attempts: {error}")
+
+
+"""
+======================================================= CHECKPOINTS =======================================================
+"""
+def get_checkpoint_path(version: str, model_name: str, dimensionality: Optional[int]) -> str:
+    return os.path.join(formatted_versions_dir, f"{version}.{model_name}.{dimensionality}.checkpoint.jsonl")
+
+
+def load_checkpoint(path: str, n_verses: int) -> Dict[int, np.ndarray]:
+    """
+    Load the embeddings saved by an interrupted run
+    - path: The checkpoint file
+    - n_verses: The number of verses of the version (records outside of it are ignored)
+
+    Returns {row: embedding} (a truncated last line, e.g. from a crash mid-write, is ignored)
+    """
+    embeddings = {}
+    if not os.path.exists(path):
+        return embeddings
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+                matrix = np.frombuffer(base64.b64decode(record["embeddings"]), dtype=np.float32).reshape(len(record["rows"]), -1)
+            except (ValueError, KeyError):
                 continue
+            for row, embedding in zip(record["rows"], matrix):
+                if row < n_verses:
+                    embeddings[row] = embedding
+    return embeddings
 
-            print(f"Processing batch {i // batch_size} of {len(verses) // batch_size}")
-            texts = [f"{verse['book_name']} {verse['chapter']}:{verse['verse']} {verse['text']}" for verse in batch]
-            embeddings = embed_text(texts)
-            
-            for j, verse in enumerate(batch):
-                verse["embedding"] = embeddings[j]
-            
-            # Save the updated Bible version periodically
-            if (i > 0 and i // batch_size) % 30 == 0:
-                with open(f"{formatted_versions_abs_path}/{version}", "w") as f:
-                    print(f"Saving Bible version: {version} at batch {i // batch_size}")
-                    json.dump(bible, f, indent=4)
-                    print(f"Saved Bible version: {version} at batch {i // batch_size}")
-
-        # Save the updated Bible version
-        with open(f"{formatted_versions_abs_path}/{version}", "w") as f:
-            print(f"Saving Bible version: {version}")
-            json.dump(bible, f, indent=4)
-
-        print(f"Saved Bible version: {version}")
-        
-
-@njit(parallel=True)
-def cosine_distance_numba(search_vector, verse_vectors):
-    similarities = np.zeros(len(verse_vectors))
-    for i in range(len(verse_vectors)):
-        # Cosine Distance = sqrt(sum((a - b)^2)
-        cur_vector = verse_vectors[i]
-        distance = 0
-        for j in range(len(search_vector)):
-            distance += (search_vector[j] - cur_vector[j]) ** 2
-        similarities[i] = np.sqrt(distance)
-    return similarities
-
-
-
-def get_bible():
-    # Get the list of Bible versions
-    versions_abs_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "formatted_versions")
-    versions = os.listdir(versions_abs_path)
+
+def open_checkpoint(path: str):
+    """
+    Open the checkpoint file for appending (after a crash mid-write, the truncated last line is terminated first)
+
+    Returns the open file
+    """
+    f = open(path, "a+")
+    if f.tell() > 0:
+        f.seek(f.tell() - 1)
+        if f.read(1) != "\n":
+            f.write("\n")
+    return f
+
+
+def append_checkpoint(f, rows: List[int], embeddings: List[List[float]]) -> None:
+    """
+    Append a completed batch to the checkpoint file (one JSON line: the rows and their float32 embeddings in base64)
+    """
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    f.write(json.dumps({"rows": rows, "embeddings": base64.b64encode(matrix.tobytes()).decode()}) + "\n")
+    f.flush()
+
+
+"""
+======================================================= PIPELINE =======================================================
+"""
+def get_verse_text(verse: Dict[str, Any]) -> str:
+    return f"{verse['book_name']} {verse['chapter']}:{verse['verse']} {verse['text']}"
+
+
+async def embed_bible_version(
+    version: str,
+    batch_size: int = BATCH_SIZE,
+    concurrency: int = CONCURRENCY,
+    model_name: str = "text-embedding-004",
+    dimensionality: Optional[int] = 256,
+    output_dir: str = default_output_dir,
+    write_json: bool = False,
+) -> None:
+    """
+    Embed every verse of a version and write it in the compiled format (resuming from the checkpoint if there is one)
+    - version: The Bible version (./versions/{version}.json)
+    - batch_size: The number of verses per request
+    - concurrency: The number of requests in flight
+    - model_name: The embedding model
+    - dimensionality: The dimensionality of the embeddings
+    - output_dir: The directory of the compiled files
+    - write_json: Also write the formatted JSON to ./formatted_versions/{version}.json
+    """
+    print(f"Loading Bible version: {version}")
+    with open(os.path.join(versions_dir, f"{version}.json"), "r") as f:
+        bible = json.load(f)
+    verses = bible["verses"]
+    for verse in verses:
+        verse.setdefault("book", verse.get("book_number"))  # The app indexes verses by "book"
+
+    os.makedirs(formatted_versions_dir, exist_ok=True)
+    checkpoint_path = get_checkpoint_path(version, model_name, dimensionality)
+    embeddings = load_checkpoint(checkpoint_path, len(verses))
+    missing = [row for row in range(len(verses)) if row not in embeddings]
+    batches = [missing[i:i + batch_size] for i in range(0, len(missing), batch_size)]
+    print(f"{version}: {len(verses)} verses, {len(embeddings)} already embedded (checkpoint), {len(batches)} batches to go")
+
+    start = time.time()
+    done = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=60, limits=limits) as client:
+        with open_checkpoint(checkpoint_path) as checkpoint:
+            async def embed_batch(rows: List[int]) -> None:
+                nonlocal done
+                async with semaphore:
+                    batch_embeddings = await embed_text_async(client, [get_verse_text(verses[row]) for row in rows], "RETRIEVAL_DOCUMENT", model_name, dimensionality)
+                append_checkpoint(checkpoint, rows, batch_embeddings)
+                for row, embedding in zip(rows, batch_embeddings):
+                    embeddings[row] = np.asarray(embedding, dtype=np.float32)
+                done += len(rows)
+                rate = done / (time.time() - start)
+                print(f"{version}: {len(embeddings)}/{len(verses)} verses embedded ({rate:.0f} verses/s, ~{(len(missing) - done) / rate:.0f}s left)")
+
+            # Stop every batch on the first failure (the completed ones are in the checkpoint)
+            tasks = [asyncio.create_task(embed_batch(rows)) for rows in batches]
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                raise
+
+    matrix = np.stack([embeddings[row] for row in range(len(verses))])
+    write_compiled_bible(output_dir, version, bible.get("metadata", {}), verses, matrix)
+    print(f"Compiled Bible version: {version} ({matrix.shape[0]} verses, {matrix.shape[1]} dims) in {time.time() - start:.2f}s")
+
+    if write_json:
+        for verse, embedding in zip(verses, matrix):
+            verse["embedding"] = embedding.tolist()
+        with open(os.path.join(formatted_versions_dir, f"{version}.json"), "w") as f:
+            json.dump(bible, f, separators=(",", ":"))
+        print(f"Saved formatted Bible version: {version}")
+
+    os.remove(checkpoint_path)  # Everything is in the compiled files now
+
+
+def format_bible_versions(versions: Optional[List[str]] = None, **kwargs) -> None:
+    """
+    Embed the Bible versions in the ./versions folder and write them in the compiled format
+    - versions: The versions to embed (default: every ./versions/*.json)
+    - kwargs: The options of embed_bible_version
+    """
+    if versions is None:
+        versions = [f.replace(".json", "") for f in sorted(os.listdir(versions_dir)) if f.endswith(".json")]
+    for version in versions:
+        asyncio.run(embed_bible_version(version, **kwargs))
+
+
+def get_bible(compiled_dir: str = default_output_dir):
+    """
+    Ask which compiled version to search and load it the way the app does (see shared.bible.BibleIndex.from_compiled)
+    - compiled_dir: The directory of the compiled files
+
+    Returns the BibleIndex of the version
+    """
+    from shared.bible import BibleIndex, EMBEDDINGS_SUFFIX, VERSES_SUFFIX  # Only the search needs the app's modules
+
+    # The compiled versions (the checkpoints and formatted JSON files of ./formatted_versions are not searchable)
+    versions = sorted(
+        name[:-len(EMBEDDINGS_SUFFIX)] for name in os.listdir(compiled_dir)
+        if name.endswith(EMBEDDINGS_SUFFIX) and os.path.exists(os.path.join(compiled_dir, name[:-len(EMBEDDINGS_SUFFIX)] + VERSES_SUFFIX))
+    )
+    if not versions:
+        raise SystemExit(f"No compiled Bible version in {compiled_dir}, run: python format_bible.py embed")
 
     # ask the user which version they want to search
     print("Available Bible Versions:")
     for i, version in enumerate(versions):
         print(f"{i}: {version}")
-    version_index = int(input("Enter the index of the Bible version you want to search: "))
+    version = versions[int(input("Enter the index of the Bible version you want to search: "))]
 
     # Load the Bible version
-    with open(f"{versions_abs_path}/{versions[version_index]}", "r") as f:
-        print(f"- Loading Bible version: {versions[version_index]}")
-        bible = json.load(f)
-
-        # Convert the embeddings to numpy arrays
-        for verse in bible["verses"]:
-            verse["embedding"] = np.array(verse["embedding"])
-
-        print(f"- Bible version: {bible['metadata']['name']} {bible['metadata']['year']} Loaded!")
-
-    # Return the Bible
+    print(f"- Loading Bible version: {version}")
+    bible = BibleIndex.from_compiled(version, os.path.join(compiled_dir, version + EMBEDDINGS_SUFFIX), os.path.join(compiled_dir, version + VERSES_SUFFIX))
+    print(f"- Bible version: {bible.metadata.get('name', version)} {bible.metadata.get('year', '')} Loaded!")
     return bible
 
 def search_bible(bible, query, limit=10, include_context=False, debug=False):
-    # Embed the query
-    start = time.time()
-    query_embedding = embed_text([query], "RETRIEVAL_QUERY")[0]
-    if debug:
-        end = time.time()
-        print(f"Embedding Time: {end - start:.2f}s")
+    from shared.bible import relative_similarities
 
-    # Calculate the similarity of the query to each verse
-    verses = bible["verses"]
+    # Embed the query (with the dimensionality of the version's embeddings)
     start = time.time()
-    verse_embeddings = np.array([verse["embedding"] for verse in verses]) # array of verse embeddings [[...], [...], ...]
-    similarities = cosine_distance_numba(np.array(query_embedding), verse_embeddings)
+    query_embedding = embed_text([query], "RETRIEVAL_QUERY", dimensionality=bible.embeddings.shape[1])[0]
     if debug:
         end = time.time()
-        print(f"Similarity Time: {end - start:.2f}s")
+        print(f"Embedding Time: {end - start:.2f}s")
 
+    # Find the top N verses (cosine similarity, higher is closer)
     start = time.time()
-    for i, verse in enumerate(verses):
-        verse["similarity"] = similarities[i]
+    rows, similarities = bible.search(query_embedding, limit)
+    relative = relative_similarities(similarities)
     if debug:
         end = time.time()
-        print(f"Adding Similarity Time: {end - start:.2f}s")
+        print(f"Search Time: {end - start:.2f}s")
+
+    top_n_verses = []
+    for row, similarity, relative_similarity in zip(rows, similarities, relative):
+        verse = {**bible.verses[int(row)], "similarity": float(similarity), "relative_similarity": float(relative_similarity)}
+        if include_context:
+            # The 2 verses before and after, within the same chapter
+            first, end = bible.positional.get_chapter(verse["book"], verse["chapter"])
+            context = [bible.verses[i] for i in range(max(first, row - 2), min(end, row + 3))]
+            verse["context"] = "".join(f"\t{v['book_name']} {v['chapter']}:{v['verse']} - {v['text']}\n" for v in context)
+        top_n_verses.append(verse)
 
-    # Sort the verses by similarity
-    start = time.time()
-    verses = sorted(verses, key=lambda x: x["similarity"])
-    if debug:
-        end = time.time()
-        print(f"Sorting Time: {end - start:.2f}s")
-
-    # Get the top N verses
-    top_n_verses = verses[:limit]
-
-    # Add relative matching score (i.e. first is 100% match, last is 0% match)
-    max_similarity = top_n_verses[0]["similarity"]
-    min_similarity = top_n_verses[-1]["similarity"]
-    for verse in top_n_verses:
-        verse["relative_similarity"] = (verse["similarity"] - min_similarity) / (max_similarity - min_similarity) if max_similarity - min_similarity != 0 else 0
-
-
-    if include_context:
-        # Include the context of the verses
-        for verse in top_n_verses:
-            verse["context"] = ""
-            book_name = verse["book_name"]
-            chapter = verse["chapter"]
-            verse_number = verse["verse"]
-            # Get the verses around the current verse. Make sure they are in the same book - add last 2 and next 2 verses
-            for i in range(-2, 3):
-                # Get the verse number
-                current_verse_number = verse_number + i
-                # Check if the verse number is valid
-                if current_verse_number > 0:
-                    # Get the verse
-                    current_verse = next((v for v in verses if v["book_name"] == book_name and v["chapter"] == chapter and v["verse"] == current_verse_number), None)
-                    # Add the verse text to the context
-                    if current_verse:
-                        verse["context"] += f"\t{current_verse['book_name']} {current_verse['chapter']}:{current_verse['verse']} - {current_verse['text']}\n"
-    
     # Return the top N verses
     return top_n_verses
 
-if __name__ == "__main__":
-    #format_bible_versions()
-
+def run_interactive_search() -> None:
     # Load the Bible
     print('Welcome to the Bible Explorer')
     print('=' * 100)
@@ -261,3 +409,31 @@ if __name__ == "__main__":
                 print('-' * 30)
 
     print('Goodbye!')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Embed the Bible versions or search a compiled one")
+    subparsers = parser.add_subparsers(dest="command")
+    embed_parser = subparsers.add_parser("embed", help="Embed the versions in ./versions and write them in the compiled format")
+    embed_parser.add_argument("versions", nargs="*", help="The versions to embed (default: every ./versions/*.json)")
+    embed_parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="The number of verses per request")
+    embed_parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help="The number of requests in flight")
+    embed_parser.add_argument("--model", default="text-embedding-004", help="The embedding model")
+    embed_parser.add_argument("--dimensionality", type=int, default=256, help="The dimensionality of the embeddings")
+    embed_parser.add_argument("--output", default=default_output_dir, help="The directory of the compiled files")
+    embed_parser.add_argument("--write-json", action="store_true", help="Also write the formatted JSON to ./formatted_versions")
+    subparsers.add_parser("search", help="Search a compiled version interactively")
+    args = parser.parse_args()
+
+    if args.command == "embed":
+        format_bible_versions(
+            args.versions or None,
+            batch_size=args.batch_size,
+            concurrency=args.concurrency,
+            model_name=args.model,
+            dimensionality=args.dimensionality,
+            output_dir=args.output,
+            write_json=args.write_json,
+        )
+    else:
+        run_interactive_search()
@@ -2,6 +2,7 @@
     Database controller for the application
 """
 from sqlmodel import SQLModel, create_engine, Session
+from sqlalchemy import event
 import os
 
 # Define the relative path for the database file
@@ -15,8 +16,18 @@ os.makedirs(relative_path, exist_ok=True)
 full_path = os.path.join(relative_path, sqlite_file_name)
 sqlite_url = f"sqlite:///{full_path}"
 
-# Create the database engine
-engine = create_engine(sqlite_url, echo=True)
+# Create the database engine (set echo=True to print every SQL statement when debugging)
+engine = create_engine(sqlite_url, echo=False)
+
+@event.listens_for(engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    Use write-ahead logging so readers don't block the (batched) log writes and commits don't fsync the main file
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
 
 def create_db_and_tables():
     """
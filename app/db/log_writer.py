@@ -0,0 +1,143 @@
+"""
+    Write-behind log writer for the application
+
+    Request handlers queue their log rows (AI_Log, Bible_Search_Log, ...) instead of committing them on the
+    request path. A background thread drains the queue and inserts the rows in batches, one transaction per batch.
+"""
+from sqlmodel import SQLModel
+from typing import List, Optional
+import queue, threading, time, atexit
+
+from db.controller import get_db
+from shared.metrics import CallbackMetric
+
+# Defaults
+LOG_BATCH_SIZE = 200  # Max rows per transaction
+LOG_FLUSH_INTERVAL_SECONDS = 1.0  # Max time a row waits in the queue before being flushed
+LOG_MAX_QUEUE_SIZE = 50_000  # Rows beyond this are dropped and counted (never written on the request path, never unbounded memory)
+
+
+class LogWriter:
+    """
+    Queues log rows and writes them to the database in batches from a background thread
+    - batch_size: The maximum number of rows written per transaction
+    - flush_interval_seconds: How long the writer waits for a batch to fill before flushing what it has
+    - max_queue_size: The maximum number of queued rows (rows queued while it is full are dropped, see dropped)
+
+    Example usage:
+    log_writer.enqueue(AI_Log(...))
+    """
+    def __init__(self, batch_size: int = LOG_BATCH_SIZE, flush_interval_seconds: float = LOG_FLUSH_INTERVAL_SECONDS, max_queue_size: int = LOG_MAX_QUEUE_SIZE):
+        self.batch_size = batch_size
+        self.flush_interval_seconds = flush_interval_seconds
+        self.written = 0
+        self.failed = 0
+        self.dropped = 0
+        self._queue: "queue.Queue[Optional[SQLModel]]" = queue.Queue(maxsize=max_queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def start(self) -> None:
+        """
+        Start the background writer thread (no-op if it is already running)
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """
+        Flush every queued row and stop the background writer thread
+        - timeout: The maximum number of seconds to wait for the flush
+        """
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)  # Sentinel: flush and exit
+            thread.join(timeout)
+        self.flush()  # Anything queued after the thread stopped
+
+    def enqueue(self, row: SQLModel) -> None:
+        """
+        Queue a row to be written (starts the writer thread on first use); never blocks and never touches the database
+        - row: The SQLModel row to insert
+
+        When the queue is full (the database can't keep up), the row is dropped: losing a log row is better than
+        stalling the event loop of every request on a SQLite commit
+        """
+        if self._thread is None:
+            self.start()
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self) -> None:
+        """
+        Synchronously write everything that is currently queued
+        """
+        batch = []
+        while True:
+            try:
+                row = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if row is not None:
+                batch.append(row)
+            if len(batch) >= self.batch_size:
+                self._write(batch)
+                batch = []
+        if batch:
+            self._write(batch)
+
+    def pending(self) -> int:
+        """
+        Returns the number of queued rows
+        """
+        return self._queue.qsize()
+
+    def _run(self) -> None:
+        while True:
+            row = self._queue.get()
+            if row is None:
+                return
+            batch = [row]
+            deadline = time.monotonic() + self.flush_interval_seconds
+            stop = False
+            # Fill the batch until it is full or the flush interval is up
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    row = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if row is None:
+                    stop = True
+                    break
+                batch.append(row)
+            self._write(batch)
+            if stop:
+                return
+
+    def _write(self, batch: List[SQLModel]) -> None:
+        with self._write_lock:
+            try:
+                with get_db() as db:
+                    db.add_all(batch)
+                    db.commit()
+                self.written += len(batch)
+            except Exception as e:
+                print(f"Failed to write {len(batch)} log rows: {e}")
+                self.failed += len(batch)
+
+
+# Global log writer
+log_writer = LogWriter()
+atexit.register(log_writer.stop)
+CallbackMetric("log_rows_dropped_total", "Log rows dropped because the log writer queue was full", [], lambda: {(): log_writer.dropped}, kind="counter")
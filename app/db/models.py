@@ -31,3 +31,26 @@ class Bible_Search_Log(SQLModel, table=True):
     runtime_seconds: float
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc), sa_column_kwargs={"onupdate": lambda: datetime.now(timezone.utc)})
+
+
+class Embedding_Cache(SQLModel, table=True):
+    id: int = Field(default=None, primary_key=True)
+    cache_key: str = Field(index=True, unique=True)
+    text: str
+    task: str
+    model: str
+    dimensionality: Optional[int] = None
+    embedding: str
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+class AI_Response_Cache(SQLModel, table=True):
+    id: int = Field(default=None, primary_key=True)
+    cache_key: str = Field(index=True, unique=True)
+    model: str
+    messages: str
+    config: str
+    output: str
+    prompt_tokens: int
+    completion_tokens: int
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
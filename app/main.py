@@ -1,14 +1,47 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
+from contextlib import asynccontextmanager
 
-import os
+import os, time
+
+from db.log_writer import log_writer
+from shared.warmup import start_warm_up
+from shared.metrics import http_request_seconds
+
+
+"""
+======================================================= LIFESPAN =======================================================
+"""
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Startup and shutdown hooks for the application
+    - Startup: start the background log writer and the warm-up (preload Bible versions, compile kernels)
+    - Shutdown: flush every queued log row
+    """
+    log_writer.start()
+    start_warm_up()  # /api/health/ready answers 503 until it is done
+    yield
+    log_writer.stop()
 
 
 """
 ======================================================= FASTAPI =======================================================
 """
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """
+    Observe the latency of every request in http_request_seconds (labelled by route template, not by raw path)
+    """
+    start = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    http_request_seconds.observe(time.perf_counter() - start, method=request.method, route=getattr(route, "path", "unmatched"), status=response.status_code)
+    return response
 
 
 """
@@ -28,6 +61,12 @@ app.include_router(ai_router)
 from router.api.routes import bible_router
 app.include_router(bible_router)
 
+from router.api.routes import health_router
+app.include_router(health_router)
+
+from router.api.routes import metrics_router
+app.include_router(metrics_router)
+
 from router.web.routes import router as web_router
 app.include_router(web_router)
 
@@ -2,12 +2,17 @@
 Router File:
 - Handles routes related to general AI functionality
 """
-from typing import Union, List, Dict, Any
-from fastapi import APIRouter, HTTPException, Request
+from typing import Union, List, Dict, Any, Literal, Optional
+from fastapi import APIRouter, HTTPException, Request, Query
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse, Response
 import json
 
-from shared.ai import ai_chat, Message, AI_Response
-from shared.bible import BibleVerse, BibleSearchResponse, search_bible, get_bible_versions
+from shared.ai import ai_chat_async, ai_chat_stream, Message, AI_Response
+from shared.warmup import warmup_state
+from shared.metrics import metrics_registry
+from shared.bible import BibleSearchResponse, get_bible_versions
+from shared.bible import BibleBatchSearchRequest, BibleBatchSearchResponse, search_bible_batch_async, search_bible_multi_async, MAX_RESULTS_LIMIT, MAX_CONTEXT_SIZE
+from shared.bible import BiblePassageResponse, get_bible_passage_async, search_bible_json_async, RESULT_CACHE_CONTROL
 
 ai_router = APIRouter(
     prefix="/api/ai", # This will be the prefix of the API
@@ -19,16 +24,33 @@ bible_router = APIRouter(
     tags=["Bible"], # This will be the tag for the API documentation
 )
 
+health_router = APIRouter(
+    prefix="/api/health", # This will be the prefix of the API
+    tags=["Health"], # This will be the tag for the API documentation
+)
+
+metrics_router = APIRouter(
+    tags=["Metrics"], # No prefix: Prometheus scrapes /metrics
+)
+
 """
 ======================================================= AI ROUTES =======================================================
 """
 @ai_router.post("/chat", response_model=AI_Response)
-def chat_with_ai(messages: List[Message], model: str = "gpt-4o-mini") -> AI_Response:
+async def chat_with_ai(messages: List[Message], model: str = "gpt-4o-mini", stream: bool = False, hedge: bool = True) -> AI_Response:
     """
     Route to chat with the AI
+    - stream: Stream the response as server-sent events ({"content": "..."} chunks, then a "done" event with the full AI_Response)
+    - hedge: Start the fallback model too when the model hasn't answered after HEDGE_AFTER_SECONDS (the first response wins)
     """
+    if stream:
+        return StreamingResponse(
+            ai_chat_stream('api docs', messages, model=model, hedge=hedge),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
     try:
-        response = ai_chat('api docs', messages, model=model)
+        response = await ai_chat_async('api docs', messages, model=model, hedge=hedge)
         if isinstance(response, dict) and "error" in response:
             raise HTTPException(status_code=500, detail=response["error"])
         return response
@@ -36,9 +58,10 @@ def chat_with_ai(messages: List[Message], model: str = "gpt-4o-mini") -> AI_Resp
         raise HTTPException(status_code=500, detail=str(e))
     
 @ai_router.post("/object-lesson-ideas", response_model=AI_Response)
-def object_lesson_ideas(topic: str, age_group: str = "1st through 6th Grade", model: str = "gpt-4o-mini") -> AI_Response:
+async def object_lesson_ideas(topic: str, age_group: str = "1st through 6th Grade", model: str = "gpt-4o-mini", cache: bool = True) -> AI_Response:
     """
     Route to generate object lesson ideas
+    - cache: Reuse the ideas already generated for the same topic, age group and model (false = always ask the model)
     """
     try:
         system_prompt = """\
@@ -77,7 +100,7 @@ def object_lesson_ideas(topic: str, age_group: str = "1st through 6th Grade", mo
             Message(role="user", content=user_prompt)
         ]
         
-        response = ai_chat('object lesson ideas', messages, model=model)
+        response = await ai_chat_async('object lesson ideas', messages, model=model, cache=cache)
         if isinstance(response, dict) and "error" in response:
             raise HTTPException(status_code=500, detail=response["error"])
         
@@ -111,14 +134,99 @@ def get_bible_versions_route() -> List[str]:
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Check an If-None-Match header against an ETag (weak comparison, as for GET revalidation)
+    """
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag.removeprefix("W/") in tags
+
 @bible_router.get("/search", response_model=BibleSearchResponse)
-def search_bible_verses(search_text: str, bible_version: str = "kjv", max_results: int = 5, add_context: bool = False, context_size: int = 2) -> BibleSearchResponse:
+async def search_bible_verses(request: Request, search_text: str, bible_version: str = "kjv", max_results: int = 5, add_context: bool = False, context_size: int = 2, search_mode: Literal["exact", "approx"] = "exact", nprobe: Optional[int] = None, mode: Literal["semantic", "lexical", "hybrid"] = "semantic", include_timings: bool = False) -> BibleSearchResponse:
     """
     Route to search the Bible for verses
+    - search_mode: "exact" scores every verse, "approx" uses the version's ANN index (nprobe = clusters scanned, higher = better recall)
+    - mode: "semantic" ranks by embedding similarity, "lexical" by keyword (BM25, no embedding call), "hybrid" fuses both rankings
+    - include_timings: Return the duration of each search stage
+
+    Results are cached (X-Cache: HIT/MISS) and carry an ETag: a request with a matching If-None-Match gets a 304.
     """
     try:
-        response, notes = search_bible(search_text, bible_version, max_results, add_context, context_size)
-        return BibleSearchResponse(verses=response, notes=notes)
+        body, etag, cached = await search_bible_json_async(search_text, bible_version, max_results, add_context, context_size, search_mode, nprobe, mode, include_timings)
     except Exception as e:
         print(e)
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+    headers = {"ETag": etag, "Cache-Control": RESULT_CACHE_CONTROL, "X-Cache": "HIT" if cached else "MISS"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@bible_router.get("/passage", response_model=BiblePassageResponse)
+async def get_bible_passage(reference: str = Query(..., description="The Bible reference, e.g. John 3:16, Ps 23, 1 Cor 13:4-7, Gen 1:1-2:3"), bible_version: str = "kjv", add_context: bool = False, context_size: int = Query(2, ge=0, le=MAX_CONTEXT_SIZE)) -> BiblePassageResponse:
+    """
+    Route to read a passage by reference (book names, abbreviations, chapter and verse ranges), no embedding call
+    """
+    try:
+        response = await get_bible_passage_async(reference, bible_version, add_context, context_size)
+    except Exception as e:
+        print(e)
+        raise HTTPException(status_code=500, detail=str(e))
+    if response is None:
+        raise HTTPException(status_code=404, detail=f"Reference not found in {bible_version}: {reference}")
+    return response
+
+@bible_router.post("/search/batch", response_model=BibleBatchSearchResponse)
+async def search_bible_verses_batch(request: BibleBatchSearchRequest) -> BibleBatchSearchResponse:
+    """
+    Route to search the Bible for many texts in one call (one embedding request, one scoring pass)
+    """
+    try:
+        results, notes, timings = await search_bible_batch_async(request.search_texts, request.bible_version, request.max_results, request.add_context, request.context_size)
+        return BibleBatchSearchResponse(results=results, notes=notes, timings=timings if request.include_timings else None)
+    except Exception as e:
+        print(e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@bible_router.get("/search/multi", response_model=BibleSearchResponse)
+async def search_bible_verses_multi(search_text: str, bible_versions: List[str] = Query(..., description="The Bible versions to search, e.g. ?bible_versions=kjv&bible_versions=asv"), max_results: int = Query(5, ge=1, le=MAX_RESULTS_LIMIT), add_context: bool = False, context_size: int = Query(2, ge=0, le=MAX_CONTEXT_SIZE), include_timings: bool = False) -> BibleSearchResponse:
+    """
+    Route to search several Bible versions at once (results are deduplicated by reference, keeping the best-scoring version)
+    """
+    try:
+        response, notes, timings = await search_bible_multi_async(search_text, bible_versions, max_results, add_context, context_size)
+        return BibleSearchResponse(verses=response, notes=notes, timings=timings if include_timings else None)
+    except Exception as e:
+        print(e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+"""
+======================================================= HEALTH ROUTES =======================================================
+"""
+@health_router.get("/live")
+def liveness() -> Dict[str, Any]:
+    """
+    Route for the liveness probe (the worker is up)
+    """
+    return {"live": True}
+
+@health_router.get("/ready")
+def readiness() -> JSONResponse:
+    """
+    Route for the readiness probe: 200 once the startup warm-up (preloaded versions + compiled kernels) is done, 503 before
+    """
+    state = warmup_state.to_dict()
+    return JSONResponse(state, status_code=200 if state["ready"] else 503)
+
+
+"""
+======================================================= METRICS ROUTES =======================================================
+"""
+@metrics_router.get("/metrics", response_class=PlainTextResponse)
+def metrics() -> PlainTextResponse:
+    """
+    Route for Prometheus: request/stage latency histograms, cache hits, upstream errors and AI token usage of this worker
+    """
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,68 @@
+"""
+Serve the app with several worker processes that share the Bible indexes
+
+This process is the loader: it loads each version once, publishes it to shared memory (see shared/shared_index.py),
+then starts uvicorn with --workers. The workers attach to the published versions instead of loading their own copy,
+so the memory of the indexes stays the same whatever the number of workers. Versions that are not published
+(not listed, or updated on disk since) are loaded by each worker as usual. The published versions are removed on exit.
+
+Usage (from the repo root, like fastapi dev):
+    python app/serve.py --workers 4                        # publishes BIBLE_PRELOAD_VERSIONS (default kjv)
+    python app/serve.py --workers 8 --versions kjv,asv --port 8000
+    python app/serve.py --workers 8 --versions "*"         # every available version
+"""
+import os, sys, argparse, time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from shared.shared_index import DEFAULT_SHARED_INDEX_DIR
+
+# Must be set before shared.bible is imported, here and in the workers (they inherit the environment)
+os.environ.setdefault("BIBLE_SHARED_INDEX_DIR", DEFAULT_SHARED_INDEX_DIR)
+shared_index_dir = os.environ["BIBLE_SHARED_INDEX_DIR"]
+
+import uvicorn
+from shared import bible
+from shared.shared_index import get_shared_index_path, remove_shared_index
+from shared.warmup import PRELOAD_VERSIONS
+
+
+def publish_versions(versions: list) -> list:
+    """
+    Load and publish the Bible versions (already published versions are reused)
+    - versions: The versions to publish
+
+    Returns the directories this process published (to remove on exit)
+    """
+    published = []
+    for version in versions:
+        path = get_shared_index_path(shared_index_dir, version, bible.get_bible_fingerprint(version))
+        if os.path.isdir(path):
+            print(f"Bible version already published: {version} ({path})")
+            continue
+        start = time.time()
+        index = bible.read_bible_index(version)  # Not kept: the loader itself doesn't serve requests
+        published.append(index.publish(shared_index_dir))
+        print(f"Published Bible version: {version} in {time.time() - start:.2f}s ({path})")
+    return published
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the app with several workers sharing the Bible indexes")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="The number of worker processes")
+    parser.add_argument("--versions", default=PRELOAD_VERSIONS, help="Comma separated versions to publish (\"*\" = every available version)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    # Create the tables once, before the workers start (they would race each other creating them)
+    import db.models
+    from db.controller import create_db_and_tables
+    create_db_and_tables()
+
+    versions = bible.get_bible_versions() if args.versions.strip() == "*" else [version.strip() for version in args.versions.split(",") if version.strip()]
+    published = publish_versions(versions)
+    try:
+        uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers, app_dir=os.path.dirname(os.path.abspath(__file__)))
+    finally:
+        for path in published:
+            remove_shared_index(path)
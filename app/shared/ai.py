@@ -1,12 +1,41 @@
 from pydantic import BaseModel, Field
-from typing import List, Dict, Any, Union
-import json, time
+from typing import List, Dict, Any, Union, AsyncIterator, Literal, Optional, Tuple
+from datetime import datetime, timezone
+import json, time, asyncio, hashlib
 
-from openai import OpenAI
+from openai import AsyncOpenAI
+from sqlmodel import select, delete
+from sqlalchemy.exc import IntegrityError
 from shared.secrets import get_secret
+from shared.cache import LRUCache
+from shared.metrics import ai_requests, ai_tokens, upstream_errors, get_error_status, register_cache, CallbackMetric
+from shared.providers import HEDGE_AFTER_SECONDS, Provider, create_chat_completion_async
 
-from db.models import AI_Log
+from db.models import AI_Log, AI_Response_Cache
 from db.controller import get_db
+from db.log_writer import log_writer
+
+"""
+======================================================= CONFIG =======================================================
+"""
+# Responses of the chats called with cache=True, keyed on (model, messages, config): in memory (LRU) and in the
+# AI_Response_Cache table, so they survive restarts and are shared by the workers
+AI_CACHE_SIZE = 1000
+AI_CACHE_MAX_BYTES = 16 * 1024 * 1024
+AI_CACHE_TTL_SECONDS = 7 * 24 * 60 * 60
+AI_CACHE_PERSIST = True
+
+# Timeout of each request to a provider (the retries, hedging and circuit breaking are configured in shared/providers.py)
+PROVIDER_TIMEOUT_SECONDS = {"openai": 60.0, "groq": 30.0}
+
+# The model that answers in place of another one (on the other provider) when its request fails, is too slow
+# (hedged chats only) or its provider's circuit is open. Models without a fallback are only retried.
+FALLBACK_MODELS = {
+    "gpt-4o-mini": "llama-3.1-70b-versatile",
+    "gpt-4o": "llama-3.1-70b-versatile",
+    "llama-3.1-70b-versatile": "gpt-4o-mini",
+    "llama-3.1-8b-instant": "gpt-4o-mini",
+}
 
 """
 ======================================================= MODELS =======================================================
@@ -44,6 +73,8 @@ class AI_Response(BaseModel):
     runtime_seconds: float = Field(..., description="The runtime of the API call in seconds.")
     prompt_tokens: int = Field(..., description="The number of tokens in the prompt.")
     completion_tokens: int = Field(..., description="The number of tokens in the completion.")
+    cache_status: Literal["hit", "persistent_hit", "miss", "bypass"] = Field("bypass", description="Where the response came from: the in-memory cache (hit), the SQLite cache (persistent_hit), the model with the response cached (miss), or the model without caching (bypass).")
+    model: Optional[str] = Field(None, description="The model that answered: the requested one, or its fallback when the requested one failed or was too slow (None for cached responses).")
 
     class Config:
         json_schema_extra = {
@@ -66,40 +97,197 @@ class AI_Response(BaseModel):
                     ],
                     "runtime_seconds": 0.5,
                     "prompt_tokens": 100,
-                    "completion_tokens": 200
+                    "completion_tokens": 200,
+                    "cache_status": "miss",
+                    "model": "gpt-4o-mini"
                 }
             ]
         }
 
+"""
+======================================================= RESPONSE CACHE =======================================================
+"""
+ai_response_cache = LRUCache(max_items=AI_CACHE_SIZE, ttl_seconds=AI_CACHE_TTL_SECONDS, max_bytes=AI_CACHE_MAX_BYTES, sizeof=lambda entry: len(entry["output"]))
+ai_cache_counters = {"persistent_hits": 0, "persistent_misses": 0}
+register_cache("ai_response", ai_response_cache)
+CallbackMetric("ai_response_cache_persistent_total", "Lookups in the persistent (SQLite) AI response cache", ["result"],
+               lambda: {("hit",): ai_cache_counters["persistent_hits"], ("miss",): ai_cache_counters["persistent_misses"]}, kind="counter")
+
+
+def get_ai_cache_key(model: str, messages: List[Message], config: Dict[str, Any]) -> str:
+    """
+    Get the cache key of a chat: a hash of (model, messages, config), the stream options excluded
+    """
+    config = {key: value for key, value in config.items() if key not in ("stream", "stream_options")}
+    payload = json.dumps([model, [message.dict() for message in messages], config], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def load_persisted_ai_response(key: str) -> Optional[Dict[str, Any]]:
+    """
+    Look up a response in the persistent tier (AI_Response_Cache table), promoting a hit into the in-memory LRU
+    - key: The cache key
+
+    Returns {"output", "prompt_tokens", "completion_tokens"} or None when missing or older than AI_CACHE_TTL_SECONDS
+    """
+    with get_db() as db:
+        row = db.exec(select(AI_Response_Cache).where(AI_Response_Cache.cache_key == key)).first()
+    if row is None:
+        ai_cache_counters["persistent_misses"] += 1
+        return None
+    created_at = row.created_at if row.created_at.tzinfo else row.created_at.replace(tzinfo=timezone.utc)  # SQLite drops the timezone
+    remaining_seconds = AI_CACHE_TTL_SECONDS - (datetime.now(timezone.utc) - created_at).total_seconds()
+    if remaining_seconds <= 0:
+        ai_cache_counters["persistent_misses"] += 1
+        return None
+    entry = {"output": row.output, "prompt_tokens": row.prompt_tokens, "completion_tokens": row.completion_tokens}
+    ai_response_cache.set(key, entry, ttl_seconds=remaining_seconds)
+    ai_cache_counters["persistent_hits"] += 1
+    return entry
+
+
+def persist_ai_response(key: str, model: str, messages: List[Message], config: Dict[str, Any], entry: Dict[str, Any]) -> None:
+    """
+    Save a response to the persistent tier (AI_Response_Cache table), replacing an expired one
+    """
+    try:
+        with get_db() as db:
+            db.exec(delete(AI_Response_Cache).where(AI_Response_Cache.cache_key == key))
+            db.add(AI_Response_Cache(
+                cache_key=key,
+                model=model,
+                messages=json.dumps([message.dict() for message in messages]),
+                config=json.dumps(config),
+                **entry,
+            ))
+            db.commit()
+    except IntegrityError:
+        pass  # A concurrent request already persisted the same response
+
+
+async def get_cached_ai_response_async(key: str) -> Tuple[Optional[Dict[str, Any]], str]:
+    """
+    Look up a response in the cache (in-memory LRU first, then SQLite in a worker thread)
+
+    Returns (the cached entry or None, cache status: "hit", "persistent_hit" or "miss")
+    """
+    entry = ai_response_cache.get(key)
+    if entry is not None:
+        return entry, "hit"
+    if AI_CACHE_PERSIST:
+        entry = await asyncio.to_thread(load_persisted_ai_response, key)
+        if entry is not None:
+            return entry, "persistent_hit"
+    return None, "miss"
+
+
+def cache_ai_response(key: str, output: str, prompt_tokens: int, completion_tokens: int) -> Dict[str, Any]:
+    """
+    Save a new response in the in-memory cache
+
+    Returns the cache entry (to persist with persist_ai_response when AI_CACHE_PERSIST)
+    """
+    entry = {"output": output, "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}
+    ai_response_cache.set(key, entry)
+    return entry
+
+
+def build_cached_ai_response(messages: List[Message], entry: Dict[str, Any], cache_status: str, runtime_seconds: float) -> AI_Response:
+    """
+    Build the AI_Response of a cache hit (the token counts are the ones of the original response, nothing is logged to AI_Log)
+    """
+    return AI_Response(
+        output=entry["output"],
+        chat_history=[Message(**message.dict()) for message in messages + [Message(role="assistant", content=entry["output"])]],
+        runtime_seconds=runtime_seconds,
+        prompt_tokens=entry["prompt_tokens"],
+        completion_tokens=entry["completion_tokens"],
+        cache_status=cache_status,
+    )
+
+
 """
 ======================================================= FUNCTIONS =======================================================
 """
-# Global OpenAI client
-openAI_client = OpenAI(api_key=get_secret('OPENAI_API_KEY'))
-groq_client = OpenAI(
+# Global async OpenAI clients
+openAI_async_client = AsyncOpenAI(api_key=get_secret('OPENAI_API_KEY'))
+groq_async_client = AsyncOpenAI(
     api_key=get_secret('GROQ_API_KEY'),
     base_url="https://api.groq.com/openai/v1"
 )
-def ai_chat(source: str, messages: List[Message], model: str = "gpt-4o-mini", config: Dict[str, Any] = {
+
+# Providers with timeouts, retries and circuit breakers wrapping the clients
+providers = {
+    "openai": Provider("openai", openAI_async_client, timeout_seconds=PROVIDER_TIMEOUT_SECONDS["openai"]),
+    "groq": Provider("groq", groq_async_client, timeout_seconds=PROVIDER_TIMEOUT_SECONDS["groq"]),
+}
+CallbackMetric("ai_provider_circuit_open", "1 while the circuit of an AI provider is open (its requests fail fast)", ["provider"],
+               lambda: {(name,): int(provider.breaker.state == "open") for name, provider in providers.items()})
+
+def get_provider_name(model: str) -> str:
+    """
+    Get the name of the provider serving a model ("openai" for the gpt models, "groq" for the others)
+    """
+    return "openai" if model.startswith("gpt") else "groq"
+
+def get_chat_candidates(model: str) -> List[Tuple[str, Provider]]:
+    """
+    Get the (model, provider) pairs that can answer a chat: the model, then its fallback (see FALLBACK_MODELS)
+    """
+    candidates = [(model, providers[get_provider_name(model)])]
+    if model in FALLBACK_MODELS:
+        candidates.append((FALLBACK_MODELS[model], providers[get_provider_name(FALLBACK_MODELS[model])]))
+    return candidates
+
+def log_ai_chat(source: str, messages: List[Message], model: str, config: Dict[str, Any], output: str, runtime_seconds: float, prompt_tokens: int, completion_tokens: int) -> None:
+    """
+    Queue a chat to be saved to the AI_Log table (written in batches by the background log writer) and count its tokens
+    """
+    ai_requests.inc(model=model, source=source)
+    ai_tokens.inc(prompt_tokens or 0, model=model, kind="prompt")
+    ai_tokens.inc(completion_tokens or 0, model=model, kind="completion")
+    log_writer.enqueue(AI_Log(
+        source=source,
+        messages=json.dumps([message.dict() for message in messages]),
+        model=model,
+        config=json.dumps(config),
+        response=output,
+        runtime_seconds=runtime_seconds,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens
+    ))
+
+async def ai_chat_async(source: str, messages: List[Message], model: str = "gpt-4o-mini", config: Dict[str, Any] = {
     "stream": False,
     "temperature": 0.65,
-}) -> Union[AI_Response, Dict[str, str]]:
+}, cache: bool = False, hedge: bool = False) -> Union[AI_Response, Dict[str, str]]:
     """
-    This function sends a message to the OpenAI API and returns the response.
+    This function sends a message to the OpenAI/Groq API and returns the response (the request to the model and the
+    database log never block the event loop). Failed requests are retried, then sent to the fallback model (see
+    FALLBACK_MODELS and shared/providers.py).
     - source: The source of the chat. | str
     - messages: The chat history to send to the API. | [{role: str, content: str}] where role is either "system", "user", or "assistant"
     - model: The model to use for the chat. | str
     - config: The configuration for the chat. | dict
+    - cache: Reuse the response of an identical chat (same model, messages and config) for AI_CACHE_TTL_SECONDS. A response
+      of the fallback model is not cached: it would be served under the requested model's key. | bool
+    - hedge: Also start the fallback model when the model hasn't answered after HEDGE_AFTER_SECONDS (the first response
+      wins). Only for short chats: a long generation is slow by nature and would always be answered twice. | bool
     """
     try:
         if config.get('stream', False):
-            # Implement streaming logic here
-            return {"error": "Streaming not implemented yet."}
-        
+            return {"error": "Use ai_chat_stream to stream a chat."}
+
         start = time.time()
-        client = openAI_client if model.startswith("gpt") else groq_client
-        response = client.chat.completions.create(
-            model=model,
+        cache_key = get_ai_cache_key(model, messages, config) if cache else None
+        if cache_key:
+            entry, cache_status = await get_cached_ai_response_async(cache_key)
+            if entry is not None:
+                return build_cached_ai_response(messages, entry, cache_status, time.time() - start)
+
+        response, answered_by = await create_chat_completion_async(
+            get_chat_candidates(model),
+            hedge_after_seconds=HEDGE_AFTER_SECONDS if hedge else None,
             messages=[message.dict() for message in messages],
             **config
         )
@@ -108,27 +296,97 @@ def ai_chat(source: str, messages: List[Message], model: str = "gpt-4o-mini", co
         full_chat_history = messages + [Message(role="assistant", content=output)]
 
         # Save the chat log to the database
-        with get_db() as db:
-            log = AI_Log(
-                source=source,
-                messages=json.dumps([message.dict() for message in messages]),
-                model=model,
-                config=json.dumps(config),
-                response=output,
-                runtime_seconds=runtime_seconds,
-                prompt_tokens=response.usage.prompt_tokens,
-                completion_tokens=response.usage.completion_tokens
-            )
-            db.add(log)
-            db.commit()
+        log_ai_chat(source, messages, answered_by, config, output, runtime_seconds, response.usage.prompt_tokens, response.usage.completion_tokens)
+        if answered_by != model:
+            cache_key = None
+        if cache_key:
+            entry = cache_ai_response(cache_key, output, response.usage.prompt_tokens, response.usage.completion_tokens)
+            if AI_CACHE_PERSIST:
+                await asyncio.to_thread(persist_ai_response, cache_key, model, messages, config, entry)
 
         return AI_Response(
             output=output,
             chat_history=[Message(**message.dict()) for message in full_chat_history],
             runtime_seconds=runtime_seconds,
             prompt_tokens=response.usage.prompt_tokens,
-            completion_tokens=response.usage.completion_tokens
+            completion_tokens=response.usage.completion_tokens,
+            cache_status="miss" if cache_key else "bypass",
+            model=answered_by
+        )
+    except Exception as e:
+        print(e)
+        return {"error": str(e)}
+
+def format_sse(data: Dict[str, Any], event: str = None) -> str:
+    """
+    Format a server-sent event
+    - data: The JSON payload of the event
+    - event: The event name (None for the default "message" event)
+    """
+    return (f"event: {event}\n" if event else "") + f"data: {json.dumps(data)}\n\n"
+
+async def ai_chat_stream(source: str, messages: List[Message], model: str = "gpt-4o-mini", config: Dict[str, Any] = {
+    "temperature": 0.65,
+}, hedge: bool = False) -> AsyncIterator[str]:
+    """
+    This function streams a chat from the OpenAI/Groq API as server-sent events. Opening the stream goes through the
+    same retries and fallback model as ai_chat_async (see FALLBACK_MODELS and shared/providers.py).
+    - source: The source of the chat. | str
+    - messages: The chat history to send to the API. | [{role: str, content: str}] where role is either "system", "user", or "assistant"
+    - model: The model to use for the chat. | str
+    - config: The configuration for the chat (the stream options are set by this function). | dict
+    - hedge: Also start opening the stream with the fallback model when the model hasn't answered after
+      HEDGE_AFTER_SECONDS (the first stream to open wins). | bool
+
+    Yields:
+    - data: {"content": "..."} for every token chunk
+    - event: done, data: {AI_Response} once the response is complete (it is also logged to AI_Log)
+    - event: error, data: {"error": "..."} if the request fails
+    """
+    answered_by = None  # Set once the stream is open
+    try:
+        start = time.time()
+        config = {key: value for key, value in config.items() if key not in ("stream", "stream_options")}
+        # Only opening the stream is retried or sent to the fallback: once chunks were sent, a failure ends the stream with an error event
+        stream, answered_by = await create_chat_completion_async(
+            get_chat_candidates(model),
+            hedge_after_seconds=HEDGE_AFTER_SECONDS if hedge else None,
+            candidate_kwargs=lambda candidate: {"stream_options": {"include_usage": True}} if get_provider_name(candidate) == "openai" else {},
+            messages=[message.dict() for message in messages],
+            stream=True,
+            **config
+        )
+
+        output = []
+        prompt_tokens = completion_tokens = 0
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                output.append(chunk.choices[0].delta.content)
+                yield format_sse({"content": chunk.choices[0].delta.content})
+
+            # Token usage comes with the last chunk (OpenAI: chunk.usage, Groq: chunk.x_groq.usage)
+            usage = chunk.usage or (chunk.model_extra or {}).get("x_groq", {}).get("usage")
+            if usage:
+                usage = usage if isinstance(usage, dict) else usage.model_dump()
+                prompt_tokens = usage.get("prompt_tokens", 0) or 0
+                completion_tokens = usage.get("completion_tokens", 0) or 0
+        runtime_seconds = time.time() - start
+        output = "".join(output)
+
+        # Save the chat log to the database
+        log_ai_chat(source, messages, answered_by, {**config, "stream": True}, output, runtime_seconds, prompt_tokens, completion_tokens)
+
+        response = AI_Response(
+            output=output,
+            chat_history=[Message(**message.dict()) for message in messages + [Message(role="assistant", content=output)]],
+            runtime_seconds=runtime_seconds,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            model=answered_by
         )
+        yield format_sse(response.dict(), event="done")
     except Exception as e:
         print(e)
-        return {"error": str(e)}
\ No newline at end of file
+        if answered_by is not None:  # The stream broke after it was open (failures to open it are counted by the provider layer)
+            upstream_errors.inc(service=get_provider_name(answered_by), status=get_error_status(e))
+        yield format_sse({"error": str(e)}, event="error")
\ No newline at end of file
@@ -0,0 +1,258 @@
+"""
+Type: Shared module
+Description: This module contains the approximate nearest neighbor (ANN) indexes used for verse search.
+
+The indexes work on L2-normalized float32 embedding matrices (see shared.bible.BibleIndex), so a higher dot product
+means a closer verse. They are built offline (app/bible/build_ann_index.py), persisted next to the compiled Bible
+files and only store row numbers: the embedding matrix itself stays in the BibleIndex. An index records the number of
+rows and a checksum of the matrix it was built on, so an index left over from a previous compile is never searched.
+"""
+from abc import ABC, abstractmethod
+import hashlib, time
+import numpy as np
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+from shared.kernels import normalize_rows, top_k, dot_scores
+
+# Rows of the embedding matrix hashed by get_embeddings_checksum (spread over the matrix)
+CHECKSUM_ROWS = 64
+
+
+def get_embeddings_checksum(embeddings: np.ndarray) -> str:
+    """
+    Get a checksum of an embedding matrix from its shape and a sample of its rows (cheap on a memory-mapped matrix)
+    """
+    digest = hashlib.blake2b(str(embeddings.shape).encode(), digest_size=16)
+    if len(embeddings):
+        for row in np.unique(np.linspace(0, len(embeddings) - 1, CHECKSUM_ROWS).astype(np.int64)):
+            digest.update(np.ascontiguousarray(embeddings[row], dtype=np.float32).tobytes())
+    return digest.hexdigest()
+
+
+"""
+======================================================= INDEXES =======================================================
+"""
+class ANNIndex(ABC):
+    """
+    Base class for approximate nearest neighbor indexes
+    - n_rows: The number of rows of the embedding matrix the index was built on
+    - checksum: The checksum of that matrix (see get_embeddings_checksum, "" = unknown)
+
+    Subclasses implement build, search, save, load, arrays and from_arrays, and register themselves in ann_index_types.
+    """
+    kind = "base"
+    n_rows: int
+    checksum: str
+
+    @classmethod
+    @abstractmethod
+    def build(cls, embeddings: np.ndarray, **kwargs) -> "ANNIndex":
+        pass
+
+    def matches(self, embeddings: np.ndarray) -> bool:
+        """
+        Check whether the index was built on an embedding matrix (an index from another compile may point past its rows)
+        """
+        return self.n_rows == len(embeddings) and self.checksum == get_embeddings_checksum(embeddings)
+
+    @abstractmethod
+    def search(self, embeddings: np.ndarray, query: np.ndarray, k: int, **kwargs) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the (approximately) closest rows to a normalized query
+        - embeddings: The normalized embedding matrix the index was built on
+        - query: The normalized query vector
+        - k: The number of rows to return
+
+        Returns (rows, similarities) ordered from best to worst
+        """
+
+    @abstractmethod
+    def save(self, path: str) -> None:
+        pass
+
+    @classmethod
+    @abstractmethod
+    def load(cls, path: str) -> "ANNIndex":
+        pass
+
+    @abstractmethod
+    def arrays(self) -> Dict[str, np.ndarray]:
+        """
+        Returns the arrays of the index by name (see from_arrays)
+        """
+
+    def params(self) -> Dict[str, Any]:
+        """
+        Returns the JSON-serializable settings of the index (see from_arrays)
+        """
+        return {}
+
+    @classmethod
+    @abstractmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], params: Dict[str, Any]) -> "ANNIndex":
+        """
+        Rebuild an index from its arrays (e.g. memory-mapped from a shared index, see shared.shared_index) and settings
+        """
+
+
+class IVFIndex(ANNIndex):
+    """
+    Inverted file index: the verses are clustered with spherical k-means and a query only scans the verses of
+    its nprobe closest clusters
+    - centroids: The normalized cluster centroids [n_lists, dimensionality]
+    - list_offsets: The start of each cluster in list_rows [n_lists + 1]
+    - list_rows: The rows of the verses, grouped by cluster
+    - nprobe: The default number of clusters scanned per query (higher = better recall, slower)
+    - checksum: The checksum of the embedding matrix it was built on (see get_embeddings_checksum)
+    """
+    kind = "ivf"
+
+    def __init__(self, centroids: np.ndarray, list_offsets: np.ndarray, list_rows: np.ndarray, nprobe: int = 16, checksum: str = ""):
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_rows = list_rows
+        self.nprobe = nprobe
+        self.n_rows = len(list_rows)  # Every row is in exactly one list
+        self.checksum = checksum
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, embeddings: np.ndarray, n_lists: Optional[int] = None, iterations: int = 20, nprobe: int = 16, seed: int = 0) -> "IVFIndex":
+        """
+        Build an IVF index with spherical k-means
+        - embeddings: The normalized embedding matrix [n_verses, dimensionality]
+        - n_lists: The number of clusters (default 4 * sqrt(n_verses))
+        - iterations: The number of k-means iterations
+        - nprobe: The default number of clusters scanned per query
+        - seed: The random seed used to pick the initial centroids
+
+        Returns the IVFIndex
+        """
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        n = len(embeddings)
+        n_lists = min(n, n_lists or max(1, int(4 * np.sqrt(n))))
+        rng = np.random.default_rng(seed)
+        centroids = embeddings[rng.choice(n, n_lists, replace=False)].copy()
+
+        for _ in range(iterations):
+            assignments = np.argmax(embeddings @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, embeddings)
+            counts = np.bincount(assignments, minlength=n_lists)
+            # Re-seed empty clusters with random verses
+            empty = counts == 0
+            sums[empty] = embeddings[rng.choice(n, int(empty.sum()), replace=False)]
+            centroids = normalize_rows(sums)
+
+        assignments = np.argmax(embeddings @ centroids.T, axis=1)
+        list_rows = np.argsort(assignments, kind="stable").astype(np.int64)
+        list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=n_lists))]).astype(np.int64)
+        return cls(centroids, list_offsets, list_rows, nprobe, get_embeddings_checksum(embeddings))
+
+    def search(self, embeddings: np.ndarray, query: np.ndarray, k: int, nprobe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the (approximately) closest rows to a normalized query
+        - embeddings: The normalized embedding matrix the index was built on
+        - query: The normalized query vector
+        - k: The number of rows to return
+        - nprobe: The number of clusters to scan (default self.nprobe)
+
+        Returns (rows, similarities) ordered from best to worst
+        """
+        nprobe = min(self.n_lists, nprobe or self.nprobe)
+        probes = top_k(self.centroids @ query, nprobe)
+        candidates = np.concatenate([self.list_rows[self.list_offsets[i]:self.list_offsets[i + 1]] for i in probes])
+        candidates.sort()  # Sequential access into the (possibly memory-mapped) embedding matrix
+        scores = dot_scores(embeddings[candidates], query)
+        best = top_k(scores, k)
+        return candidates[best], scores[best]
+
+    def save(self, path: str) -> None:
+        with open(path, "wb") as f:
+            np.savez(f, kind=self.kind, centroids=self.centroids, list_offsets=self.list_offsets, list_rows=self.list_rows, nprobe=self.nprobe,
+                     n_rows=self.n_rows, checksum=self.checksum)
+
+    @classmethod
+    def load(cls, path: str) -> "IVFIndex":
+        data = np.load(path)
+        checksum = str(data["checksum"]) if "checksum" in data.files else ""  # Indexes saved before the checksum never match
+        index = cls(data["centroids"], data["list_offsets"], data["list_rows"], int(data["nprobe"]), checksum)
+        if "n_rows" in data.files and int(data["n_rows"]) != index.n_rows:
+            raise ValueError(f"Invalid IVF index {path}: {index.n_rows} rows in the lists, {int(data['n_rows'])} expected")
+        return index
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {"centroids": self.centroids, "list_offsets": self.list_offsets, "list_rows": self.list_rows}
+
+    def params(self) -> Dict[str, Any]:
+        return {"nprobe": self.nprobe, "checksum": self.checksum}
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], params: Dict[str, Any]) -> "IVFIndex":
+        return cls(arrays["centroids"], arrays["list_offsets"], arrays["list_rows"], int(params["nprobe"]), params.get("checksum", ""))
+
+
+# Registered index types (kind -> class)
+ann_index_types: Dict[str, Type[ANNIndex]] = {
+    IVFIndex.kind: IVFIndex,
+}
+
+
+def load_ann_index(path: str) -> ANNIndex:
+    """
+    Load a persisted ANN index of any registered type
+    - path: The path to the index file
+
+    Returns the ANN index
+    """
+    kind = str(np.load(path)["kind"])
+    if kind not in ann_index_types:
+        raise ValueError(f"Unknown ANN index type: {kind}")
+    return ann_index_types[kind].load(path)
+
+
+def ann_index_from_arrays(kind: str, arrays: Dict[str, np.ndarray], params: Dict[str, Any]) -> ANNIndex:
+    """
+    Rebuild an ANN index of any registered type from its arrays and settings (see ANNIndex.from_arrays)
+    - kind: The index type
+    - arrays: The arrays of the index by name
+    - params: The settings of the index
+
+    Returns the ANN index
+    """
+    if kind not in ann_index_types:
+        raise ValueError(f"Unknown ANN index type: {kind}")
+    return ann_index_types[kind].from_arrays(arrays, params)
+
+
+"""
+======================================================= EVALUATION =======================================================
+"""
+def recall_report(index: ANNIndex, embeddings: np.ndarray, queries: np.ndarray, k: int = 10, settings: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+    """
+    Measure recall@k and latency of an ANN index against the exact (brute-force) search
+    - index: The ANN index to evaluate
+    - embeddings: The normalized embedding matrix the index was built on
+    - queries: The normalized query vectors [n_queries, dimensionality]
+    - k: The number of results per query
+    - settings: The search settings to evaluate (e.g. [{"nprobe": 4}, {"nprobe": 16}], None = the index defaults)
+
+    Returns one {"setting", "recall_at_k", "avg_ms", "exact_avg_ms"} row per setting
+    """
+    start = time.perf_counter()
+    exact = [set(top_k(embeddings @ query, k).tolist()) for query in queries]
+    exact_avg_ms = 1000 * (time.perf_counter() - start) / len(queries)
+
+    if settings is None:
+        settings = [{}]
+    report = []
+    for setting in settings:
+        start = time.perf_counter()
+        found = [index.search(embeddings, query, k, **setting)[0] for query in queries]
+        avg_ms = 1000 * (time.perf_counter() - start) / len(queries)
+        recall = np.mean([len(truth.intersection(rows.tolist())) / max(1, len(truth)) for truth, rows in zip(exact, found)])
+        report.append({"setting": setting, "recall_at_k": float(recall), "avg_ms": avg_ms, "exact_avg_ms": exact_avg_ms})
+    return report
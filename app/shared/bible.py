@@ -1,16 +1,30 @@
-import json, time, os, requests
+import json, time, os, threading, asyncio, hashlib, requests
+import httpx
 import google.auth
 import google.auth.transport.requests
 from google.oauth2 import service_account
 import numpy as np
 
-from pydantic import BaseModel, Field
-from typing import List, Dict, Any, Union, Optional
-from numba import njit
+from pydantic import BaseModel, Field, TypeAdapter
+from typing import List, Dict, Any, Union, Optional, Tuple
+from datetime import datetime, timedelta, timezone
+
+from sqlmodel import select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
 from shared.secrets import get_secret
-from db.models import Bible_Search_Log
+from shared.cache import LRUCache
+from shared.version_store import VersionStore
+from shared.shared_index import SHARED_INDEX_DIR, get_shared_index_path, publish_shared_index, attach_shared_index
+from shared.metrics import Trace, register_cache, upstream_seconds, upstream_errors, get_error_status, CallbackMetric
+from shared.ann import ANNIndex, load_ann_index, ann_index_from_arrays
+from shared.lexical import BM25Index, reciprocal_rank_fusion
+from shared.references import BibleReference, parse_reference, normalize_book_name
+from shared.verse_table import VerseTable, PositionalIndex
+from shared.kernels import normalize_rows, top_k, dot_scores, quantize_embeddings, score_quantized
+from db.models import Bible_Search_Log, Embedding_Cache
 from db.controller import get_db
+from db.log_writer import log_writer
 
 """
 ======================================================= CONFIG =======================================================
@@ -19,6 +33,41 @@ from db.controller import get_db
 bible_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "./bibles")
 all_bibles = os.listdir(bible_dir)
 
+# Compiled versions (see app/bible/compile_bible.py) live in bibles/compiled as
+# {version}.embeddings.npy (normalized float32 matrix) + {version}.verses.json (verse records, no embeddings)
+compiled_bible_dir = os.path.join(bible_dir, "compiled")
+EMBEDDINGS_SUFFIX = ".embeddings.npy"
+VERSES_SUFFIX = ".verses.json"
+ANN_SUFFIX = ".ann.npz"  # Optional approximate nearest neighbor index (see app/bible/build_ann_index.py)
+
+# In-memory storage of the embeddings of compiled versions used for the first-pass scan: "float32", "float16" or "int8"
+# The compact matrices are 2-4x smaller than float32 (which stays memory-mapped and is only read to re-rank the candidates)
+EMBEDDING_STORAGE = "int8"
+RERANK_FACTOR = 10  # Candidates re-ranked exactly per requested result
+
+# Bounds of the max_results and context_size parameters of the search routes
+MAX_RESULTS_LIMIT = 100
+MAX_CONTEXT_SIZE = 20
+
+# Verses taken from each ranking (semantic and lexical) before the reciprocal rank fusion of mode="hybrid"
+HYBRID_CANDIDATES = 50
+
+# Serialized search results of /api/bible/search, keyed on the query and its parameters (see search_bible_json_async)
+RESULT_CACHE_SIZE = 4096
+RESULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+RESULT_CACHE_TTL_SECONDS = 60 * 60
+RESULT_CACHE_CONTROL = "public, max-age=300"  # Browsers and the CDN revalidate with the ETag once this expires
+# How long the fingerprint of a version's data files is reused before they are stat-ed again (see check_bible_version)
+FINGERPRINT_CHECK_SECONDS = 2.0
+
+# Memory budget of the loaded versions of a worker (resident bytes, see BibleIndex.measure_memory): the least recently
+# used versions are evicted past it, except the pinned ones (comma separated)
+BIBLE_MEMORY_BUDGET_MB = int(os.environ.get("BIBLE_MEMORY_BUDGET_MB", "1024"))
+BIBLE_PINNED_VERSIONS = os.environ.get("BIBLE_PINNED_VERSIONS", "kjv")
+
+# Layout of the published indexes (see BibleIndex.publish): a worker ignores a publication with another layout
+SHARED_INDEX_LAYOUT = 2
+
 # GCP Service Account Key
 gcp_key = get_secret("VERTEX_AI_SERVICE_ACCOUNT")
 
@@ -26,20 +75,84 @@ gcp_key = get_secret("VERTEX_AI_SERVICE_ACCOUNT")
 """
 ======================================================= GOOGLE HELPERS =======================================================
 """
-def get_gcp_bearer_token() -> str:
+class GCPTokenProvider:
     """
-    Get a Google Cloud Platform (GCP) Bearer Token for authentication
+    Thread-safe cache for a GCP service account bearer token
+    - service_account_info: The service account key (dict)
+    - scopes: The OAuth scopes to request
+    - refresh_margin_seconds: How long before the token expires it gets refreshed
 
-    Returns a GCP Bearer Token
+    The credentials are built once and the token is reused until shortly before it expires.
+    Only one thread refreshes at a time; the others wait for (and reuse) its token.
     """
-    credentials = service_account.Credentials.from_service_account_info(gcp_key)
-    credentials = credentials.with_scopes(["https://www.googleapis.com/auth/cloud-platform"])
-    credentials.refresh(google.auth.transport.requests.Request())
-    token = credentials.token
-    return token
+    def __init__(self, service_account_info: Dict[str, Any], scopes: List[str], refresh_margin_seconds: int = 300):
+        self.service_account_info = service_account_info
+        self.scopes = scopes
+        self.refresh_margin = timedelta(seconds=refresh_margin_seconds)
+        self.refresh_count = 0
+        self._credentials = None
+        self._lock = threading.Lock()
+        self._auth_request = google.auth.transport.requests.Request(session=requests.Session())
+
+    def is_fresh(self) -> bool:
+        """
+        Check if the cached token is valid for longer than the refresh margin
+        """
+        credentials = self._credentials
+        if credentials is None or not credentials.token or credentials.expiry is None:
+            return False
+        now = datetime.now(timezone.utc).replace(tzinfo=None)  # google-auth expiries are naive UTC
+        return credentials.expiry - self.refresh_margin > now
 
+    def get_token(self, force_refresh: bool = False) -> str:
+        """
+        Get a bearer token, refreshing it only when it is missing, about to expire or force_refresh is set
 
-def get_text_embeddings(
+        Returns a GCP Bearer Token
+        """
+        if not force_refresh and self.is_fresh():
+            return self._credentials.token
+        with self._lock:
+            # Another thread may have refreshed while we waited for the lock
+            if not force_refresh and self.is_fresh():
+                return self._credentials.token
+            if self._credentials is None:
+                credentials = service_account.Credentials.from_service_account_info(self.service_account_info)
+                self._credentials = credentials.with_scopes(self.scopes)
+            self._credentials.refresh(self._auth_request)
+            self.refresh_count += 1
+            return self._credentials.token
+
+
+gcp_token_provider = GCPTokenProvider(gcp_key, ["https://www.googleapis.com/auth/cloud-platform"])
+
+
+def get_vertex_embeddings_endpoint(model_name: str) -> str:
+    """
+    Get the Vertex AI prediction endpoint of an embedding model
+    """
+    location = "us-central1"
+    project_id = "bible-explorer-gcp-project"
+    return f"https://{location}-aiplatform.googleapis.com/v1/projects/{project_id}/locations/{location}/publishers/google/models/{model_name}:predict"
+
+
+# Keep-alive connection pool for the Vertex AI endpoint (saves a TCP + TLS handshake per request)
+vertex_async_client = httpx.AsyncClient(timeout=30, limits=httpx.Limits(max_connections=100, max_keepalive_connections=32))
+
+
+async def get_gcp_bearer_token_async(force_refresh: bool = False) -> str:
+    """
+    Get a Google Cloud Platform (GCP) Bearer Token without blocking the event loop
+    - force_refresh: Whether to refresh the token even if the cached one is still valid
+
+    Returns a GCP Bearer Token (refreshes run in a worker thread, cached tokens are returned directly)
+    """
+    if not force_refresh and gcp_token_provider.is_fresh():
+        return gcp_token_provider.get_token()
+    return await asyncio.to_thread(gcp_token_provider.get_token, force_refresh)
+
+
+async def get_text_embeddings_async(
     texts: List[str],
     task: str = "RETRIEVAL_DOCUMENT",
     model_name: str = "text-embedding-004",
@@ -54,13 +167,7 @@ def get_text_embeddings(
 
     Returns a list of embeddings for each text
     """
-    location = "us-central1"
-    project_id = "bible-explorer-gcp-project"
-    endpoint = f"https://{location}-aiplatform.googleapis.com/v1/projects/{project_id}/locations/{location}/publishers/google/models/{model_name}:predict"
-    headers = {
-        "Authorization": f"Bearer {get_gcp_bearer_token()}",
-        "Content-Type": "application/json",
-    }
+    endpoint = get_vertex_embeddings_endpoint(model_name)
     data = {
         "instances": [{
             "task_type": task,
@@ -68,59 +175,446 @@ def get_text_embeddings(
         } for text in texts],
         "parameters": {"outputDimensionality": dimensionality},
     }
-    response = requests.post(endpoint, headers=headers, json=data)
+    response = await vertex_async_client.post(endpoint, headers={"Authorization": f"Bearer {await get_gcp_bearer_token_async()}"}, json=data)
+    if response.status_code == 401:
+        # The token was revoked or expired early, refresh it and retry once
+        response = await vertex_async_client.post(endpoint, headers={"Authorization": f"Bearer {await get_gcp_bearer_token_async(force_refresh=True)}"}, json=data)
     response.raise_for_status()
     response = response.json()
     embeddings = [prediction["embeddings"]["values"] for prediction in response["predictions"]]
     return embeddings
 
+"""
+======================================================= EMBEDDING CACHE =======================================================
+"""
+# Query embeddings are cached in memory (LRU) and, optionally, in the Embedding_Cache table so they survive restarts
+EMBEDDING_CACHE_SIZE = 10_000
+EMBEDDING_CACHE_PERSIST = True
+embedding_cache = LRUCache(max_items=EMBEDDING_CACHE_SIZE)
+embedding_cache_counters = {"persistent_hits": 0, "persistent_misses": 0}
+register_cache("embedding", embedding_cache)
+CallbackMetric("embedding_cache_persistent_total", "Lookups in the persistent (SQLite) embedding cache", ["result"],
+               lambda: {("hit",): embedding_cache_counters["persistent_hits"], ("miss",): embedding_cache_counters["persistent_misses"]}, kind="counter")
+
+
+def normalize_query_text(text: str) -> str:
+    """
+    Normalize a query so that trivially different spellings share a cache entry (case and whitespace)
+    """
+    return " ".join(text.split()).casefold()
+
+
+def get_embedding_cache_key(text: str, task: str, model_name: str, dimensionality: Optional[int]) -> str:
+    """
+    Get the cache key of an embedding: (normalized text, task, model, dimensionality)
+    """
+    return json.dumps([text, task, model_name, dimensionality])
+
+
+def get_embedding_cache_keys(texts: List[str], task: str, model_name: str, dimensionality: Optional[int]) -> List[str]:
+    """
+    Build the embedding cache keys of texts (only the keys are normalized, the texts are embedded as they were written)
+
+    Returns the cache keys
+    """
+    return [get_embedding_cache_key(normalize_query_text(text), task, model_name, dimensionality) for text in texts]
+
+
+def load_persisted_embeddings(keys: List[str]) -> Dict[str, List[float]]:
+    """
+    Look up embeddings in the persistent tier (Embedding_Cache table), promoting the hits into the in-memory LRU
+    - keys: The cache keys to look up
+
+    Returns {cache key: embedding} for the keys that were found
+    """
+    with get_db() as db:
+        rows = db.exec(select(Embedding_Cache).where(Embedding_Cache.cache_key.in_(keys))).all()
+    embeddings = {row.cache_key: json.loads(row.embedding) for row in rows}
+    for key, embedding in embeddings.items():
+        embedding_cache.set(key, embedding)
+    embedding_cache_counters["persistent_hits"] += len(embeddings)
+    embedding_cache_counters["persistent_misses"] += len(keys) - len(embeddings)
+    return embeddings
+
+
+def persist_embeddings(keys: List[str], texts: List[str], embeddings: List[List[float]], task: str, model_name: str, dimensionality: Optional[int]) -> None:
+    """
+    Save newly fetched embeddings to the persistent tier (Embedding_Cache table)
+
+    Rows are inserted with INSERT OR IGNORE: a key already persisted by a concurrent request is skipped, the others are still saved
+    """
+    rows = [Embedding_Cache(
+        cache_key=key,
+        text=text,
+        task=task,
+        model=model_name,
+        dimensionality=dimensionality,
+        embedding=json.dumps(embedding),
+    ).model_dump(exclude={"id"}) for key, text, embedding in zip(keys, texts, embeddings)]
+    with get_db() as db:
+        db.exec(sqlite_insert(Embedding_Cache).values(rows).on_conflict_do_nothing(index_elements=["cache_key"]))
+        db.commit()
+
+
+async def get_cached_text_embeddings_async(
+    texts: List[str],
+    task: str = "RETRIEVAL_QUERY",
+    model_name: str = "text-embedding-004",
+    dimensionality: Optional[int] = 256,
+) -> List[List[float]]:
+    """
+    Get text embeddings through the embedding cache, only calling the API for the texts that miss every tier
+    (SQLite access runs in a worker thread)
+    - texts: List of texts to get embeddings for (cached by their normalize_query_text form)
+    - task: The task type of the model
+    - model_name: The name of the embedding model to use
+    - dimensionality: The dimensionality of the embeddings to return
+
+    Returns a list of embeddings for each text
+    """
+    keys = get_embedding_cache_keys(texts, task, model_name, dimensionality)
+
+    # 1. In-memory LRU
+    embeddings = {key: embedding_cache.get(key) for key in dict.fromkeys(keys)}
+    missing = [key for key, embedding in embeddings.items() if embedding is None]
+
+    # 2. Persistent tier (SQLite)
+    if missing and EMBEDDING_CACHE_PERSIST:
+        embeddings.update(await asyncio.to_thread(load_persisted_embeddings, missing))
+        missing = [key for key in missing if embeddings[key] is None]
+
+    # 3. Embedding API (one request for all the remaining texts)
+    if missing:
+        missing_texts = [texts[keys.index(key)] for key in missing]
+        try:
+            with upstream_seconds.time(service="vertex"):
+                new_embeddings = await get_text_embeddings_async(missing_texts, task, model_name, dimensionality)
+        except Exception as e:
+            upstream_errors.inc(service="vertex", status=get_error_status(e))
+            raise
+        for key, embedding in zip(missing, new_embeddings):
+            embeddings[key] = embedding
+            embedding_cache.set(key, embedding)
+        if EMBEDDING_CACHE_PERSIST:
+            await asyncio.to_thread(persist_embeddings, missing, missing_texts, new_embeddings, task, model_name, dimensionality)
+
+    return [embeddings[key] for key in keys]
+
+
+def get_embedding_cache_stats() -> Dict[str, Any]:
+    """
+    Get the hit/miss counters of the embedding cache
+
+    Returns the in-memory LRU stats plus the persistent tier counters
+    """
+    return {**embedding_cache.stats(), **embedding_cache_counters}
+
+
 """
 ======================================================= SEARCH HELPERS =======================================================
 """
-@njit(parallel=True)
-def l2_distance_numba(search_vector, verse_vectors) -> np.ndarray:
-    """
-    Calculate the L2 distance between a search vector and a list of verse vectors
-    - search_vector: The search vector to compare to
-    - verse_vectors: The list of verse vectors to compare to
-
-    Returns a list of L2 distances
-    """
-    similarities = np.zeros(len(verse_vectors))
-    for i in range(len(verse_vectors)):
-        # L2 Distance = sqrt(sum((a - b)^2)
-        cur_vector = verse_vectors[i]
-        distance = 0
-        for j in range(len(search_vector)):
-            distance += (search_vector[j] - cur_vector[j]) ** 2
-        similarities[i] = np.sqrt(distance)
-    return similarities
-
-
-@njit(parallel=True)
-def cosine_distance_numba(search_vector, verse_vectors) -> np.ndarray:
-    """
-    Calculate the cosine distance between a search vector and a list of verse vectors
-    - search_vector: The search vector to compare to
-    - verse_vectors: The list of verse vectors to compare to
-
-    Returns a list of cosine distances
-    """
-    similarities = np.zeros(len(verse_vectors))
-    for i in range(len(verse_vectors)):
-        # Cosine Distance = 1 - cos(theta) = 1 - (a . b) / (||a|| ||b||)
-        cur_vector = verse_vectors[i]
-        dot_product = 0
-        norm_a = 0
-        norm_b = 0
-        for j in range(len(search_vector)):
-            dot_product += search_vector[j] * cur_vector[j]
-            norm_a += search_vector[j] ** 2
-            norm_b += cur_vector[j] ** 2
-        norm_a = np.sqrt(norm_a)
-        norm_b = np.sqrt(norm_b)
-        similarities[i] = 1 - dot_product / (norm_a * norm_b)
-    return similarities
+def relative_similarities(similarities: np.ndarray) -> np.ndarray:
+    """
+    Rescale the similarities of a result set to 0-1 (i.e. first is 100% match, last is 0% match)
+    - similarities: The similarities of the results, ordered from best to worst
+
+    Returns the relative similarities (all 0 when every similarity is the same)
+    """
+    if len(similarities) == 0:
+        return similarities
+    max_similarity = similarities[0]
+    min_similarity = similarities[-1]
+    if max_similarity - min_similarity == 0:
+        return np.zeros(len(similarities))
+    return (similarities - min_similarity) / (max_similarity - min_similarity)
+
+
+"""
+======================================================= INDEX =======================================================
+"""
+class BibleIndex:
+    """
+    Search index for a single Bible version
+    - version: The Bible version name
+    - metadata: The metadata block of the Bible file
+    - verses: The verse records (book_name, book, chapter, verse, text) in file order, without embeddings, as a
+      VerseTable (a list of records is converted)
+    - embeddings: Contiguous float32 matrix with one L2-normalized embedding per verse (row i <-> verses[i])
+    - positional: The positional index of the verses (built from them when not given)
+
+    Since the rows are normalized up front, scoring a normalized query is a single matrix-vector product.
+
+    The positional index (see shared.verse_table.PositionalIndex) maps a reference to its row and a chapter to its
+    rows. book_aliases maps the version's own book names to their number (used next to the standard names by parse_reference).
+
+    ann_index is the optional approximate nearest neighbor index used for search_mode="approx".
+
+    quantized/scales are the optional compact (float16/int8) copy of the embeddings (see quantize). When set, the exact
+    search scans the compact matrix first and re-ranks the best candidates with the float32 embeddings.
+
+    fingerprint identifies the data files the index was loaded from (see get_bible_fingerprint), memory is the
+    estimate of its size (see measure_memory).
+    """
+    def __init__(self, version: str, metadata: Dict[str, Any], verses: Union[VerseTable, List[Dict[str, Any]]], embeddings: np.ndarray, positional: Optional[PositionalIndex] = None):
+        self.version = version
+        self.metadata = metadata
+        self.verses = verses if isinstance(verses, VerseTable) else VerseTable.from_records(verses)
+        self.positional = positional if positional is not None else PositionalIndex.build(self.verses)
+        self.embeddings = embeddings
+        self.ann_index: Optional[ANNIndex] = None
+        self.storage = "float32"
+        self.quantized: Optional[np.ndarray] = None
+        self.scales: Optional[np.ndarray] = None
+        self.lexical_index: Optional[BM25Index] = None
+        self.fingerprint: Optional[Tuple] = None
+        self.memory: Dict[str, int] = {"resident": 0, "mapped": 0}
+        self.book_aliases = {normalize_book_name(name): book for book, name in self.verses.book_names.items()}
+
+    @classmethod
+    def from_json(cls, version: str, bible: Dict[str, Any]) -> "BibleIndex":
+        """
+        Build an index from a parsed {version}.json Bible
+        - version: The Bible version name
+        - bible: The parsed Bible ({"metadata": {...}, "verses": [{..., "embedding": [...]}, ...]})
+
+        Returns a BibleIndex (the embedding lists are dropped from the verse records once copied into the matrix)
+        """
+        verses = bible["verses"]
+        embeddings = normalize_rows(np.array([verse.pop("embedding") for verse in verses], dtype=np.float32))
+        return cls(version, bible.get("metadata", {}), verses, embeddings)
+
+    @classmethod
+    def from_compiled(cls, version: str, embeddings_path: str, verses_path: str) -> "BibleIndex":
+        """
+        Build an index from the compiled files of a version
+        - version: The Bible version name
+        - embeddings_path: The path to the {version}.embeddings.npy file (rows already normalized)
+        - verses_path: The path to the {version}.verses.json file
+
+        Returns a BibleIndex whose embedding matrix is memory-mapped (read-only), so the pages are shared between worker processes
+        """
+        with open(verses_path, "r") as file:
+            bible = json.load(file)
+        embeddings = np.load(embeddings_path, mmap_mode="r")
+        if embeddings.dtype != np.float32 or len(embeddings) != len(bible["verses"]):
+            raise ValueError(f"Compiled Bible version {version} is invalid: {embeddings.dtype} {embeddings.shape} for {len(bible['verses'])} verses")
+        return cls(version, bible.get("metadata", {}), bible["verses"], embeddings)
+
+    @classmethod
+    def from_shared(cls, version: str, fingerprint: Tuple, root: str = SHARED_INDEX_DIR) -> Optional["BibleIndex"]:
+        """
+        Attach to a version published by the loader process (see publish and shared.shared_index)
+        - version: The Bible version name
+        - fingerprint: The fingerprint of the version's current data files (see get_bible_fingerprint)
+        - root: The shared index directory
+
+        Returns a BibleIndex whose arrays (embeddings, verse records, positional index, lexical index, ANN index) are
+        memory-mapped from shared memory, or None when the version is not published (or was published with another
+        EMBEDDING_STORAGE or SHARED_INDEX_LAYOUT)
+        """
+        attached = attach_shared_index(get_shared_index_path(root, version, fingerprint))
+        if attached is None:
+            return None
+        manifest, arrays = attached
+        if manifest.get("layout") != SHARED_INDEX_LAYOUT:
+            return None
+        if manifest["storage"] != EMBEDDING_STORAGE and manifest["storage"] != "float32":
+            return None
+        parts = {}  # "verses" -> {"books": ..., ...}: the arrays are published as {part}_{name}
+        for key, array in arrays.items():
+            part, _, name = key.partition("_")
+            parts.setdefault(part, {})[name] = array
+        embeddings = arrays["embeddings"] if "embeddings" in arrays else np.load(manifest["embeddings_path"], mmap_mode="r")
+        verses = VerseTable.from_arrays(parts["verses"], manifest["book_names"])
+        index = cls(version, manifest["metadata"], verses, embeddings, PositionalIndex.from_arrays(parts["positional"]))
+        index.storage = manifest["storage"]
+        index.quantized, index.scales = arrays.get("quantized"), arrays.get("scales")
+        index.lexical_index = BM25Index.from_arrays(verses.texts, **parts["lexical"])
+        if "ann" in manifest:
+            index.ann_index = ann_index_from_arrays(manifest["ann"]["kind"], parts["ann"], manifest["ann"]["params"])
+        return index
+
+    def publish(self, root: str) -> str:
+        """
+        Publish the index to shared memory for the worker processes (see from_shared)
+        - root: The shared index directory
+
+        Everything the workers search is published as arrays: the verse records, the positional index, the lexical index
+        and the ANN index. The float32 matrix of a compiled version is not copied: it is already memory-mapped, the
+        workers map the same file.
+
+        Returns the directory the index was published to
+        """
+        if self.lexical_index is None:
+            self.build_lexical_index()
+        parts = {"verses": self.verses.arrays(), "positional": self.positional.arrays(), "lexical": self.lexical_index.arrays()}
+        manifest = {"layout": SHARED_INDEX_LAYOUT, "metadata": self.metadata, "storage": self.storage, "book_names": self.verses.book_names}
+        if self.ann_index is not None:
+            parts["ann"] = self.ann_index.arrays()
+            manifest["ann"] = {"kind": self.ann_index.kind, "params": self.ann_index.params()}
+        arrays = {f"{part}_{name}": array for part, part_arrays in parts.items() for name, array in part_arrays.items()}
+        if isinstance(self.embeddings, np.memmap):
+            manifest["embeddings_path"] = os.path.abspath(self.embeddings.filename)
+        else:
+            arrays["embeddings"] = self.embeddings
+        if self.quantized is not None:
+            arrays["quantized"] = self.quantized
+        if self.scales is not None:
+            arrays["scales"] = self.scales
+        return publish_shared_index(get_shared_index_path(root, self.version, self.fingerprint), manifest, arrays)
+
+    def score(self, search_embedding: List[float]) -> np.ndarray:
+        """
+        Score every verse against a search embedding
+        - search_embedding: The (un-normalized) embedding of the search text
+
+        Returns the cosine similarity of every verse (float32, one per verse)
+        """
+        query = normalize_rows(np.asarray(search_embedding, dtype=np.float32))
+        return dot_scores(self.embeddings, query)
+
+    def quantize(self, storage: str) -> None:
+        """
+        Keep a compact copy of the embeddings for the first-pass scan
+        - storage: "float32" (no compact copy), "float16" or "int8"
+        """
+        self.storage = storage
+        if storage == "float32":
+            self.quantized, self.scales = None, None
+        else:
+            self.quantized, self.scales = quantize_embeddings(self.embeddings, storage)
+
+    def search(self, search_embedding: List[float], k: int, search_mode: str = "exact", nprobe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the verses closest to a search embedding
+        - search_embedding: The (un-normalized) embedding of the search text
+        - k: The number of verses to return
+        - search_mode: "exact" (score every verse) or "approx" (ANN index, falls back to exact when the version has none)
+        - nprobe: The number of ANN clusters to scan (approx only, None = the index default)
+
+        Returns (rows, similarities) ordered from best to worst
+        """
+        if search_mode == "approx" and self.ann_index is not None:
+            query = normalize_rows(np.asarray(search_embedding, dtype=np.float32))
+            return self.ann_index.search(self.embeddings, query, k, nprobe=nprobe)
+        if self.quantized is not None:
+            # First pass on the compact matrix, then exact float32 re-ranking of the best candidates
+            query = normalize_rows(np.asarray(search_embedding, dtype=np.float32))
+            candidates = np.sort(top_k(score_quantized(self.quantized, self.scales, query), k * RERANK_FACTOR))
+            similarities = dot_scores(self.embeddings[candidates], query)
+            best = top_k(similarities, k)
+            return candidates[best], similarities[best]
+        similarities = self.score(search_embedding)
+        rows = top_k(similarities, k)
+        return rows, similarities[rows]
+
+    def build_lexical_index(self) -> None:
+        """
+        Build the BM25 inverted index of the verse texts (used by mode="lexical" and mode="hybrid")
+        """
+        self.lexical_index = BM25Index(self.verses.texts)
+
+    def lexical_search(self, search_text: str, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the verses whose text best matches the words of a search text (BM25, no embedding needed)
+        - search_text: The text to search for
+        - k: The number of verses to return
+
+        Returns (rows, BM25 scores) ordered from best to worst (fewer than k when fewer verses contain a search word)
+        """
+        if self.lexical_index is None:
+            self.build_lexical_index()
+        return self.lexical_index.search(search_text, k)
+
+    def score_batch(self, search_embeddings: List[List[float]]) -> np.ndarray:
+        """
+        Score every verse against several search embeddings at once (one matrix-matrix product)
+        - search_embeddings: The (un-normalized) embeddings of the search texts
+
+        Returns the cosine similarities as a [n_queries, n_verses] float32 matrix
+        """
+        queries = normalize_rows(np.asarray(search_embeddings, dtype=np.float32))
+        return dot_scores(self.embeddings, queries)
+
+    def get_row(self, book: int, chapter: int, verse: int) -> Optional[int]:
+        """
+        Get the row of a verse
+        - book: The book number
+        - chapter: The chapter number
+        - verse: The verse number
+
+        Returns the row of the verse or None if the verse does not exist in this version
+        """
+        return self.positional.get_row(book, chapter, verse)
+
+    def parse_reference(self, text: str, strict: bool = False) -> Optional[BibleReference]:
+        """
+        Parse a Bible reference ("John 3:16", "Ps 23"), also accepting the book names of this version
+        - strict: Reject the short texts that may be ordinary queries ("is 53"), see shared.references.parse_reference
+
+        Returns the BibleReference, or None when the text is not shaped like a reference
+        """
+        return parse_reference(text, self.book_aliases, strict)
+
+    def get_passage_rows(self, reference: BibleReference) -> np.ndarray:
+        """
+        Get the rows of the verses of a reference (rows are in canonical order, so a passage is a contiguous slice)
+        - reference: The parsed reference
+
+        Returns the rows of the passage (empty when the first chapter or verse does not exist in this version).
+        A range ending on a verse or chapter this version doesn't have is cut at the end of the last chapter found.
+        """
+        end_chapter = reference.end_chapter if reference.end_chapter is not None else reference.chapter
+        first_chapter = self.positional.get_chapter(reference.book, reference.chapter)
+        last_chapter = self.positional.get_chapter(reference.book, end_chapter)
+        if first_chapter is None:
+            return np.empty(0, dtype=np.int64)
+        if reference.verse is None:
+            start = first_chapter[0]
+        else:
+            start = self.positional.get_row(reference.book, reference.chapter, reference.verse)
+            if start is None:
+                return np.empty(0, dtype=np.int64)
+
+        end_row = self.positional.get_row(reference.book, end_chapter, reference.end_verse) if reference.end_verse is not None else None
+        stop = end_row + 1 if end_row is not None else (last_chapter or first_chapter)[1]
+        return np.arange(start, max(start + 1, stop), dtype=np.int64)
+
+    def measure_memory(self) -> Dict[str, int]:
+        """
+        Estimate the memory used by the index (call it once the index is complete, the result is kept in self.memory)
+
+        Returns {"resident": bytes held by this process, "mapped": bytes of the memory-mapped files (shared page cache, not budgeted)}
+        """
+        arrays = [self.embeddings, self.quantized, self.scales]
+        arrays += list(self.verses.arrays().values()) + list(self.positional.arrays().values())
+        if self.lexical_index is not None:
+            arrays += list(self.lexical_index.arrays().values())
+        if self.ann_index is not None:
+            arrays += list(self.ann_index.arrays().values())
+        resident, mapped = 0, 0
+        for array in arrays:
+            if array is None:
+                continue
+            if isinstance(array, np.memmap):
+                mapped += array.nbytes
+            else:
+                resident += array.nbytes
+        self.memory = {"resident": resident, "mapped": mapped}
+        return self.memory
+
+    def get_context(self, row: int, context_size: int) -> List[str]:
+        """
+        Get the text of the verses surrounding a verse, without crossing a chapter boundary
+        - row: The row of the verse
+        - context_size: The number of verses to include before and after the verse
+
+        Returns the texts of the context verses (the verse itself included) in order
+        """
+        first, end = self.positional.get_chapter(int(self.verses.books[row]), int(self.verses.chapters[row]))
+        start = max(first, row - context_size)
+        stop = min(end, row + context_size + 1)
+        return [self.verses.text(i) for i in range(start, stop)]
 
 
 """
@@ -135,10 +629,34 @@ class BibleVerse(BaseModel):
     similarity: float = Field(..., description="The similarity score of the Bible verse")
     relative_similarity: float = Field(..., description="The relative similarity score of the Bible verse")
     context: Optional[List[str]] = Field(None, description="The context of the Bible verse")
+    bible_version: Optional[str] = Field(None, description="The Bible version the verse text comes from")
 
 class BibleSearchResponse(BaseModel):
     verses: List[BibleVerse] = Field(..., description="The list of Bible verses that match the search text")
     notes: List[Dict[str, Any]] = Field(..., description="The notes from the search process")
+    timings: Optional[Dict[str, float]] = Field(None, description="The duration of each search stage in seconds (only with include_timings)")
+
+class BiblePassageResponse(BaseModel):
+    reference: str = Field(..., description="The parsed reference, e.g. John 3:16-18")
+    bible_version: str = Field(..., description="The Bible version the verse texts come from")
+    verses: List[BibleVerse] = Field(..., description="The verses of the passage, in order")
+
+class BibleBatchSearchRequest(BaseModel):
+    search_texts: List[str] = Field(..., min_length=1, max_length=250, description="The texts to search for (embedded together in one request, max 250)")
+    bible_version: str = Field("kjv", description="The Bible version to search in")
+    max_results: int = Field(5, ge=1, le=MAX_RESULTS_LIMIT, description=f"The maximum number of results to return per search text (1-{MAX_RESULTS_LIMIT})")
+    add_context: bool = Field(False, description="Whether to include context around each verse")
+    context_size: int = Field(2, ge=0, le=MAX_CONTEXT_SIZE, description=f"The number of verses to include before and after each verse (0-{MAX_CONTEXT_SIZE})")
+    include_timings: bool = Field(False, description="Whether to return the duration of each search stage")
+
+class BibleBatchSearchResult(BaseModel):
+    search_text: str = Field(..., description="The search text")
+    verses: List[BibleVerse] = Field(..., description="The list of Bible verses that match the search text")
+
+class BibleBatchSearchResponse(BaseModel):
+    results: List[BibleBatchSearchResult] = Field(..., description="The results of each search text, in request order")
+    notes: List[Dict[str, Any]] = Field(..., description="The notes from the search process")
+    timings: Optional[Dict[str, float]] = Field(None, description="The duration of each search stage in seconds (only with include_timings)")
 
 
 """
@@ -154,124 +672,502 @@ A search function that is used for the search endpoint with paramaters:
 - context_size: int // the number of surrounding verses to include in the context (default is 2)
 
 As each bible version gets loaded, we want to cache it in memory so that we don't have to reload it each time
+(within BIBLE_MEMORY_BUDGET_MB, see version_store)
 '''
-bible_cache = {}
-def search_bible(search_text: str, bible_version: str, max_results: int = 5, add_context: bool = True, context_size: int = 2) -> BibleSearchResponse:
+
+def get_bible_fingerprint(bible_version: str) -> Tuple:
+    """
+    Get the fingerprint of the data files of a Bible version (path, size and modification time of each file load_bible_index reads)
+    - bible_version: The Bible version
+
+    Returns a tuple that changes whenever one of the files is replaced or modified (empty when the version has no files)
+    """
+    embeddings_path = os.path.join(compiled_bible_dir, f"{bible_version}{EMBEDDINGS_SUFFIX}")
+    verses_path = os.path.join(compiled_bible_dir, f"{bible_version}{VERSES_SUFFIX}")
+    ann_path = os.path.join(compiled_bible_dir, f"{bible_version}{ANN_SUFFIX}")
+    paths = [embeddings_path, verses_path, ann_path, os.path.join(bible_dir, f"{bible_version}.json")]
+    fingerprint = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        fingerprint.append((os.path.basename(path), stat.st_size, stat.st_mtime_ns))
+    return tuple(fingerprint)
+
+
+# bible_version -> (time.monotonic() of the check, fingerprint)
+fingerprint_checks: Dict[str, Tuple[float, Tuple]] = {}
+
+
+def check_bible_version(bible_version: str) -> Tuple:
+    """
+    Drop the loaded index of a Bible version when its data files changed on disk (the next load reads the new files)
+    - bible_version: The Bible version
+
+    The files are stat-ed at most once per FINGERPRINT_CHECK_SECONDS per version, so the cached searches that call this
+    on the event loop don't hit the filesystem on every request (a change is picked up within that delay).
+
+    Returns the current fingerprint of the version (see get_bible_fingerprint)
+    """
+    now = time.monotonic()
+    checked_at, fingerprint = fingerprint_checks.get(bible_version, (None, None))
+    if checked_at is None or now - checked_at >= FINGERPRINT_CHECK_SECONDS:
+        fingerprint = get_bible_fingerprint(bible_version)
+        fingerprint_checks[bible_version] = (now, fingerprint)
+    bible = version_store.get(bible_version)
+    if bible is not None and bible.fingerprint != fingerprint:
+        print(f"Bible version changed on disk, reloading: {bible_version}")
+        version_store.pop(bible_version)
+    return fingerprint
+
+
+def load_ann(index: BibleIndex) -> None:
+    """
+    Load the ANN index of a version when it has one (see app/bible/build_ann_index.py). An index built on other
+    embeddings (e.g. before the version was recompiled) is skipped: search_mode="approx" falls back to the exact search
+    """
+    ann_path = os.path.join(compiled_bible_dir, f"{index.version}{ANN_SUFFIX}")
+    if not os.path.exists(ann_path):
+        return
+    ann_index = load_ann_index(ann_path)
+    if not ann_index.matches(index.embeddings):
+        print(f"Skipping the ANN index of {index.version}: it was built on other embeddings, rebuild it with app/bible/build_ann_index.py")
+        return
+    index.ann_index = ann_index
+
+
+def read_bible_index(bible_version: str) -> BibleIndex:
+    """
+    Load the search index of a Bible version from its files (uncached, use load_bible_index)
+    - bible_version: The Bible version to load
+
+    Returns the BibleIndex for the version, with its memory estimate
+    """
+    fingerprint = get_bible_fingerprint(bible_version)  # Taken first: a file replaced during the load triggers a reload
+
+    # Attach to the copy published by the loader process when serving with shared indexes (see app/serve.py)
+    index = BibleIndex.from_shared(bible_version, fingerprint) if SHARED_INDEX_DIR else None
+    if index is not None:
+        if index.ann_index is None:
+            load_ann(index)
+        index.fingerprint = fingerprint
+        index.measure_memory()
+        print(f"Attached shared Bible version: {bible_version} ({index.memory['resident'] / 2**20:.1f} MB resident, {index.memory['mapped'] / 2**20:.1f} MB mapped)")
+        return index
+
+    # Load the Bible version (prefer the compiled, memory-mapped format when it exists)
+    print(f"Loading Bible version: {bible_version}")
+    embeddings_path = os.path.join(compiled_bible_dir, f"{bible_version}{EMBEDDINGS_SUFFIX}")
+    verses_path = os.path.join(compiled_bible_dir, f"{bible_version}{VERSES_SUFFIX}")
+    if os.path.exists(embeddings_path) and os.path.exists(verses_path):
+        index = BibleIndex.from_compiled(bible_version, embeddings_path, verses_path)
+        # Only compiled versions get a compact copy: their float32 matrix is memory-mapped, so the re-ranking
+        # reads just the candidate rows and the full matrix doesn't have to stay resident
+        index.quantize(EMBEDDING_STORAGE)
+    else:
+        bible_path = os.path.join(bible_dir, f"{bible_version}.json")
+        with open(bible_path, "r") as file:
+            bible = json.load(file)
+        index = BibleIndex.from_json(bible_version, bible)
+    load_ann(index)
+    index.build_lexical_index()
+    index.fingerprint = fingerprint
+    index.measure_memory()
+    print(f"Loaded Bible version: {bible_version} ({index.memory['resident'] / 2**20:.1f} MB resident, {index.memory['mapped'] / 2**20:.1f} MB mapped)")
+    return index
+
+
+# The loaded versions: byte-accounted, LRU-evicted past the budget, one load at a time per version
+version_store = VersionStore(
+    loader=read_bible_index,
+    sizeof=lambda bible: bible.memory["resident"],
+    max_bytes=BIBLE_MEMORY_BUDGET_MB * 2**20,
+    pinned=[version.strip() for version in BIBLE_PINNED_VERSIONS.split(",") if version.strip()],
+)
+register_cache("bible_versions", version_store)
+CallbackMetric("bible_version_bytes", "Estimated memory of each loaded Bible version", ["version", "kind"],
+               lambda: {(bible_version, kind): size for bible_version, bible in version_store.items() for kind, size in bible.memory.items()})
+
+
+def load_bible_index(bible_version: str) -> BibleIndex:
+    """
+    Get the search index for a Bible version, loading and caching it on first use
+    - bible_version: The Bible version to load
+
+    Concurrent calls for a version that is not loaded yet wait for a single load. Loading a version may evict the
+    least recently used (unpinned) versions to stay within BIBLE_MEMORY_BUDGET_MB.
+
+    Returns the BibleIndex for the version
+    """
+    return version_store.load(bible_version)
+
+
+def build_bible_verses(bible: BibleIndex, rows: np.ndarray, similarities: np.ndarray, add_context: bool = False, context_size: int = 2) -> List[BibleVerse]:
+    """
+    Materialize search results into BibleVerse objects
+    - bible: The BibleIndex the rows belong to
+    - rows: The rows of the result verses, ordered from best to worst
+    - similarities: The similarity of each result row
+    - add_context: Whether to include context around each verse
+    - context_size: The number of verses to include before and after each verse
+
+    Returns a list of BibleVerse
+    """
+    relative = relative_similarities(similarities)
+    return [
+        build_bible_verse(bible, row, similarities[i], relative[i], add_context, context_size)
+        for i, row in enumerate(rows)
+    ]
+
+
+def build_bible_verse(bible: BibleIndex, row: int, similarity: float, relative_similarity: float, add_context: bool = False, context_size: int = 2) -> BibleVerse:
+    """
+    Materialize a single search result into a BibleVerse
+    - bible: The BibleIndex the row belongs to
+    - row: The row of the verse
+    - similarity: The similarity of the verse
+    - relative_similarity: The relative similarity of the verse within its result set
+    - add_context: Whether to include context around the verse
+    - context_size: The number of verses to include before and after the verse
+
+    Returns a BibleVerse
+    """
+    verse = bible.verses[row]
+    return BibleVerse(
+        book_name=verse["book_name"],
+        book_number=verse["book"],
+        chapter=verse["chapter"],
+        verse=verse["verse"],
+        text=verse["text"],
+        similarity=float(similarity),
+        relative_similarity=float(relative_similarity),
+        context=bible.get_context(int(row), context_size) if add_context else None,
+        bible_version=bible.version,
+    )
+
+
+def get_search_log_response(verses: List[BibleVerse]) -> str:
+    """
+    Serialize the results of a search for the response column of Bible_Search_Log
     """
-    Search the Bible for a specific text
+    return json.dumps([{
+        "book": verse.book_number,
+        "chapter": verse.chapter,
+        "verse": verse.verse,
+        "similarity": verse.similarity,
+        "relative_similarity": verse.relative_similarity,
+    } for verse in verses])
+
+
+def log_bible_search(search_text: str, bible_version: str, max_results: int, add_context: bool, context_size: int, verses: Union[List[BibleVerse], str], runtime_seconds: float) -> None:
+    """
+    Queue a search to be saved to the Bible_Search_Log table (written in batches by the background log writer)
+    - verses: The results, or their already serialized log response (see get_search_log_response)
+    """
+    log_writer.enqueue(Bible_Search_Log(
+        search_text=search_text,
+        bible_version=bible_version,
+        max_results=max_results,
+        add_context=add_context,
+        context_size=context_size,
+        response=verses if isinstance(verses, str) else get_search_log_response(verses),
+        runtime_seconds=runtime_seconds
+    ))
+
+
+def rank_bible_verses(bible: BibleIndex, search_embedding: Optional[List[float]], max_results: int, add_context: bool, context_size: int, add_note, search_mode: str = "exact", nprobe: Optional[int] = None, mode: str = "semantic", search_text: Optional[str] = None) -> List[BibleVerse]:
+    """
+    Rank the verses of a Bible version against a search (the CPU part of a search)
+    - bible: The BibleIndex to search
+    - search_embedding: The embedding of the search text (None for mode="lexical")
+    - max_results: The maximum number of results to return
+    - add_context: Whether to include context around each verse
+    - context_size: The number of verses to include before and after each verse
+    - add_note: Callback that records a search note and closes a stage (see shared.metrics.Trace.add_note)
+    - search_mode: "exact" or "approx" (see BibleIndex.search)
+    - nprobe: The number of ANN clusters to scan (approx only)
+    - mode: "semantic" (embeddings), "lexical" (BM25 over the verse texts) or "hybrid" (reciprocal rank fusion of both)
+    - search_text: The text to search for (lexical and hybrid only)
+
+    Returns the top matching verses (similarity = cosine similarity, BM25 score or fused score depending on the mode)
+    """
+    if mode == "lexical":
+        rows, similarities = bible.lexical_search(search_text, max_results)
+        add_note("Selected top verses by BM25", "lexical")
+    elif mode == "hybrid":
+        semantic_rows, _ = bible.search(search_embedding, max(max_results, HYBRID_CANDIDATES), search_mode, nprobe)
+        add_note(f"Selected top verses by similarity ({search_mode})", "score")
+        lexical_rows, _ = bible.lexical_search(search_text, max(max_results, HYBRID_CANDIDATES))
+        add_note("Selected top verses by BM25", "lexical")
+        rows, similarities = reciprocal_rank_fusion([semantic_rows, lexical_rows], max_results)
+        add_note("Fused the rankings", "fusion")
+    else:
+        # Score the verses and select the top matches (exact: one matrix-vector product + partial selection)
+        rows, similarities = bible.search(search_embedding, max_results, search_mode, nprobe)
+        add_note(f"Selected top verses by similarity ({search_mode})", "score")
+    if mode != "lexical" and search_mode == "approx" and bible.ann_index is None:
+        add_note(f"No ANN index for {bible.version}, used exact search")
+
+    # Materialize only the winners (the cached verse records are never mutated)
+    top_verses = build_bible_verses(bible, rows, similarities, add_context, context_size)
+    add_note("Added relative similarity scores" + (" and context" if add_context else ""), "context")
+    return top_verses
+
+
+def lookup_bible_reference(bible: BibleIndex, search_text: str, max_results: int, add_context: bool, context_size: int, add_note) -> Optional[List[BibleVerse]]:
+    """
+    Answer a reference-shaped search ("John 3:16", "Psalm 23") from the positional index (no embedding call)
+    - bible: The BibleIndex to search
+    - search_text: The text to search for
+    - max_results: The maximum number of verses to return (the start of the passage)
+    - add_context: Whether to include context around each verse
+    - context_size: The number of verses to include before and after each verse
+    - add_note: Callback that records a search note and closes a stage (see shared.metrics.Trace.add_note)
+
+    Two-letter book abbreviations only count with a verse ("is 53:5"): "is 53" or "la 1" stay ordinary searches.
+
+    Returns the verses of the passage (similarity 1), or None when the text is not a reference this version has
+    """
+    reference = bible.parse_reference(search_text, strict=True)
+    rows = bible.get_passage_rows(reference) if reference is not None else []
+    if len(rows) == 0:
+        return None
+    top_verses = [build_bible_verse(bible, row, 1.0, 1.0, add_context, context_size) for row in rows[:max_results]]
+    add_note(f"Reference lookup: {reference.label(top_verses[0].book_name)}", "reference")
+    return top_verses
+
+
+async def search_bible_async(search_text: str, bible_version: str, max_results: int = 5, add_context: bool = True, context_size: int = 2, search_mode: str = "exact", nprobe: Optional[int] = None, mode: str = "semantic") -> BibleSearchResponse:
+    """
+    Search the Bible for a specific text (waiting on the embedding API or loading a version never blocks the event loop)
     - search_text: The text to search for
     - bible_version: The Bible version to search in
     - max_results: The maximum number of results to return
     - add_context: Whether to include context around the search text
     - context_size: The number of verses to include before and after the search text
+    - search_mode: "exact" (score every verse) or "approx" (ANN index, when the version has one)
+    - nprobe: The number of ANN clusters to scan (approx only, None = the index default)
+    - mode: "semantic" (embeddings), "lexical" (BM25, no embedding call) or "hybrid" (reciprocal rank fusion of both)
+
+    A search text that is a Bible reference ("John 3:16", "Psalm 23-24") returns the start of that passage instead (any mode).
 
-    Returns a list of verses that match the search text
+    Returns (the verses that match the search text, notes, stage timings in seconds)
     """
-    notes = []
-    start = time.time()
-    def add_note(note):
-        notes.append({
-            "note": note,
-            "elapsed_time": time.time() - start,
-        })
+    trace = Trace("search")
+
+    # Loading a version the first time takes a while, do it in a worker thread
+    bible = version_store.get(bible_version) or await asyncio.to_thread(load_bible_index, bible_version)
+    trace.add_note(f"Loaded Bible version: {bible_version}", "load")
+
+    # Reference-shaped searches ("John 3:16", "Psalm 23") are answered from the positional index, without any network call
+    top_verses = lookup_bible_reference(bible, search_text, max_results, add_context, context_size, trace.add_note)
+    if top_verses is None:
+        # Get the embeddings for the search text (the lexical mode runs locally)
+        search_embedding = None
+        if mode != "lexical":
+            search_embedding = (await get_cached_text_embeddings_async([search_text], "RETRIEVAL_QUERY"))[0]
+            trace.add_note("Got search text embeddings", "embed")
+
+        top_verses = rank_bible_verses(bible, search_embedding, max_results, add_context, context_size, trace.add_note, search_mode, nprobe, mode, search_text)
+
+    # Log the search
+    log_bible_search(search_text, bible_version, max_results, add_context, context_size, top_verses, time.time() - trace.start)
+    trace.add_note("Logged the search", "log")
+
+    trace.finish()
+    return top_verses, trace.notes, trace.timings
+
+
+
+# Cached search results: key -> (serialized verses, serialized log response, ETag)
+search_result_cache = LRUCache(
+    max_items=RESULT_CACHE_SIZE,
+    ttl_seconds=RESULT_CACHE_TTL_SECONDS,
+    max_bytes=RESULT_CACHE_MAX_BYTES,
+    sizeof=lambda entry: len(entry[0]) + len(entry[1]),
+)
+register_cache("search_results", search_result_cache)
+bible_verses_adapter = TypeAdapter(List[BibleVerse])
+
 
-    bible = None
-    # Check if the Bible version is already loaded
-    if bible_version in bible_cache:
-        bible = bible_cache[bible_version]
+async def search_bible_json_async(search_text: str, bible_version: str, max_results: int = 5, add_context: bool = True, context_size: int = 2, search_mode: str = "exact", nprobe: Optional[int] = None, mode: str = "semantic", include_timings: bool = False) -> Tuple[bytes, str, bool]:
+    """
+    Cached version of search_bible_async that returns the serialized BibleSearchResponse (used by the search route)
+    - search_text: The text to search for
+    - bible_version: The Bible version to search in
+    - max_results: The maximum number of results to return
+    - add_context: Whether to include context around the search text
+    - context_size: The number of verses to include before and after the search text
+    - search_mode: "exact" (score every verse) or "approx" (ANN index, when the version has one)
+    - nprobe: The number of ANN clusters to scan (approx only, None = the index default)
+    - mode: "semantic", "lexical" or "hybrid" (see search_bible_async)
+    - include_timings: Whether to include the duration of each search stage
+
+    The verses of a search are serialized once and cached, keyed on the normalized search text, the parameters and
+    the fingerprint of the version's data files (an updated version never serves old results). A cache hit only
+    assembles the response bytes (no embedding call, no numpy). The ETag is a hash of the verses (weak, since the
+    notes and timings differ between two identical results).
+
+    Returns (the JSON body, the ETag, whether the verses came from the cache)
+    """
+    fingerprint = check_bible_version(bible_version)
+    key = (normalize_query_text(search_text), bible_version, fingerprint, max_results, add_context, context_size, search_mode, nprobe, mode)
+    cached = search_result_cache.get(key)
+    if cached is not None:
+        trace = Trace("search")
+        verses_json, log_response, etag = cached
+        trace.add_note("Served from the result cache", "cache")
+        log_bible_search(search_text, bible_version, max_results, add_context, context_size, log_response, time.time() - trace.start)
+        trace.add_note("Logged the search", "log")
+        trace.finish()
+        notes, timings = trace.notes, trace.timings
     else:
-        # Load the Bible version
-        bible_path = os.path.join(bible_dir, f"{bible_version}.json")
-        print(f"Loading Bible version: {bible_version}")
-        with open(bible_path, "r") as file:
-            bible = json.load(file)
-        bible_cache[bible_version] = bible  # Cache the Bible version
-        print(f"Loaded Bible version: {bible_version}")
-    add_note(f"Loaded Bible version: {bible_version}")
-    
-    # Get the embeddings for the search text
-    search_embedding = get_text_embeddings([search_text], "RETRIEVAL_QUERY")[0]
-    add_note("Got search text embeddings")
-    
-    # Get the embeddings for all the verses in the Bible
-    verses = bible["verses"]
-    verse_embeddings = np.array([verse["embedding"] for verse in verses]) # array of verse embeddings [[...], [...], ...]
-    similarities = cosine_distance_numba(np.array(search_embedding), verse_embeddings)
-    add_note("Calculated cosine distances")
-
-    # Map the similarities back to the verses
-    for i, verse in enumerate(verses):
-        verse["similarity"] = 1 - similarities[i]
-
-    # Sort the verses by similarity
-    verses = sorted(verses, key=lambda x: x["similarity"], reverse=True)
-    add_note("Sorted verses by similarity")
-
-    # Get the top matching verses
-    top_verses = verses[:max_results]
-
-    # Add relative matching score (i.e. first is 100% match, last is 0% match)
-    max_similarity = top_verses[0]["similarity"]
-    min_similarity = top_verses[-1]["similarity"]
-    for verse in top_verses:
-        verse["relative_similarity"] = (verse["similarity"] - min_similarity) / (max_similarity - min_similarity) if max_similarity - min_similarity != 0 else 0
-    add_note("Added relative similarity scores")
-    
-    # Get the context for the top matching verses
-    if add_context:
-        for verse in top_verses:
-            book_number = verse["book"]
-            chapter = verse["chapter"]
-            verse_number = verse["verse"]
-            context = []
-            # Get the surrounding verses (context_size before and after)
-            for i in range(verse_number - context_size, verse_number + context_size + 1): 
-                current_verse_number = i
-                # Skip if the verse number is invalid - happens when the verse is at the beginning or end of a chapter
-                if current_verse_number < 1:
-                    continue
-                # Find the verse in the Bible
-                current_verse = next((v for v in bible["verses"] if v["book"] == book_number and v["chapter"] == chapter and v["verse"] == current_verse_number), None)
-                if current_verse:
-                    context.append(current_verse["text"])
-            verse["context"] = context
-        add_note("Added context to verses")
+        verses, notes, timings = await search_bible_async(search_text, bible_version, max_results, add_context, context_size, search_mode, nprobe, mode)
+        verses_json = bible_verses_adapter.dump_json(verses)
+        etag = f'W/"{hashlib.blake2b(verses_json, digest_size=16).hexdigest()}"'
+        search_result_cache.set(key, (verses_json, get_search_log_response(verses), etag))
+
+    body = b'{"verses":' + verses_json + b',"notes":' + json.dumps(notes).encode() + b',"timings":' + (json.dumps(timings).encode() if include_timings else b"null") + b"}"
+    return body, etag, cached is not None
+
+
+async def search_bible_batch_async(search_texts: List[str], bible_version: str, max_results: int = 5, add_context: bool = False, context_size: int = 2) -> Tuple[List[BibleBatchSearchResult], List[Dict[str, Any]], Dict[str, float]]:
+    """
+    Search the Bible for several texts at once
+    - search_texts: The texts to search for
+    - bible_version: The Bible version to search in
+    - max_results: The maximum number of results to return per search text
+    - add_context: Whether to include context around each verse
+    - context_size: The number of verses to include before and after each verse
+
+    All the texts are embedded in a single request and scored with a single matrix-matrix product on the float32
+    embeddings. Unlike a single search, the compact (EMBEDDING_STORAGE) matrix is not scanned and nothing is re-ranked:
+    the similarities are exact, and one pass over the float32 matrix serves every text of the batch, where the compact
+    scan would be repeated once per text.
+
+    Returns (the results of each search text in request order, notes, stage timings in seconds)
+    """
+    trace = Trace("batch_search")
+
+    # Loading a version the first time takes a while, do it in a worker thread
+    bible = version_store.get(bible_version) or await asyncio.to_thread(load_bible_index, bible_version)
+    trace.add_note(f"Loaded Bible version: {bible_version}", "load")
+
+    # Get the embeddings for all the search texts (one request for every cache miss)
+    search_embeddings = await get_cached_text_embeddings_async(search_texts, "RETRIEVAL_QUERY")
+    trace.add_note(f"Got search text embeddings for {len(search_texts)} search texts", "embed")
+
+    # Score all the verses against all the search texts
+    similarities = bible.score_batch(search_embeddings)
+    trace.add_note("Calculated cosine similarities", "score")
+
+    results = []
+    for search_text, query_similarities in zip(search_texts, similarities):
+        rows = top_k(query_similarities, max_results)
+        verses = build_bible_verses(bible, rows, query_similarities[rows], add_context, context_size)
+        results.append(BibleBatchSearchResult(search_text=search_text, verses=verses))
+    trace.add_note("Selected top verses for every search text", "top_k")
+
+    # Log the searches
+    runtime_seconds = time.time() - trace.start
+    for result in results:
+        log_bible_search(result.search_text, bible_version, max_results, add_context, context_size, result.verses, runtime_seconds)
+    trace.add_note("Logged the searches", "log")
+
+    trace.finish()
+    return results, trace.notes, trace.timings
+
+
+async def search_bible_multi_async(search_text: str, bible_versions: List[str], max_results: int = 5, add_context: bool = False, context_size: int = 2) -> BibleSearchResponse:
+    """
+    Search several Bible versions at once with a single query embedding
+    - search_text: The text to search for
+    - bible_versions: The Bible versions to search in
+    - max_results: The maximum number of (distinct) verses to return
+    - add_context: Whether to include context around each verse
+    - context_size: The number of verses to include before and after each verse
+
+    Each version is scored on its own index (compact scan + exact re-ranking, like a single-version search), and the
+    per-version top verses are merged. The versions are deliberately not scored as one stacked matrix: stacking copies
+    every matrix into a second resident array outside the version store's budget (and drops the compact scan), while
+    it saves no work, since every verse of every version is scored once either way. The single query embedding is what
+    replaces the per-version embedding calls. Results are deduplicated by (book, chapter, verse), keeping the text of
+    the best-scoring version.
+
+    Returns (the verses that match the search text, notes, stage timings in seconds)
+    """
+    trace = Trace("multi_search")
+
+    bible_versions = list(dict.fromkeys(bible_versions))
+    bibles = [version_store.get(version) or await asyncio.to_thread(load_bible_index, version) for version in bible_versions]
+    dimensions = {bible.embeddings.shape[1] for bible in bibles}
+    if len(dimensions) != 1:
+        raise ValueError(f"Cannot search versions with different embedding dimensions together: {dimensions}")
+    trace.add_note(f"Loaded Bible versions: {', '.join(bible_versions)}", "load")
+
+    # Get the embeddings for the search text (once for every version)
+    search_embedding = (await get_cached_text_embeddings_async([search_text], "RETRIEVAL_QUERY"))[0]
+    trace.add_note("Got search text embeddings", "embed")
+
+    # Top verses of each version: a verse of the overall top max_results is always in its version's top max_results
+    candidates = []  # (similarity, version index, row)
+    for version_index, bible in enumerate(bibles):
+        rows, similarities = bible.search(search_embedding, max_results)
+        candidates.extend(zip(similarities.tolist(), [version_index] * len(rows), rows.tolist()))
+    trace.add_note("Calculated cosine similarities", "score")
+
+    best = {}  # (book, chapter, verse) -> (bible, row, similarity), first hit = best-scoring version
+    for similarity, version_index, row in sorted(candidates, key=lambda candidate: -candidate[0]):
+        bible = bibles[version_index]
+        verse = bible.verses[row]
+        reference = (verse["book"], verse["chapter"], verse["verse"])
+        if reference not in best:
+            best[reference] = (bible, row, similarity)
+            if len(best) == max_results:
+                break
+    trace.add_note("Selected and deduplicated top verses", "top_k")
+
+    results = list(best.values())
+    relative = relative_similarities(np.array([similarity for _, _, similarity in results]))
+    top_verses = [
+        build_bible_verse(bible, row, similarity, relative[i], add_context, context_size)
+        for i, (bible, row, similarity) in enumerate(results)
+    ]
+    trace.add_note("Added relative similarity scores" + (" and context" if add_context else ""), "context")
 
     # Log the search
-    with get_db() as db:
-        log = Bible_Search_Log(
-            search_text=search_text,
-            bible_version=bible_version,
-            max_results=max_results,
-            add_context=add_context,
-            context_size=context_size,
-            response=json.dumps([{
-                "book": verse["book"],
-                "chapter": verse["chapter"],
-                "verse": verse["verse"],
-                "similarity": verse["similarity"],
-                "relative_similarity": verse["relative_similarity"],
-            } for verse in top_verses]),
-            runtime_seconds=time.time() - start
-        )
-        db.add(log)
-        db.commit()
+    log_bible_search(search_text, ",".join(bible_versions), max_results, add_context, context_size, top_verses, time.time() - trace.start)
+    trace.add_note("Logged the search", "log")
 
-    # Format and return the response
-    print([f"note: {note['note']}, elapsed_time: {note['elapsed_time']:0.2f}s" for note in notes])
-    return [
-        BibleVerse(
-            book_name=verse["book_name"],
-            book_number=verse["book"],
-            chapter=verse["chapter"],
-            verse=verse["verse"],
-            text=verse["text"],
-            similarity=verse["similarity"],
-            relative_similarity=verse["relative_similarity"],
-            context=verse.get("context"),
-        ) for verse in top_verses
-    ], notes
+    trace.finish()
+    return top_verses, trace.notes, trace.timings
+
+
+async def get_bible_passage_async(reference_text: str, bible_version: str, add_context: bool = False, context_size: int = 2) -> Optional[BiblePassageResponse]:
+    """
+    Get the verses of a Bible reference
+    - reference_text: The reference, e.g. "John 3:16", "jn 3:16-18", "Ps 23", "1 Cor 13:4-7", "Gen 1:1-2:3"
+    - bible_version: The Bible version to read from
+    - add_context: Whether to include context around each verse
+    - context_size: The number of verses to include before and after each verse
+
+    Returns the passage, or None when the text is not a reference or the version does not have it
+    """
+    trace = Trace("passage")
+
+    bible = version_store.get(bible_version) or await asyncio.to_thread(load_bible_index, bible_version)
+    trace.add_note(f"Loaded Bible version: {bible_version}", "load")
+
+    reference = bible.parse_reference(reference_text)
+    rows = bible.get_passage_rows(reference) if reference is not None else []
+    verses = [build_bible_verse(bible, row, 1.0, 1.0, add_context, context_size) for row in rows]
+    trace.add_note(f"Looked up {len(verses)} verses", "reference")
 
+    trace.finish()
+    if not verses:
+        return None
+    return BiblePassageResponse(reference=reference.label(verses[0].book_name), bible_version=bible_version, verses=verses)
 
 
 def get_bible_versions() -> List[str]:
@@ -280,4 +1176,8 @@ def get_bible_versions() -> List[str]:
 
     Returns a list of Bible versions
     """
-    return [bible.replace(".json", "") for bible in all_bibles]
+    versions = [bible.replace(".json", "") for bible in all_bibles if bible.endswith(".json")]
+    if os.path.isdir(compiled_bible_dir):
+        compiled = [bible.replace(VERSES_SUFFIX, "") for bible in os.listdir(compiled_bible_dir) if bible.endswith(VERSES_SUFFIX)]
+        versions += [version for version in compiled if version not in versions]
+    return versions
@@ -0,0 +1,116 @@
+"""
+Type: Shared module
+Description: This module contains the in-memory caches used across the application.
+"""
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+import threading, time
+
+"""
+======================================================= CACHES =======================================================
+"""
+class LRUCache:
+    """
+    Thread-safe, bounded least-recently-used cache with hit/miss counters
+    - max_items: The maximum number of entries to keep (the least recently used entry is evicted first)
+    - ttl_seconds: How long an entry stays valid after it was set (None = forever)
+    - max_bytes: The maximum total size of the entries (None = no size limit, only max_items)
+    - sizeof: Returns the size in bytes of a value (used with max_bytes, default len)
+
+    Example usage:
+    cache = LRUCache(max_items=1000)
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value)
+    """
+    def __init__(self, max_items: int = 1024, ttl_seconds: Optional[float] = None, max_bytes: Optional[int] = None, sizeof: Callable[[Any], int] = len):
+        self.max_items = max_items
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = 0  # Total size of the entries (only tracked with max_bytes)
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (value, expires_at, size)
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Get a value from the cache (and mark it as recently used)
+
+        Returns the cached value or default when missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] is not None and entry[1] < time.monotonic():
+                del self._entries[key]
+                self.bytes -= entry[2]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key: Hashable, value: Any, ttl_seconds: Optional[float] = None) -> None:
+        """
+        Add or replace a value in the cache, evicting the least recently used entries when full
+        (a value larger than max_bytes on its own is not cached)
+        - ttl_seconds: How long this entry stays valid (None = the cache's ttl_seconds)
+        """
+        ttl_seconds = ttl_seconds if ttl_seconds is not None else self.ttl_seconds
+        expires_at = time.monotonic() + ttl_seconds if ttl_seconds is not None else None
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[2]
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self._entries[key] = (value, expires_at, size)
+            self.bytes += size
+            while len(self._entries) > self.max_items or (self.max_bytes is not None and self.bytes > self.max_bytes):
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def delete(self, key: Hashable) -> None:
+        """
+        Remove a value from the cache (no-op when missing)
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.bytes -= entry[2]
+
+    def clear(self) -> None:
+        """
+        Remove every value from the cache
+        """
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the cache statistics
+
+        Returns {"items", "max_items", "bytes", "max_bytes", "hits", "misses", "evictions", "hit_rate"}
+        """
+        lookups = self.hits + self.misses
+        return {
+            "items": len(self._entries),
+            "max_items": self.max_items,
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
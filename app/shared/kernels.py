@@ -0,0 +1,323 @@
+"""
+Type: Shared module
+Description: This module contains the vector scoring kernels used by the Bible search.
+
+Every kernel works on float32 matrices (one vector per row) and comes in two flavors:
+- *_prange: numba kernels parallelized over the rows with prange (fastmath lets LLVM vectorize the inner loop)
+- *_blas: numpy expressions backed by BLAS (sgemv / sgemm)
+
+The dispatchers (dot_scores, cosine_scores, l2_distances) accept a single query [dim] or a batch of queries
+[n_queries, dim]. dot_scores picks a flavor by matrix size (KERNEL_BLAS_MIN_SIZE); cosine_scores and l2_distances
+use prange for single queries (the BLAS versions recompute every row norm per call) and BLAS for batches.
+See app/bench/bench_kernels.py for the benchmark used to pick them.
+"""
+import threading
+import numpy as np
+from numba import njit, prange
+from typing import Optional, Tuple
+
+"""
+======================================================= CONFIG =======================================================
+"""
+# Matrices with at least this many elements (rows * dim) are scored with BLAS, smaller ones with the prange kernels
+KERNEL_BLAS_MIN_SIZE = 1_000_000
+
+# numba's default "workqueue" threading layer aborts when parallel kernels are launched from several threads at once
+parallel_kernel_lock = threading.Lock()
+
+
+"""
+======================================================= HELPERS =======================================================
+"""
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """
+    L2-normalize each row of a matrix so that a dot product equals cosine similarity
+    - matrix: The matrix to normalize (one vector per row)
+
+    Returns a contiguous float32 matrix with unit length rows (zero rows are left as zeros)
+    """
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return np.ascontiguousarray(matrix / norms, dtype=np.float32)
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Get the rows of the k highest scores without sorting the whole array
+    - scores: The scores to select from
+    - k: The number of rows to select
+
+    Returns the selected rows, ordered from highest to lowest score
+    """
+    k = max(0, min(k, len(scores)))
+    if k == 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(scores):
+        rows = np.argpartition(-scores, k - 1)[:k]  # Partial selection, O(n)
+    else:
+        rows = np.arange(len(scores))
+    return rows[np.argsort(-scores[rows], kind="stable")]  # Only sort the k winners
+
+
+"""
+======================================================= PRANGE KERNELS =======================================================
+"""
+@njit(parallel=True, fastmath=True, cache=True)
+def dot_prange(matrix, query) -> np.ndarray:
+    """
+    Calculate the dot product between a query and every row of a matrix
+    - matrix: The float32 matrix (one vector per row)
+    - query: The float32 query vector
+
+    Returns a list of dot products (float32)
+    """
+    n, d = matrix.shape
+    scores = np.empty(n, dtype=np.float32)
+    for i in prange(n):
+        total = np.float32(0)
+        for j in range(d):
+            total += matrix[i, j] * query[j]
+        scores[i] = total
+    return scores
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def dot_batch_prange(matrix, queries) -> np.ndarray:
+    """
+    Calculate the dot product between several queries and every row of a matrix
+    - matrix: The float32 matrix (one vector per row)
+    - queries: The float32 query vectors (one per row)
+
+    Returns a [n_queries, n_rows] matrix of dot products (float32)
+    """
+    n, d = matrix.shape
+    q = queries.shape[0]
+    scores = np.empty((q, n), dtype=np.float32)
+    for i in prange(n):
+        for k in range(q):
+            total = np.float32(0)
+            for j in range(d):
+                total += matrix[i, j] * queries[k, j]
+            scores[k, i] = total
+    return scores
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def cosine_prange(matrix, query) -> np.ndarray:
+    """
+    Calculate the cosine similarity between a query and every row of a matrix (rows don't need to be normalized)
+    - matrix: The float32 matrix (one vector per row)
+    - query: The float32 query vector
+
+    Returns a list of cosine similarities (float32, 0 for zero rows)
+    """
+    n, d = matrix.shape
+    query_norm = np.float32(0)
+    for j in range(d):
+        query_norm += query[j] * query[j]
+    query_norm = np.sqrt(query_norm)
+    scores = np.empty(n, dtype=np.float32)
+    for i in prange(n):
+        dot = np.float32(0)
+        norm = np.float32(0)
+        for j in range(d):
+            dot += matrix[i, j] * query[j]
+            norm += matrix[i, j] * matrix[i, j]
+        denominator = np.sqrt(norm) * query_norm
+        scores[i] = dot / denominator if denominator > 0 else np.float32(0)
+    return scores
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def l2_prange(matrix, query) -> np.ndarray:
+    """
+    Calculate the L2 distance between a query and every row of a matrix
+    - matrix: The float32 matrix (one vector per row)
+    - query: The float32 query vector
+
+    Returns a list of L2 distances (float32)
+    """
+    n, d = matrix.shape
+    distances = np.empty(n, dtype=np.float32)
+    for i in prange(n):
+        total = np.float32(0)
+        for j in range(d):
+            diff = matrix[i, j] - query[j]
+            total += diff * diff
+        distances[i] = np.sqrt(total)
+    return distances
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def int8_dot_prange(quantized, scales, query) -> np.ndarray:
+    """
+    Calculate the approximate dot products between a query and an int8 quantized matrix
+    - quantized: The int8 matrix (one row per verse)
+    - scales: The float32 scale of each row
+    - query: The float32 query vector
+
+    Returns a list of approximate dot products (float32)
+    """
+    n, d = quantized.shape
+    scores = np.empty(n, dtype=np.float32)
+    for i in prange(n):
+        total = np.float32(0)
+        for j in range(d):
+            total += np.float32(quantized[i, j]) * query[j]
+        scores[i] = total * scales[i]
+    return scores
+
+
+"""
+======================================================= BLAS KERNELS =======================================================
+"""
+def dot_blas(matrix: np.ndarray, queries: np.ndarray) -> np.ndarray:
+    """
+    Dot products with BLAS: [n_rows] for a single query, [n_queries, n_rows] for a batch
+    """
+    return matrix @ queries if queries.ndim == 1 else queries @ matrix.T
+
+
+def cosine_blas(matrix: np.ndarray, queries: np.ndarray) -> np.ndarray:
+    """
+    Cosine similarities with BLAS (rows don't need to be normalized): [n_rows] or [n_queries, n_rows]
+    """
+    norms = np.linalg.norm(matrix, axis=1)
+    norms[norms == 0] = np.inf
+    return dot_blas(matrix, normalize_rows(queries)) / norms
+
+
+def l2_blas(matrix: np.ndarray, queries: np.ndarray) -> np.ndarray:
+    """
+    L2 distances with BLAS (||a||^2 + ||b||^2 - 2 a.b): [n_rows] or [n_queries, n_rows]
+    """
+    squared = np.einsum("ij,ij->i", matrix, matrix)[None, :] + np.einsum("ij,ij->i", np.atleast_2d(queries), np.atleast_2d(queries))[:, None]
+    squared -= 2 * np.atleast_2d(dot_blas(matrix, queries))
+    distances = np.sqrt(np.maximum(squared, 0))
+    return distances[0] if queries.ndim == 1 else distances
+
+
+"""
+======================================================= DISPATCH =======================================================
+"""
+def use_blas(matrix: np.ndarray) -> bool:
+    """
+    Check if a matrix should be scored with BLAS rather than the prange kernels
+    """
+    return matrix.size >= KERNEL_BLAS_MIN_SIZE
+
+
+def _as_float32(matrix: np.ndarray, queries: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    return np.asarray(matrix, dtype=np.float32), np.ascontiguousarray(queries, dtype=np.float32)
+
+
+def dot_scores(matrix: np.ndarray, queries: np.ndarray) -> np.ndarray:
+    """
+    Dot products between one query [dim] or a batch of queries [n_queries, dim] and every row of a matrix
+    - matrix: The float32 matrix (one vector per row)
+    - queries: The float32 query vector(s)
+
+    Returns [n_rows] for a single query, [n_queries, n_rows] for a batch
+    """
+    matrix, queries = _as_float32(matrix, queries)
+    if use_blas(matrix):
+        return dot_blas(matrix, queries)
+    with parallel_kernel_lock:
+        return dot_prange(matrix, queries) if queries.ndim == 1 else dot_batch_prange(matrix, queries)
+
+
+def cosine_scores(matrix: np.ndarray, queries: np.ndarray) -> np.ndarray:
+    """
+    Cosine similarities between one query or a batch of queries and every row of a (not necessarily normalized) matrix
+
+    Returns [n_rows] for a single query, [n_queries, n_rows] for a batch
+    """
+    matrix, queries = _as_float32(matrix, queries)
+    if queries.ndim == 2:
+        return cosine_blas(matrix, queries)
+    with parallel_kernel_lock:
+        return cosine_prange(matrix, queries)
+
+
+def l2_distances(matrix: np.ndarray, queries: np.ndarray) -> np.ndarray:
+    """
+    L2 distances between one query or a batch of queries and every row of a matrix
+
+    Returns [n_rows] for a single query, [n_queries, n_rows] for a batch
+    """
+    matrix, queries = _as_float32(matrix, queries)
+    if queries.ndim == 2:
+        return l2_blas(matrix, queries)
+    with parallel_kernel_lock:
+        return l2_prange(matrix, queries)
+
+
+"""
+======================================================= QUANTIZED =======================================================
+"""
+def quantize_embeddings(embeddings: np.ndarray, storage: str, block_rows: int = 8192) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Build the compact copy of a normalized embedding matrix
+    - embeddings: The normalized float32 embedding matrix (may be memory-mapped)
+    - storage: "float16" or "int8" (symmetric scalar quantization with one scale per row)
+    - block_rows: The number of rows converted at a time (bounds the temporaries)
+
+    Returns (compact matrix, per-row scales or None for float16)
+    """
+    if storage == "float16":
+        return embeddings.astype(np.float16), None
+    if storage != "int8":
+        raise ValueError(f"Unknown embedding storage: {storage}")
+    quantized = np.empty(embeddings.shape, dtype=np.int8)
+    scales = np.empty(len(embeddings), dtype=np.float32)
+    for start in range(0, len(embeddings), block_rows):
+        block = np.asarray(embeddings[start:start + block_rows], dtype=np.float32)
+        block_scales = np.abs(block).max(axis=1) / 127
+        block_scales[block_scales == 0] = 1
+        quantized[start:start + block_rows] = np.round(block / block_scales[:, None])
+        scales[start:start + block_rows] = block_scales
+    return quantized, scales
+
+
+def score_quantized(quantized: np.ndarray, scales: Optional[np.ndarray], query: np.ndarray, block_rows: int = 4096) -> np.ndarray:
+    """
+    Approximate the cosine similarities of a normalized query against a compact embedding matrix
+    - quantized: The compact matrix (float16 or int8)
+    - scales: The per-row scales (int8) or None (float16)
+    - query: The normalized float32 query
+    - block_rows: The number of rows scored at a time for float16 (keeps the float32 temporaries in cache)
+
+    Returns the approximate similarities (float32, one per row)
+    """
+    if scales is not None:
+        with parallel_kernel_lock:
+            return int8_dot_prange(quantized, scales, query)
+    scores = np.empty(len(quantized), dtype=np.float32)
+    for start in range(0, len(quantized), block_rows):
+        scores[start:start + block_rows] = quantized[start:start + block_rows].astype(np.float32) @ query
+    return scores
+
+
+def compile_kernels() -> list:
+    """
+    Call every numba kernel once with the argument types used in production, so they are compiled (or loaded from
+    the on-disk cache) before the first request
+
+    Returns the names of the compiled kernels
+    """
+    query = np.ones(8, dtype=np.float32)
+    queries = np.ones((2, 8), dtype=np.float32)
+    # numba compiles one version per writeable flag: memory-mapped embeddings are read-only, JSON ones writeable
+    for writeable in (True, False):
+        matrix = np.ones((4, 8), dtype=np.float32)
+        quantized, scales = quantize_embeddings(matrix, "int8")
+        for array in (matrix, quantized, scales):
+            array.flags.writeable = writeable
+        with parallel_kernel_lock:
+            dot_prange(matrix, query)
+            dot_batch_prange(matrix, queries)
+            cosine_prange(matrix, query)
+            l2_prange(matrix, query)
+            int8_dot_prange(quantized, scales, query)
+    return ["dot_prange", "dot_batch_prange", "cosine_prange", "l2_prange", "int8_dot_prange"]
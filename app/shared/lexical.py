@@ -0,0 +1,189 @@
+"""
+Type: Shared module
+Description: This module contains the lexical (keyword) search used next to the embedding search.
+
+BM25Index is an inverted index over the verse texts of a version, built when the version is loaded
+(see shared.bible.load_bible_index). It answers exact words and names ("Melchizedek", "living water") locally, without
+an embedding call. reciprocal_rank_fusion merges its ranking with the semantic one for the hybrid mode.
+"""
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+import hashlib, re, unicodedata
+import numpy as np
+
+from shared.kernels import top_k
+
+"""
+======================================================= CONFIG =======================================================
+"""
+BM25_K1 = 1.2  # Term frequency saturation
+BM25_B = 0.75  # Verse length normalization
+PHRASE_RERANK_DEPTH = 50  # The best BM25 candidates checked for the exact query phrase
+RRF_K = 60  # Reciprocal rank fusion constant (higher = flatter fusion of the rankings)
+
+token_pattern = re.compile(r"\w+", re.UNICODE)  # Any script: accented and non-Latin words are tokens too
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split a text into casefolded word tokens (punctuation is dropped)
+
+    The casefolded text is NFKC-normalized so that combining accents stay attached to their letter (casefold can
+    decompose them, e.g. Greek "ῇ") and differently encoded spellings of a word give the same token
+    """
+    return token_pattern.findall(unicodedata.normalize("NFKC", text.casefold()))
+
+
+def hash_term(term: str) -> int:
+    """
+    Get the 64-bit hash of a term (stable across processes, unlike hash())
+    """
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+"""
+======================================================= INDEX =======================================================
+"""
+class BM25Index:
+    """
+    BM25 inverted index of a list of texts
+    - texts: The texts to index (row i = texts[i], any sequence of strings)
+
+    The postings are stored in CSR form: the rows containing term t are rows[offsets[t]:offsets[t + 1]], with their
+    precomputed BM25 term weights (without the idf) in weights. The vocabulary is the sorted array of the 64-bit term
+    hashes (term id = position in term_hashes), so the whole index is a few arrays that can be memory-mapped and
+    shared between processes (see shared.shared_index).
+    """
+    def __init__(self, texts: Sequence[str], k1: float = BM25_K1, b: float = BM25_B):
+        self.texts = texts
+        terms = {}  # term -> build-time id
+        term_ids, rows, frequencies = [], [], []
+        lengths = np.zeros(len(texts), dtype=np.float32)
+        for row, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            lengths[row] = sum(counts.values())
+            for term, frequency in counts.items():
+                term_ids.append(terms.setdefault(term, len(terms)))
+                rows.append(row)
+                frequencies.append(frequency)
+
+        # Renumber the terms in hash order, so that a term's id is its position in term_hashes
+        hashes = np.fromiter((hash_term(term) for term in terms), dtype=np.uint64, count=len(terms))
+        hash_order = np.argsort(hashes)
+        self.term_hashes = hashes[hash_order]
+        if len(self.term_hashes) > 1 and np.any(self.term_hashes[1:] == self.term_hashes[:-1]):
+            raise ValueError("Two terms of the lexical index have the same 64-bit hash")
+        ids = np.empty(len(terms), dtype=np.int64)
+        ids[hash_order] = np.arange(len(terms))
+        term_ids = ids[np.asarray(term_ids, dtype=np.int64)]
+
+        order = np.argsort(term_ids, kind="stable")  # Group the postings by term, rows stay sorted within a term
+        self.rows = np.asarray(rows, dtype=np.int32)[order]
+        frequencies = np.asarray(frequencies, dtype=np.float32)[order]
+        document_frequencies = np.bincount(term_ids, minlength=len(terms))
+        self.offsets = np.concatenate([[0], np.cumsum(document_frequencies)]).astype(np.int64)
+
+        n = max(1, len(texts))
+        average_length = max(1.0, float(lengths.mean())) if len(texts) else 1.0
+        self.idf = np.log(1 + (n - document_frequencies + 0.5) / (document_frequencies + 0.5)).astype(np.float32)
+        self.weights = (frequencies * (k1 + 1) / (frequencies + k1 * (1 - b + b * lengths[self.rows] / average_length))).astype(np.float32)
+
+    @classmethod
+    def from_arrays(cls, texts: Sequence[str], term_hashes: np.ndarray, rows: np.ndarray, offsets: np.ndarray, weights: np.ndarray, idf: np.ndarray) -> "BM25Index":
+        """
+        Rebuild an index from its arrays (e.g. memory-mapped from a shared index, see shared.shared_index)
+        - texts: The indexed texts
+        - term_hashes: The sorted term hashes (the vocabulary)
+        - rows, offsets, weights, idf: The CSR postings and the idf of each term
+
+        Returns the BM25Index (nothing is re-tokenized)
+        """
+        index = cls.__new__(cls)
+        index.texts = texts
+        index.term_hashes, index.rows, index.offsets, index.weights, index.idf = term_hashes, rows, offsets, weights, idf
+        return index
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        """
+        Returns the arrays of the index by name (see from_arrays)
+        """
+        return {"term_hashes": self.term_hashes, "rows": self.rows, "offsets": self.offsets, "weights": self.weights, "idf": self.idf}
+
+    def get_term_id(self, term: str) -> Optional[int]:
+        """
+        Returns the id of a term or None when no text contains it
+        """
+        term_hash = np.uint64(hash_term(term))
+        i = int(np.searchsorted(self.term_hashes, term_hash))
+        return i if i < len(self.term_hashes) and self.term_hashes[i] == term_hash else None
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def score(self, query: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Score the rows that contain at least one query term
+        - query: The search text
+
+        Returns (candidate rows, their BM25 scores)
+        """
+        term_ids = [term_id for term_id in map(self.get_term_id, dict.fromkeys(tokenize(query))) if term_id is not None]
+        if not term_ids:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        if len(term_ids) == 1:
+            t = term_ids[0]
+            return self.rows[self.offsets[t]:self.offsets[t + 1]].astype(np.int64), self.idf[t] * self.weights[self.offsets[t]:self.offsets[t + 1]]
+
+        # Several terms: accumulate into a dense score array, then keep the rows that were touched
+        scores = np.zeros(len(self.texts), dtype=np.float32)
+        postings = []
+        for t in term_ids:
+            rows = self.rows[self.offsets[t]:self.offsets[t + 1]]
+            scores[rows] += self.idf[t] * self.weights[self.offsets[t]:self.offsets[t + 1]]  # A row appears once per term
+            postings.append(rows)
+        candidates = np.unique(np.concatenate(postings)).astype(np.int64)
+        return candidates, scores[candidates]
+
+    def search(self, query: str, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the rows that best match a search text
+        - query: The search text
+        - k: The number of rows to return
+
+        Multi-word queries rank the rows containing the exact phrase first (among the best PHRASE_RERANK_DEPTH candidates).
+
+        Returns (rows, scores) ordered from best to worst
+        """
+        candidates, scores = self.score(query)
+        query_tokens = tokenize(query)
+        if len(query_tokens) > 1 and len(candidates):
+            best = top_k(scores, max(k, PHRASE_RERANK_DEPTH))
+            candidates, scores = candidates[best], scores[best].copy()
+            phrase, boost = f" {' '.join(query_tokens)} ", scores[0]  # Adding the best score ranks every phrase match first
+            for i, row in enumerate(candidates):
+                if phrase in f" {' '.join(tokenize(self.texts[row]))} ":
+                    scores[i] += boost
+        best = top_k(scores, k)
+        return candidates[best], scores[best]
+
+
+"""
+======================================================= FUSION =======================================================
+"""
+def reciprocal_rank_fusion(rankings: List[np.ndarray], k: int, rrf_k: int = RRF_K) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Merge several rankings of rows with reciprocal rank fusion (score = sum of 1 / (rrf_k + rank) over the rankings)
+    - rankings: The rankings to merge (rows ordered from best to worst)
+    - k: The number of rows to return
+    - rrf_k: The fusion constant
+
+    Returns (rows, fused scores) ordered from best to worst
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking.tolist()):
+            fused[row] = fused.get(row, 0.0) + 1.0 / (rrf_k + rank + 1)
+    rows = np.fromiter(fused.keys(), dtype=np.int64, count=len(fused))
+    scores = np.fromiter(fused.values(), dtype=np.float32, count=len(fused))
+    best = top_k(scores, k)
+    return rows[best], scores[best]
@@ -0,0 +1,271 @@
+"""
+Type: Shared module
+Description: This module contains the lightweight metrics (counters, histograms and per-request traces) of the app.
+
+Every metric registers itself in the global registry, which renders them in the Prometheus text format for
+GET /metrics. Values live in process memory, so each worker process reports its own metrics (Prometheus sums them).
+
+Example usage:
+searches = Counter("searches_total", "The number of searches", ["bible_version"])
+searches.inc(bible_version="kjv")
+
+trace = Trace("search")
+... load ...
+trace.add_note("Loaded Bible version", stage="load")  # Observed in bible_stage_seconds{operation="search", stage="load"}
+trace.finish()
+"""
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+import bisect, math, threading, time
+
+"""
+======================================================= CONFIG =======================================================
+"""
+# Default histogram buckets (seconds): from sub-millisecond kernel work up to slow upstream calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Requests slower than this print their notes (the stdout log only keeps the outliers)
+SLOW_TRACE_SECONDS = 1.0
+
+
+"""
+======================================================= METRICS =======================================================
+"""
+def format_labels(labelnames: Sequence[str], labelvalues: Sequence[Any], extra: str = "") -> str:
+    """
+    Format a Prometheus label set, e.g. {model="gpt-4o-mini",kind="prompt"}
+    """
+    escape = lambda value: str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(labelnames, labelvalues)]
+    pairs += [extra] if extra else []
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    """
+    Base class of the metrics: a name, a help text, label names and one value per label set
+    - name: The metric name (Prometheus naming, e.g. bible_search_seconds)
+    - help: The description shown by Prometheus
+    - labelnames: The names of the labels
+    """
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), registry: Optional["MetricsRegistry"] = None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+        (registry or metrics_registry).register(self)
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects the labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def collect(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        return "\n".join([f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self.collect())
+
+
+class Counter(Metric):
+    """
+    A value that only goes up (requests, errors, tokens, ...)
+    """
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{format_labels(self.labelnames, key)} {value}" for key, value in values]
+
+
+class Histogram(Metric):
+    """
+    A distribution of observed values (durations in seconds) in cumulative buckets, with their sum and count
+    - buckets: The upper bounds of the buckets (+Inf is added)
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS, registry: Optional["MetricsRegistry"] = None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames, registry)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """
+        Observe the duration of a block
+
+        Example usage:
+        with upstream_seconds.time(service="vertex"):
+            response = post(...)
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def get_count(self, **labels) -> int:
+        counts, _ = self._values.get(self._key(labels), ([0], 0.0))
+        return sum(counts)
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        lines = []
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(list(self.buckets) + [math.inf], counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == math.inf else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class CallbackMetric(Metric):
+    """
+    A metric whose values are read when /metrics is scraped (e.g. the statistics an LRUCache already keeps)
+    - callback: Returns {label values tuple: value}
+    - kind: "gauge" or "counter"
+    """
+    def __init__(self, name: str, help: str, labelnames: Sequence[str], callback: Callable[[], Dict[Tuple[Any, ...], float]], kind: str = "gauge", registry: Optional["MetricsRegistry"] = None):
+        self.callback = callback
+        self.kind = kind
+        super().__init__(name, help, labelnames, registry)
+
+    def collect(self) -> List[str]:
+        return [f"{self.name}{format_labels(self.labelnames, key)} {value}" for key, value in self.callback().items()]
+
+
+class MetricsRegistry:
+    """
+    The set of metrics rendered by GET /metrics
+    """
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> None:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+
+    def render(self) -> str:
+        """
+        Render every metric in the Prometheus text exposition format (version 0.0.4)
+        """
+        return "\n".join(metric.render() for metric in self.metrics.values()) + "\n"
+
+
+metrics_registry = MetricsRegistry()
+
+
+"""
+======================================================= APP METRICS =======================================================
+"""
+http_request_seconds = Histogram("http_request_seconds", "Latency of the HTTP requests (until the response headers are sent)", ["method", "route", "status"])
+bible_seconds = Histogram("bible_seconds", "Total latency of the Bible operations", ["operation"])
+bible_stage_seconds = Histogram("bible_stage_seconds", "Latency of each stage of the Bible operations", ["operation", "stage"])
+upstream_seconds = Histogram("upstream_request_seconds", "Latency of the calls to upstream APIs", ["service"])
+upstream_errors = Counter("upstream_errors_total", "Failed calls to upstream APIs", ["service", "status"])
+ai_requests = Counter("ai_requests_total", "Completed AI chats", ["model", "source"])
+ai_tokens = Counter("ai_tokens_total", "Tokens used by the AI chats", ["model", "kind"])
+ai_provider_events = Counter("ai_provider_events_total", "Retries, hedges, fallbacks and fail-fast requests (open circuit) of the AI providers", ["provider", "event"])
+
+# Caches registered with register_cache (name -> object with an LRUCache-style stats() method)
+caches: Dict[str, Any] = {}
+
+
+def register_cache(name: str, cache: Any) -> None:
+    """
+    Report the statistics of a cache (hits, misses, evictions, items) at /metrics
+    - name: The value of the "cache" label
+    - cache: The cache (anything with a stats() method returning hits, misses, evictions, items and bytes)
+    """
+    caches[name] = cache
+
+
+def collect_cache_stat(stat: str) -> Callable[[], Dict[Tuple[str], float]]:
+    return lambda: {(name,): cache.stats()[stat] for name, cache in list(caches.items())}
+
+
+cache_hits = CallbackMetric("cache_hits_total", "Cache hits", ["cache"], collect_cache_stat("hits"), kind="counter")
+cache_misses = CallbackMetric("cache_misses_total", "Cache misses", ["cache"], collect_cache_stat("misses"), kind="counter")
+cache_evictions = CallbackMetric("cache_evictions_total", "Cache evictions", ["cache"], collect_cache_stat("evictions"), kind="counter")
+cache_items = CallbackMetric("cache_items", "Entries currently in the cache", ["cache"], collect_cache_stat("items"))
+cache_bytes = CallbackMetric("cache_bytes", "Size of the entries currently in the cache (0 when the cache has no byte limit)", ["cache"], collect_cache_stat("bytes"))
+
+
+def get_error_status(error: Exception) -> str:
+    """
+    Get the HTTP status of an upstream error (httpx, requests and openai errors), "error" when there is none
+    """
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return str(status) if status else "error"
+
+
+"""
+======================================================= TRACES =======================================================
+"""
+class Trace:
+    """
+    The notes and stage timings of one Bible operation (replaces the ad-hoc notes list of the search functions)
+    - operation: The value of the "operation" label (search, batch_search, multi_search, ...)
+
+    Every add_note call with a stage closes that stage: the time since the previous note is observed in
+    bible_stage_seconds. finish() observes the total in bible_seconds.
+    """
+    def __init__(self, operation: str):
+        self.operation = operation
+        self.start = time.time()
+        self.last = self.start
+        self.notes: List[Dict[str, Any]] = []
+        self.timings: Dict[str, float] = {}
+
+    def add_note(self, note: str, stage: Optional[str] = None) -> None:
+        """
+        Record a note (and close a stage)
+        - note: The note returned to the client
+        - stage: The stage that just finished (None = a note without timing)
+        """
+        now = time.time()
+        self.notes.append({
+            "note": note,
+            "elapsed_time": now - self.start,
+        })
+        if stage:
+            self.timings[stage] = self.timings.get(stage, 0.0) + now - self.last
+            bible_stage_seconds.observe(now - self.last, operation=self.operation, stage=stage)
+            self.last = now
+
+    def finish(self) -> float:
+        """
+        Observe the total duration (and print the notes of slow operations)
+
+        Returns the total duration in seconds
+        """
+        total = time.time() - self.start
+        self.timings["total"] = total
+        bible_seconds.observe(total, operation=self.operation)
+        if total >= SLOW_TRACE_SECONDS:
+            print(f"Slow {self.operation} ({total:0.2f}s):", [f"note: {note['note']}, elapsed_time: {note['elapsed_time']:0.2f}s" for note in self.notes])
+        return total
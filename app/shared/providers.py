@@ -0,0 +1,255 @@
+"""
+Type: Shared module
+Description: This module contains the provider layer of the AI chats (see shared.ai).
+
+Every request to a provider (OpenAI, Groq) has a timeout and is retried with jittered exponential backoff when the
+error is worth retrying (timeout, connection error, 429, 5xx). Each provider has a circuit breaker: after
+BREAKER_FAILURES failed requests in a row its requests fail fast for BREAKER_RESET_SECONDS, then a single trial
+request decides whether it is closed again. A chat has candidates: its model, then a fallback model on the other
+provider. A chat can be hedged (opt-in, for short chats whose latency is predictable): when the running request hasn't
+answered after HEDGE_AFTER_SECONDS (or failed), the next candidate is started, the first response wins and the other
+request is cancelled. Without hedging, the next candidate only starts when the running request failed.
+"""
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import asyncio, random, threading, time
+
+import openai
+from shared.metrics import ai_provider_events, upstream_seconds, upstream_errors, get_error_status
+
+"""
+======================================================= CONFIG =======================================================
+"""
+MAX_RETRIES = 2  # Retries of a failed request on the same provider (0 = a single attempt)
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 8.0
+RETRY_STATUSES = {"408", "409", "429", "500", "502", "503", "504"}
+
+HEDGE_AFTER_SECONDS = 10.0  # Start the fallback model of a hedged chat when the first one hasn't answered by then
+
+BREAKER_FAILURES = 5  # Failed requests in a row that open the circuit of a provider
+BREAKER_RESET_SECONDS = 30.0  # How long an open circuit fails fast before a trial request
+
+
+class ProviderUnavailable(Exception):
+    """
+    Raised instead of calling a provider whose circuit is open
+    """
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """
+    Check whether a failed request is worth retrying (or sending to another provider)
+    """
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError, ProviderUnavailable)):
+        return True
+    return get_error_status(error) in RETRY_STATUSES
+
+
+def get_retry_delay(attempt: int, error: Exception) -> float:
+    """
+    Get how long to wait before retrying a request
+    - attempt: The number of the failed attempt (0 = first)
+    - error: The error of the failed attempt
+
+    Returns the delay in seconds (the Retry-After header of the error, else exponential backoff with full jitter)
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return min(BACKOFF_MAX_SECONDS, float(retry_after))
+        except ValueError:
+            pass
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+
+"""
+======================================================= CIRCUIT BREAKER =======================================================
+"""
+class CircuitBreaker:
+    """
+    Thread-safe circuit breaker of a provider
+    - failures: The failed requests in a row that open the circuit
+    - reset_seconds: How long the circuit stays open before letting a single trial request through (half-open)
+
+    States: "closed" (requests go through), "open" (requests fail fast), "half_open" (one trial request: its success
+    closes the circuit, its failure opens it again)
+    """
+    def __init__(self, failures: int = BREAKER_FAILURES, reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.max_failures = failures
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opens = 0
+        self.opened_at = 0.0
+        self._trial = False  # Whether the half-open trial request is in flight
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """
+        Check whether a request may be sent (a True in half-open state reserves the trial request)
+        """
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open":
+                if time.monotonic() - self.opened_at < self.reset_seconds:
+                    return False
+                self.state = "half_open"
+            if self._trial:
+                return False
+            self._trial = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._trial = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._trial = False
+            if self.state == "half_open" or (self.state == "closed" and self.failures >= self.max_failures):
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self.opens += 1
+
+    def release(self) -> None:
+        """
+        Give back the trial request without a verdict (e.g. the request was cancelled)
+        """
+        with self._lock:
+            self._trial = False
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns {"state", "failures", "opens"}
+        """
+        with self._lock:
+            return {"state": self.state, "failures": self.failures, "opens": self.opens}
+
+
+"""
+======================================================= PROVIDERS =======================================================
+"""
+class Provider:
+    """
+    A chat completion API with a timeout, retries and a circuit breaker
+    - name: The provider name (the "service"/"provider" label of the metrics)
+    - client: The OpenAI-compatible async client of the provider (its own retries are disabled)
+    - timeout_seconds: The timeout of each request
+    - max_retries: Retries of a failed request (only the retryable errors, see is_retryable_error)
+
+    Example usage:
+    provider = Provider("groq", groq_async_client, timeout_seconds=30)
+    response = await provider.create_async(model="llama-3.1-8b-instant", messages=[...])
+    """
+    def __init__(self, name: str, client: openai.AsyncOpenAI, timeout_seconds: float, max_retries: int = MAX_RETRIES, breaker: Optional[CircuitBreaker] = None):
+        self.name = name
+        self.client = client.with_options(timeout=timeout_seconds, max_retries=0)
+        self.max_retries = max_retries
+        self.breaker = breaker or CircuitBreaker()
+
+    def _check_circuit(self) -> None:
+        if not self.breaker.allow():
+            ai_provider_events.inc(provider=self.name, event="circuit_open")
+            raise ProviderUnavailable(f"The {self.name} API is unavailable (circuit open after repeated failures)")
+
+    def _record_error(self, error: Exception, attempt: int) -> bool:
+        """
+        Record a failed attempt in the circuit breaker
+
+        Returns whether the request should be retried
+        """
+        if not is_retryable_error(error):
+            self.breaker.record_success()  # The provider answered (e.g. 400 for a bad request): not a provider failure
+            return False
+        self.breaker.record_failure()
+        if attempt >= self.max_retries:
+            return False
+        ai_provider_events.inc(provider=self.name, event="retry")
+        return True
+
+    async def create_async(self, **kwargs) -> Any:
+        """
+        Create a chat completion (with stream=True, only opening the stream is retried, not a broken stream)
+        - kwargs: The arguments of client.chat.completions.create
+
+        Returns the completion (raises the last error once the retries are exhausted, ProviderUnavailable when the circuit is open)
+
+        upstream_request_seconds times the successful attempt only (for a stream: until it is open), upstream_errors_total
+        counts the requests that failed after their retries, both labelled with this provider.
+        """
+        attempt = 0
+        while True:
+            self._check_circuit()
+            start = time.monotonic()
+            try:
+                response = await self.client.chat.completions.create(**kwargs)
+            except asyncio.CancelledError:
+                self.breaker.release()  # A cancelled hedge says nothing about the provider
+                raise
+            except Exception as e:
+                if not self._record_error(e, attempt):
+                    upstream_errors.inc(service=self.name, status=get_error_status(e))
+                    raise
+                await asyncio.sleep(get_retry_delay(attempt, e))
+                attempt += 1
+                continue
+            upstream_seconds.observe(time.monotonic() - start, service=self.name)
+            self.breaker.record_success()
+            return response
+
+
+"""
+======================================================= CHAT COMPLETIONS =======================================================
+"""
+async def create_chat_completion_async(candidates: List[Tuple[str, Provider]], hedge_after_seconds: Optional[float] = None, candidate_kwargs: Optional[Callable[[str], Dict[str, Any]]] = None, **kwargs) -> Tuple[Any, str]:
+    """
+    Create a chat completion with fallbacks: the next candidate is started when the running requests all failed, or
+    (hedged) when they haven't answered after hedge_after_seconds. The first completion wins, the requests still
+    running are cancelled.
+    - candidates: The (model, provider) pairs that can answer, in order of preference
+    - hedge_after_seconds: The latency that starts the next candidate (None = only fall back on failures, e.g. for long
+      generations, whose latency says nothing about the health of the provider)
+    - candidate_kwargs: Returns the extra arguments of a candidate model (e.g. the stream options only OpenAI accepts)
+    - kwargs: The other arguments of client.chat.completions.create (messages, temperature, ...). With stream=True, the
+      candidates only compete to open the stream
+
+    Returns (the completion, the model that answered)
+    """
+    queue = list(candidates)
+    running: Dict[asyncio.Task, Tuple[str, Provider]] = {}
+    error: Optional[Exception] = None
+    try:
+        while True:
+            if not running:
+                if not queue:
+                    raise error
+                model, provider = queue.pop(0)
+                if error is not None:
+                    ai_provider_events.inc(provider=provider.name, event="fallback")
+                running[asyncio.create_task(provider.create_async(model=model, **kwargs, **(candidate_kwargs(model) if candidate_kwargs else {})))] = (model, provider)
+
+            timeout = hedge_after_seconds if queue else None
+            done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                model, provider = queue.pop(0)
+                ai_provider_events.inc(provider=provider.name, event="hedge")
+                running[asyncio.create_task(provider.create_async(model=model, **kwargs, **(candidate_kwargs(model) if candidate_kwargs else {})))] = (model, provider)
+                continue
+
+            for task in done:
+                model, provider = running.pop(task)
+                if task.exception() is None:
+                    if (model, provider) != candidates[0]:
+                        ai_provider_events.inc(provider=provider.name, event="fallback_answered")
+                    return task.result(), model
+                error = task.exception()
+                if not is_retryable_error(error):
+                    queue.clear()  # A bad request fails the same way everywhere
+    finally:
+        for task in running:
+            task.cancel()
@@ -0,0 +1,199 @@
+"""
+Type: Shared module
+Description: This module parses Bible references ("John 3:16", "Ps 23", "1 Cor 13:4-7", "Gen 1:1-2:3").
+
+Book names, common abbreviations and unambiguous prefixes are recognized (case, dots and spaces don't matter).
+The parsed BibleReference is resolved to rows with the positional index of a version (see BibleIndex.get_passage_rows),
+so reference-shaped searches are answered without an embedding call.
+"""
+from pydantic import BaseModel, Field
+from typing import Dict, Optional
+import re
+
+"""
+======================================================= BOOKS =======================================================
+"""
+# (book number, canonical name, extra abbreviations); the numbered books list their abbreviations without the number
+BOOKS = [
+    (1, "Genesis", ["gn", "ge"]),
+    (2, "Exodus", ["ex", "exod"]),
+    (3, "Leviticus", ["lv", "le"]),
+    (4, "Numbers", ["nm", "nu", "nb"]),
+    (5, "Deuteronomy", ["dt", "de"]),
+    (6, "Joshua", ["jos", "jsh"]),
+    (7, "Judges", ["jdg", "jg", "jdgs"]),
+    (8, "Ruth", ["ru", "rth"]),
+    (9, "1 Samuel", ["sa", "sm", "sam"]),
+    (10, "2 Samuel", ["sa", "sm", "sam"]),
+    (11, "1 Kings", ["ki", "kg", "kgs"]),
+    (12, "2 Kings", ["ki", "kg", "kgs"]),
+    (13, "1 Chronicles", ["ch", "chr", "chron"]),
+    (14, "2 Chronicles", ["ch", "chr", "chron"]),
+    (15, "Ezra", ["ezr"]),
+    (16, "Nehemiah", ["ne"]),
+    (17, "Esther", ["es", "est"]),
+    (18, "Job", ["jb"]),
+    (19, "Psalms", ["ps", "psa", "psalm", "pss", "pslm", "psm"]),
+    (20, "Proverbs", ["pr", "prv", "prov"]),
+    (21, "Ecclesiastes", ["ec", "eccl", "ecc", "qoh"]),
+    (22, "Song of Solomon", ["song", "sos", "so", "ss", "songofsongs", "canticles", "cant"]),
+    (23, "Isaiah", ["is", "isa"]),
+    (24, "Jeremiah", ["je", "jer", "jr"]),
+    (25, "Lamentations", ["la", "lam"]),
+    (26, "Ezekiel", ["ez", "ezk", "ezek"]),
+    (27, "Daniel", ["dn", "da"]),
+    (28, "Hosea", ["ho"]),
+    (29, "Joel", ["jl"]),
+    (30, "Amos", ["am"]),
+    (31, "Obadiah", ["ob", "obad"]),
+    (32, "Jonah", ["jnh", "jon"]),
+    (33, "Micah", ["mi", "mic"]),
+    (34, "Nahum", ["na", "nah"]),
+    (35, "Habakkuk", ["hb", "hab"]),
+    (36, "Zephaniah", ["zp", "zph", "zep"]),
+    (37, "Haggai", ["hg", "hag"]),
+    (38, "Zechariah", ["zc", "zec", "zech"]),
+    (39, "Malachi", ["ml", "mal"]),
+    (40, "Matthew", ["mt", "mat", "matt"]),
+    (41, "Mark", ["mk", "mr", "mrk"]),
+    (42, "Luke", ["lk", "lu", "luk"]),
+    (43, "John", ["jn", "jhn", "joh"]),
+    (44, "Acts", ["ac", "act"]),
+    (45, "Romans", ["ro", "rm", "rom"]),
+    (46, "1 Corinthians", ["co", "cor"]),
+    (47, "2 Corinthians", ["co", "cor"]),
+    (48, "Galatians", ["ga", "gal"]),
+    (49, "Ephesians", ["eph", "ephes"]),
+    (50, "Philippians", ["php", "phil", "pp"]),
+    (51, "Colossians", ["col"]),
+    (52, "1 Thessalonians", ["th", "thes", "thess"]),
+    (53, "2 Thessalonians", ["th", "thes", "thess"]),
+    (54, "1 Timothy", ["ti", "tm", "tim"]),
+    (55, "2 Timothy", ["ti", "tm", "tim"]),
+    (56, "Titus", ["tit"]),
+    (57, "Philemon", ["phm", "phlm", "philem"]),
+    (58, "Hebrews", ["heb"]),
+    (59, "James", ["jas", "jm"]),
+    (60, "1 Peter", ["pe", "pt", "pet"]),
+    (61, "2 Peter", ["pe", "pt", "pet"]),
+    (62, "1 John", ["jn", "jhn", "jo", "joh"]),
+    (63, "2 John", ["jn", "jhn", "jo", "joh"]),
+    (64, "3 John", ["jn", "jhn", "jo", "joh"]),
+    (65, "Jude", ["jd", "jud"]),
+    (66, "Revelation", ["re", "rev", "rv", "revelations", "apocalypse"]),
+]
+BOOK_NAMES = {number: name for number, name, _ in BOOKS}
+
+# Books with a single chapter: "Jude 3" means verse 3
+SINGLE_CHAPTER_BOOKS = {31, 57, 63, 64, 65}
+
+MIN_PREFIX_LENGTH = 3  # Shortest unambiguous prefix of a book name accepted as an abbreviation
+
+# Ordinal prefixes of the numbered books; the words and roman numerals must be followed by a space ("I Cor", not "Isaiah")
+ordinal_pattern = re.compile(r"^(?:(1st|2nd|3rd|first|second|third|iii|ii|i)\s+|([1-3])\s*)")
+ordinals = {"1st": "1", "2nd": "2", "3rd": "3", "first": "1", "second": "2", "third": "3", "i": "1", "ii": "2", "iii": "3"}
+
+
+def normalize_book_name(name: str) -> str:
+    """
+    Normalize a book name for lookups: lowercase, no dots or spaces, ordinal prefixes as digits ("I Cor." -> "1cor")
+    """
+    name = ordinal_pattern.sub(lambda match: ordinals.get(match.group(1)) or match.group(2), name.lower().strip())
+    return re.sub(r"[\s.]+", "", name)
+
+
+def build_book_aliases() -> Dict[str, int]:
+    """
+    Build the lookup table of every accepted book name
+
+    Returns {normalized alias: book number}
+    """
+    aliases: Dict[str, int] = {}
+    prefixes: Dict[str, set] = {}
+    for number, name, abbreviations in BOOKS:
+        full = normalize_book_name(name)
+        ordinal = full[0] if full[0].isdigit() else ""
+        base = full[len(ordinal):]
+        for length in range(MIN_PREFIX_LENGTH, len(base) + 1):
+            prefixes.setdefault(ordinal + base[:length], set()).add(number)
+        for abbreviation in abbreviations:
+            aliases[ordinal + abbreviation] = number
+        aliases[full] = number
+    # Prefixes only count when they point to a single book (e.g. "gen", but not "jud" for Judges/Jude)
+    for prefix, numbers in prefixes.items():
+        if len(numbers) == 1 and prefix not in aliases:
+            aliases[prefix] = next(iter(numbers))
+    return aliases
+
+
+book_aliases = build_book_aliases()
+
+
+"""
+======================================================= REFERENCES =======================================================
+"""
+class BibleReference(BaseModel):
+    book: int = Field(..., description="The book number (1 = Genesis, 66 = Revelation)")
+    chapter: int = Field(..., description="The first chapter")
+    verse: Optional[int] = Field(None, description="The first verse (None = the whole chapter)")
+    end_chapter: Optional[int] = Field(None, description="The last chapter (None = same as chapter)")
+    end_verse: Optional[int] = Field(None, description="The last verse (None = the end of the last chapter, or just verse when no range is given)")
+
+    def label(self, book_name: Optional[str] = None) -> str:
+        """
+        Format the reference, e.g. "John 3:16-18", "Psalms 23", "Genesis 1:1-2:3"
+        """
+        label = f"{book_name or BOOK_NAMES.get(self.book, self.book)} {self.chapter}"
+        if self.verse is not None:
+            label += f":{self.verse}"
+        end_chapter = self.end_chapter if self.end_chapter is not None else self.chapter
+        if end_chapter != self.chapter:
+            label += f"-{end_chapter}" + (f":{self.end_verse}" if self.end_verse is not None else "")
+        elif self.end_verse is not None and self.end_verse != self.verse:
+            label += f"-{self.end_verse}"
+        return label
+
+
+reference_pattern = re.compile(
+    r"^\s*(?P<book>(?:[1-3]|i{1,3}|1st|2nd|3rd|first|second|third)?\s*[a-z][a-z .]*?)\s*"
+    r"(?P<chapter>\d{1,3})(?:\s*[:.]\s*(?P<verse>\d{1,3}))?"
+    r"(?:\s*[-–—]\s*(?P<end>\d{1,3})(?:\s*[:.]\s*(?P<end_verse>\d{1,3}))?)?\s*$",
+    re.IGNORECASE,
+)
+
+
+def parse_reference(text: str, extra_aliases: Optional[Dict[str, int]] = None, strict: bool = False) -> Optional[BibleReference]:
+    """
+    Parse a Bible reference
+    - text: The text to parse, e.g. "John 3:16", "jn 3:16-18", "Ps 23", "Ps 23-24", "1 Cor 13", "Gen 1:1-2:3", "Jude 3"
+    - extra_aliases: Additional {normalized book name: book number} (e.g. the book names used by a version)
+    - strict: Reject the texts that may just be short queries: without a verse ("is 53:5"), the book name must have at
+      least MIN_PREFIX_LENGTH letters ("Isa 53", "Psalm 23"), so "is 53", "la 1" or "ho 3" are not references
+
+    Returns the BibleReference, or None when the text is not shaped like a reference
+    """
+    match = reference_pattern.match(text)
+    if not match:
+        return None
+    name = normalize_book_name(match.group("book"))
+    book = book_aliases.get(name) or (extra_aliases or {}).get(name)
+    if book is None:
+        return None
+    if strict and not match.group("verse") and len(name.lstrip("123")) < MIN_PREFIX_LENGTH:
+        return None
+
+    chapter = int(match.group("chapter"))
+    verse = int(match.group("verse")) if match.group("verse") else None
+    end = int(match.group("end")) if match.group("end") else None
+    end_verse = int(match.group("end_verse")) if match.group("end_verse") else None
+
+    if book in SINGLE_CHAPTER_BOOKS and verse is None and end_verse is None and (chapter > 1 or end is not None):
+        # "Jude 3" / "Jude 3-5": the numbers are verses of the only chapter
+        return BibleReference(book=book, chapter=1, verse=chapter, end_chapter=1, end_verse=end if end is not None else chapter)
+    if end is None:
+        return BibleReference(book=book, chapter=chapter, verse=verse, end_chapter=chapter, end_verse=verse)
+    if end_verse is not None:
+        return BibleReference(book=book, chapter=chapter, verse=verse, end_chapter=end, end_verse=end_verse)  # "Gen 1:1-2:3"
+    if verse is not None:
+        return BibleReference(book=book, chapter=chapter, verse=verse, end_chapter=chapter, end_verse=end)  # "John 3:16-18"
+    return BibleReference(book=book, chapter=chapter, end_chapter=end)  # "Ps 23-24"
@@ -0,0 +1,90 @@
+"""
+Type: Shared module
+Description: This module shares the loaded Bible indexes between the worker processes of one machine.
+
+A loader process (see app/serve.py) publishes each version once: its arrays (compact embeddings, verse texts and
+numbers, positional, lexical and ANN indexes) as .npy files plus a small manifest.json (metadata, book names, settings),
+in a directory on shared memory (/dev/shm on Linux).
+The workers attach to it with np.load(mmap_mode="r"), the same way compiled versions are memory-mapped: every worker
+reads the same physical pages, so adding workers adds throughput without multiplying the memory of the indexes.
+
+Layout: {root}/{version}-{fingerprint hash}/manifest.json + {array name}.npy. A published directory is only valid for
+the data files it was built from, so a version updated on disk is never served from an old publication.
+"""
+from typing import Any, Dict, Optional, Tuple
+import hashlib, json, os, shutil, tempfile
+import numpy as np
+
+"""
+======================================================= CONFIG =======================================================
+"""
+# Where the workers look for published versions ("" = disabled, every worker loads its own copy); set by app/serve.py
+SHARED_INDEX_DIR = os.environ.get("BIBLE_SHARED_INDEX_DIR", "")
+DEFAULT_SHARED_INDEX_DIR = "/dev/shm/bible-explorer" if os.path.isdir("/dev/shm") else os.path.join(tempfile.gettempdir(), "bible-explorer")
+
+MANIFEST_FILE = "manifest.json"
+
+
+"""
+======================================================= SHARED INDEXES =======================================================
+"""
+def get_shared_index_path(root: str, version: str, fingerprint: Tuple) -> str:
+    """
+    Get the directory of a published version
+    - root: The shared index directory
+    - version: The Bible version
+    - fingerprint: The fingerprint of the version's data files (see shared.bible.get_bible_fingerprint)
+
+    Returns the path of the version's directory (it may not exist)
+    """
+    digest = hashlib.blake2b(json.dumps(fingerprint).encode(), digest_size=8).hexdigest()
+    return os.path.join(root, f"{version}-{digest}")
+
+
+def publish_shared_index(path: str, manifest: Dict[str, Any], arrays: Dict[str, np.ndarray]) -> str:
+    """
+    Publish a version's arrays and manifest (written to a temporary directory first, then renamed into place,
+    so a worker never attaches to a half-written version)
+    - path: The directory to publish to (see get_shared_index_path)
+    - manifest: The JSON part of the index (metadata, book names, ...)
+    - arrays: The arrays of the index by name
+
+    Returns the path
+    """
+    root = os.path.dirname(path)
+    os.makedirs(root, exist_ok=True)
+    staging = tempfile.mkdtemp(dir=root, prefix=".publishing-")
+    try:
+        for name, array in arrays.items():
+            np.save(os.path.join(staging, f"{name}.npy"), np.ascontiguousarray(array))
+        with open(os.path.join(staging, MANIFEST_FILE), "w") as file:
+            json.dump({**manifest, "arrays": list(arrays)}, file)
+        os.rename(staging, path)
+    except OSError:
+        shutil.rmtree(staging, ignore_errors=True)
+        if not os.path.isdir(path):  # Another loader publishing the same version at the same time is fine
+            raise
+    return path
+
+
+def attach_shared_index(path: str) -> Optional[Tuple[Dict[str, Any], Dict[str, np.ndarray]]]:
+    """
+    Attach to a published version
+    - path: The directory of the version (see get_shared_index_path)
+
+    Returns (manifest, read-only memory-mapped arrays by name), or None when the version is not published
+    """
+    manifest_path = os.path.join(path, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, "r") as file:
+        manifest = json.load(file)
+    arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in manifest["arrays"]}
+    return manifest, arrays
+
+
+def remove_shared_index(path: str) -> None:
+    """
+    Remove a published version (workers that already attached keep their mappings until they drop the version)
+    """
+    shutil.rmtree(path, ignore_errors=True)
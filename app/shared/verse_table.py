@@ -0,0 +1,197 @@
+"""
+Type: Shared module
+Description: This module contains the columnar storage of the verse records of a Bible version (see shared.bible.BibleIndex).
+
+A version's verses are kept as a few flat arrays instead of one dict per verse: the book, chapter and verse numbers,
+and the UTF-8 texts concatenated into one byte array with their offsets. The arrays hold the same data in a fraction
+of the memory of the dicts, and they can be memory-mapped, so the worker processes attached to a shared index
+(see shared.shared_index) read the same physical pages instead of each rebuilding the records in its own heap.
+
+The positional index (reference -> row, chapter -> rows) is built on the same arrays, as sorted keys looked up
+with a binary search.
+"""
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import numpy as np
+
+"""
+======================================================= VERSE TABLE =======================================================
+"""
+class TextColumn:
+    """
+    Read-only sequence of the verse texts of a VerseTable (decoded on access, e.g. for shared.lexical.BM25Index)
+    """
+    def __init__(self, table: "VerseTable"):
+        self.table = table
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def __getitem__(self, row: int) -> str:
+        return self.table.text(row)
+
+    def __iter__(self) -> Iterator[str]:
+        return (self.table.text(row) for row in range(len(self.table)))
+
+
+class VerseTable:
+    """
+    Columnar verse records of a Bible version (row i = verse i in file order)
+    - books, chapters, verse_numbers: The book, chapter and verse number of each verse
+    - text_offsets: The text of verse i is text_data[text_offsets[i]:text_offsets[i + 1]] [n_verses + 1]
+    - text_data: The UTF-8 encoded texts, concatenated
+    - book_names: The version's name of each book number
+
+    table[row] returns the verse record as a dict ({"book_name", "book", "chapter", "verse", "text"}), like the
+    records of the Bible files.
+
+    Example usage:
+    table = VerseTable.from_records(bible["verses"])
+    table[0]["text"], table.text(0), table.arrays()  # The arrays to publish or save
+    """
+    ARRAYS = ["books", "chapters", "verse_numbers", "text_offsets", "text_data"]
+
+    def __init__(self, books: np.ndarray, chapters: np.ndarray, verse_numbers: np.ndarray, text_offsets: np.ndarray, text_data: np.ndarray, book_names: Dict[int, str]):
+        self.books = books
+        self.chapters = chapters
+        self.verse_numbers = verse_numbers
+        self.text_offsets = text_offsets
+        self.text_data = text_data
+        self.book_names = book_names
+
+    @classmethod
+    def from_records(cls, verses: List[Dict[str, Any]]) -> "VerseTable":
+        """
+        Build a table from verse records ({"book_name", "book", "chapter", "verse", "text", ...}, other keys are dropped)
+        """
+        texts = [verse["text"].encode("utf-8") for verse in verses]
+        lengths = np.fromiter((len(text) for text in texts), dtype=np.int64, count=len(texts))
+        return cls(
+            books=np.fromiter((verse["book"] for verse in verses), dtype=np.int16, count=len(verses)),
+            chapters=np.fromiter((verse["chapter"] for verse in verses), dtype=np.int16, count=len(verses)),
+            verse_numbers=np.fromiter((verse["verse"] for verse in verses), dtype=np.int16, count=len(verses)),
+            text_offsets=np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64),
+            text_data=np.frombuffer(b"".join(texts), dtype=np.uint8),
+            book_names={verse["book"]: verse["book_name"] for verse in verses},
+        )
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], book_names: Dict[Any, str]) -> "VerseTable":
+        """
+        Rebuild a table from its arrays (e.g. memory-mapped from a shared index) and book names (keys may be strings, from JSON)
+        """
+        return cls(*(arrays[name] for name in cls.ARRAYS), {int(book): name for book, name in book_names.items()})
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        """
+        Returns the arrays of the table by name (see from_arrays)
+        """
+        return {name: getattr(self, name) for name in self.ARRAYS}
+
+    def __len__(self) -> int:
+        return len(self.books)
+
+    def text(self, row: int) -> str:
+        """
+        Get the text of a verse
+        """
+        return self.text_data[self.text_offsets[row]:self.text_offsets[row + 1]].tobytes().decode("utf-8")
+
+    @property
+    def texts(self) -> TextColumn:
+        return TextColumn(self)
+
+    def __getitem__(self, row: int) -> Dict[str, Any]:
+        book = int(self.books[row])
+        return {
+            "book_name": self.book_names[book],
+            "book": book,
+            "chapter": int(self.chapters[row]),
+            "verse": int(self.verse_numbers[row]),
+            "text": self.text(row),
+        }
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return (self[row] for row in range(len(self)))
+
+
+"""
+======================================================= POSITIONAL INDEX =======================================================
+"""
+# Keys of the positional index: book * CHAPTER_KEY + chapter, and (book * CHAPTER_KEY + chapter) * VERSE_KEY + verse
+CHAPTER_KEY = 1_000
+VERSE_KEY = 1_000
+
+
+def get_chapter_key(book: int, chapter: int) -> int:
+    return book * CHAPTER_KEY + chapter
+
+
+def get_verse_key(book: int, chapter: int, verse: int) -> int:
+    return get_chapter_key(book, chapter) * VERSE_KEY + verse
+
+
+class PositionalIndex:
+    """
+    Lookups of the rows of a VerseTable by reference
+    - verse_keys: The sorted verse keys (see get_verse_key), verse_rows: the row of each of them
+    - chapter_keys: The sorted chapter keys (see get_chapter_key), chapter_bounds: (first row, last row + 1) of each chapter
+
+    Example usage:
+    positions = PositionalIndex.build(table)
+    positions.get_row(43, 3, 16), positions.get_chapter(43, 3)
+    """
+    ARRAYS = ["verse_keys", "verse_rows", "chapter_keys", "chapter_bounds"]
+
+    def __init__(self, verse_keys: np.ndarray, verse_rows: np.ndarray, chapter_keys: np.ndarray, chapter_bounds: np.ndarray):
+        self.verse_keys = verse_keys
+        self.verse_rows = verse_rows
+        self.chapter_keys = chapter_keys
+        self.chapter_bounds = chapter_bounds
+
+    @classmethod
+    def build(cls, table: VerseTable) -> "PositionalIndex":
+        """
+        Build the positional index of a table (a verse that appears twice resolves to its last row, a chapter spans
+        from its first to its last row)
+        """
+        rows = np.arange(len(table), dtype=np.int64)
+        chapter_keys = table.books.astype(np.int64) * CHAPTER_KEY + table.chapters
+        verse_keys = chapter_keys * VERSE_KEY + table.verse_numbers
+
+        # Stable sort, then keep the last row of each key
+        order = np.argsort(verse_keys, kind="stable")
+        last = np.append(verse_keys[order][1:] != verse_keys[order][:-1], True) if len(table) else np.zeros(0, dtype=bool)
+        unique_chapters, first = np.unique(chapter_keys, return_index=True)
+        _, last_from_end = np.unique(chapter_keys[::-1], return_index=True)
+        bounds = np.stack([first, len(table) - last_from_end], axis=1).astype(np.int64)
+        return cls(verse_keys[order][last], rows[order][last], unique_chapters.astype(np.int64), bounds)
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray]) -> "PositionalIndex":
+        return cls(*(arrays[name] for name in cls.ARRAYS))
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {name: getattr(self, name) for name in self.ARRAYS}
+
+    def __len__(self) -> int:
+        return len(self.verse_keys)
+
+    def get_row(self, book: int, chapter: int, verse: int) -> Optional[int]:
+        """
+        Returns the row of a verse or None if the table doesn't have it
+        """
+        key = get_verse_key(book, chapter, verse)
+        i = int(np.searchsorted(self.verse_keys, key))
+        if i < len(self.verse_keys) and self.verse_keys[i] == key:
+            return int(self.verse_rows[i])
+        return None
+
+    def get_chapter(self, book: int, chapter: int) -> Optional[Tuple[int, int]]:
+        """
+        Returns (first row, last row + 1) of a chapter or None if the table doesn't have it
+        """
+        key = get_chapter_key(book, chapter)
+        i = int(np.searchsorted(self.chapter_keys, key))
+        if i < len(self.chapter_keys) and self.chapter_keys[i] == key:
+            return int(self.chapter_bounds[i, 0]), int(self.chapter_bounds[i, 1])
+        return None
@@ -0,0 +1,205 @@
+"""
+Type: Shared module
+Description: This module contains the memory-budgeted store of the loaded Bible versions (see shared.bible.version_store).
+
+Each loaded version is accounted by its resident size. When the total goes over the budget, the least recently used
+versions are evicted (pinned versions never are), so the memory of a worker stays predictable no matter how many
+versions get requested. Concurrent requests for a version that is not loaded yet share a single load.
+"""
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+import threading, time
+
+"""
+======================================================= STORE =======================================================
+"""
+class VersionStore:
+    """
+    Thread-safe store of loaded versions with a memory budget
+    - loader: Loads a version (never called twice at the same time for the same version)
+    - sizeof: Returns the resident size in bytes of a loaded version
+    - max_bytes: The memory budget (None = no budget, nothing is ever evicted)
+    - pinned: The versions that are never evicted
+    - on_evict: Called with (version, value) after a version was evicted or removed
+
+    Example usage:
+    store = VersionStore(loader=read_bible_index, sizeof=lambda index: index.memory["resident"], max_bytes=1024 ** 3, pinned=["kjv"])
+    index = store.get("kjv") or store.load("kjv")
+    """
+    def __init__(self, loader: Callable[[Hashable], Any], sizeof: Callable[[Any], int], max_bytes: Optional[int] = None, pinned: Iterable[Hashable] = (), on_evict: Optional[Callable[[Hashable, Any], None]] = None):
+        self.loader = loader
+        self.sizeof = sizeof
+        self.max_bytes = max_bytes
+        self.pinned = set(pinned)
+        self.on_evict = on_evict
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.loads = 0
+        self.load_seconds = 0.0
+        self.bytes = 0
+        self._entries: "OrderedDict[Hashable, Tuple[Any, int]]" = OrderedDict()  # version -> (value, size), least recently used first
+        self._loading: Dict[Hashable, Future] = {}  # version -> the load in progress
+        self._lock = threading.Lock()
+
+    def get(self, version: Hashable) -> Optional[Any]:
+        """
+        Get a loaded version (and mark it as recently used), without loading it
+
+        Returns the loaded value or None when the version is not loaded
+        """
+        with self._lock:
+            entry = self._entries.get(version)
+            if entry is None:
+                return None
+            self._entries.move_to_end(version)
+            self.hits += 1
+            return entry[0]
+
+    def load(self, version: Hashable) -> Any:
+        """
+        Get a version, loading it on first use (blocking: call it from a worker thread in async code)
+
+        When the version is already being loaded by another thread, waits for that load instead of starting a second one.
+        Loading a version may evict the least recently used unpinned versions to get back under the budget.
+
+        Returns the loaded value (the loader's exception is raised to every waiting caller)
+        """
+        with self._lock:
+            entry = self._entries.get(version)
+            if entry is not None:
+                self._entries.move_to_end(version)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            future = self._loading.get(version)
+            owner = future is None
+            if owner:
+                future = self._loading[version] = Future()
+        if not owner:
+            return future.result()
+
+        start = time.perf_counter()
+        try:
+            value = self.loader(version)
+            size = self.sizeof(value)
+        except BaseException as e:
+            with self._lock:
+                del self._loading[version]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._loading[version]
+            self._entries[version] = (value, size)
+            self.bytes += size
+            self.loads += 1
+            self.load_seconds += time.perf_counter() - start
+            evicted = self._evict(keep=version)
+        future.set_result(value)
+        self._notify_evicted(evicted)
+        return value
+
+    def _evict(self, keep: Hashable) -> List[Tuple[Hashable, Any]]:
+        """
+        Evict the least recently used unpinned versions until the store is under its budget (call with the lock held)
+        - keep: The version that was just loaded (never evicted, even when it is over the budget on its own)
+
+        Returns the evicted (version, value) pairs
+        """
+        evicted = []
+        if self.max_bytes is None:
+            return evicted
+        candidates = [version for version in self._entries if version not in self.pinned and version != keep]
+        for version in candidates:
+            if self.bytes <= self.max_bytes:
+                break
+            value, size = self._entries.pop(version)
+            self.bytes -= size
+            self.evictions += 1
+            evicted.append((version, value))
+        if self.bytes > self.max_bytes:
+            print(f"Bible versions use {self.bytes / 2**20:.0f} MB, over the {self.max_bytes / 2**20:.0f} MB budget (pinned: {sorted(self.pinned)})")
+        return evicted
+
+    def _notify_evicted(self, evicted: List[Tuple[Hashable, Any]]) -> None:
+        for version, value in evicted:
+            print(f"Evicted Bible version: {version}")
+            if self.on_evict is not None:
+                self.on_evict(version, value)
+
+    def pop(self, version: Hashable) -> Optional[Any]:
+        """
+        Remove a version (it is loaded again on next use)
+
+        Returns the removed value or None when the version was not loaded
+        """
+        with self._lock:
+            entry = self._entries.pop(version, None)
+            if entry is None:
+                return None
+            self.bytes -= entry[1]
+        if self.on_evict is not None:
+            self.on_evict(version, entry[0])
+        return entry[0]
+
+    def clear(self) -> None:
+        """
+        Remove every version
+        """
+        with self._lock:
+            entries = list(self._entries.items())
+            self._entries.clear()
+            self.bytes = 0
+        if self.on_evict is not None:
+            for version, (value, _) in entries:
+                self.on_evict(version, value)
+
+    def pin(self, version: Hashable) -> None:
+        """
+        Never evict a version (it is not loaded by pinning it)
+        """
+        with self._lock:
+            self.pinned.add(version)
+
+    def unpin(self, version: Hashable) -> None:
+        """
+        Let a version be evicted again
+        """
+        with self._lock:
+            self.pinned.discard(version)
+
+    def items(self) -> List[Tuple[Hashable, Any]]:
+        """
+        Get the loaded (version, value) pairs, least recently used first
+        """
+        with self._lock:
+            return [(version, value) for version, (value, _) in self._entries.items()]
+
+    def __contains__(self, version: Hashable) -> bool:
+        return version in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the store statistics
+
+        Returns {"items", "bytes", "max_bytes", "hits", "misses", "evictions", "loads", "load_seconds", "loading", "pinned", "versions"}
+        ("versions" is the resident size of each loaded version, least recently used first)
+        """
+        with self._lock:
+            return {
+                "items": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "loads": self.loads,
+                "load_seconds": self.load_seconds,
+                "loading": list(self._loading),
+                "pinned": sorted(self.pinned),
+                "versions": {version: size for version, (_, size) in self._entries.items()},
+            }
@@ -0,0 +1,117 @@
+"""
+Type: Shared module
+Description: This module preloads Bible versions and compiles the numba kernels when a worker starts.
+
+The app's lifespan hook starts the warm-up in a background thread, so the worker can answer the readiness probe
+(/api/health/ready) with 503 until every configured version is loaded and every kernel is compiled.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+import os, threading, time
+import numpy as np
+
+from shared import bible
+from shared import kernels as kernels_module
+
+"""
+======================================================= CONFIG =======================================================
+"""
+# Comma separated list of the versions to load at startup ("*" = every available version, "" = none)
+PRELOAD_VERSIONS = os.environ.get("BIBLE_PRELOAD_VERSIONS", "kjv")
+PRELOAD_MAX_WORKERS = int(os.environ.get("BIBLE_PRELOAD_WORKERS", "4"))
+
+
+"""
+======================================================= WARM-UP =======================================================
+"""
+class WarmupState:
+    """
+    Progress of the startup warm-up (reported by the readiness endpoint)
+
+    The lists and the errors are written from the warm-up pool threads: update and read them with _lock held.
+    """
+    def __init__(self):
+        self.started_at = None
+        self.finished_at = None
+        self.loaded_versions: List[str] = []
+        self.compiled_kernels: List[str] = []
+        self.errors: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self.finished_at is not None
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "ready": self.ready,
+                "loaded_versions": list(self.loaded_versions),
+                "compiled_kernels": list(self.compiled_kernels),
+                "errors": dict(self.errors),
+                "warmup_seconds": (self.finished_at or time.time()) - self.started_at if self.started_at else None,
+            }
+
+
+warmup_state = WarmupState()
+
+
+def get_preload_versions() -> List[str]:
+    """
+    Get the versions listed in BIBLE_PRELOAD_VERSIONS
+
+    Returns a list of Bible versions
+    """
+    if PRELOAD_VERSIONS.strip() == "*":
+        return bible.get_bible_versions()
+    return [version.strip() for version in PRELOAD_VERSIONS.split(",") if version.strip()]
+
+
+def warm_up(versions: List[str] = None, max_workers: int = PRELOAD_MAX_WORKERS) -> WarmupState:
+    """
+    Load the Bible versions (in parallel) and compile the kernels
+    - versions: The versions to load (default: BIBLE_PRELOAD_VERSIONS)
+    - max_workers: The number of versions loaded at the same time
+
+    Returns the warm-up state (errors are recorded per version instead of raised)
+    """
+    versions = get_preload_versions() if versions is None else versions
+    warmup_state.started_at = time.time()
+
+    def load(version: str) -> None:
+        try:
+            index = bible.load_bible_index(version)
+            index.search(np.ones(index.embeddings.shape[1], dtype=np.float32), 1)  # Touch the search path once
+            with warmup_state._lock:
+                warmup_state.loaded_versions.append(version)
+        except Exception as e:
+            print(f"Failed to preload Bible version {version}: {e}")
+            with warmup_state._lock:
+                warmup_state.errors[version] = str(e)
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        kernels = executor.submit(kernels_module.compile_kernels)
+        list(executor.map(load, versions))
+        try:
+            compiled_kernels = kernels.result()
+            with warmup_state._lock:
+                warmup_state.compiled_kernels = compiled_kernels
+        except Exception as e:
+            print(f"Failed to compile kernels: {e}")
+            with warmup_state._lock:
+                warmup_state.errors["kernels"] = str(e)
+
+    warmup_state.finished_at = time.time()
+    print(f"Warm-up finished in {warmup_state.finished_at - warmup_state.started_at:.2f}s: {warmup_state.to_dict()}")
+    return warmup_state
+
+
+def start_warm_up() -> threading.Thread:
+    """
+    Run warm_up in a background thread
+
+    Returns the thread
+    """
+    thread = threading.Thread(target=warm_up, name="warm-up", daemon=True)
+    thread.start()
+    return thread
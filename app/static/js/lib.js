@@ -133,9 +133,12 @@ const getRandomAiModel = (tier='high') => {
     return nextModel;
 }
 
-async function runAIChat(systemPrompt, chatHistory, model='gpt-4o-mini') {
+// onToken (optional): called with the output so far every time a new chunk streams in
+async function runAIChat(systemPrompt, chatHistory, model='gpt-4o-mini', onToken=null) {
     const _chatHistory = [{role: 'system', content: systemPrompt}, ...chatHistory];
-    const response = await fetch('/api/ai/chat?model=' + model, {
+    const streaming = typeof onToken === 'function';
+    const urlParams = new URLSearchParams({ model: model, stream: streaming ? 'true' : 'false' });
+    const response = await fetch(`/api/ai/chat?${urlParams.toString()}`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify(_chatHistory),
@@ -145,7 +148,48 @@ async function runAIChat(systemPrompt, chatHistory, model='gpt-4o-mini') {
         return { output: 'Failed to communicate with AI.' };
     }
 
-    return response.json();
+    if (!streaming) {
+        return response.json();
+    }
+
+    // Read the server-sent events: {content} chunks, then a "done" event with the full response
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let output = '';
+    let result = null;
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const rawEvent = buffer.substring(0, boundary);
+            buffer = buffer.substring(boundary + 2);
+
+            let event = 'message';
+            let data = '';
+            for (const line of rawEvent.split('\n')) {
+                if (line.startsWith('event:')) event = line.substring(6).trim();
+                else if (line.startsWith('data:')) data += line.substring(5).trim();
+            }
+            const payload = parseJson(data);
+            if (!payload) continue;
+
+            if (event === 'done') {
+                result = payload;
+            } else if (event === 'error') {
+                console.debug('AI stream failed:', payload.error);
+                result = { output: output || 'Failed to communicate with AI.' };
+            } else {
+                output += payload.content;
+                onToken(output);
+            }
+        }
+    }
+
+    return result || { output: output || 'Failed to communicate with AI.' };
 }
 
 // ============================================================================================
@@ -82,9 +82,14 @@ function runChat() {
 
     // Send user input to AI
     chatState.chatLoading = true;
-    runAIChat(chatState.systemPrompt, chatState.chatHistory, 'llama-3.2-90b-text-preview').then(data => {
-        // Update chat history with AI response
-        chatState.chatHistory.push({ content: data.output, role: 'assistant' });
+    const chatHistory = [...chatState.chatHistory];
+    runAIChat(chatState.systemPrompt, chatHistory, 'llama-3.2-90b-text-preview', (output) => {
+        // Show the AI response as it streams in
+        chatState.chatHistory = [...chatHistory, { content: output, role: 'assistant' }];
+        document.getElementById('chat-history').scrollTop = document.getElementById('chat-history').scrollHeight;
+    }).then(data => {
+        // Update chat history with the final AI response
+        chatState.chatHistory = [...chatHistory, { content: data.output, role: 'assistant' }];
     }).finally(() => {
         // Update chat loading chatState
         chatState.chatLoading = false;
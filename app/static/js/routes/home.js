@@ -129,7 +129,8 @@ async function runBibleSearch() {
             **Response:**
             Return your response in markdown format. Utulize markdown lists and bold text to highlight key points. Refrain from any H1-H3's since the response will be displayed in a card format.`,
         [{ role: 'user', content: `**Verses found (may or may not be relevent):** ${JSON.stringify(homeState.getSearchResultsContext())}\n\n**User query:** "${homeState.query}"`}],
-        getRandomAiModel()
+        getRandomAiModel(),
+        (output) => { homeState.aiResponse = { output: output }; } // Show the summary as it streams in
     );
     // Hide the alert
     homeState.loading = false;